@@ -0,0 +1,164 @@
+import logging
+import os
+import re
+import time
+
+from helpers import get_next_id
+from news_record import NewsRecord
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PENDING = 200
+DEFAULT_PENDING_TTL = 24 * 3600
+DEFAULT_OVERFLOW_POLICY = "drop_oldest"
+OVERFLOW_POLICIES = ("drop_oldest", "pause_ingest", "summarise")
+
+MODERATION_IDLE_AFTER = 3600
+SUMMARY_BATCH = 10
+SUMMARY_LINE_LENGTH = 200
+ORPHAN_IMAGE_AGE = 2 * 24 * 3600
+
+
+def pending_limits(linkage):
+    """
+    Лимиты очереди pending_news связки:
+    max_pending (штук), pending_ttl (секунд) и overflow_policy
+    (drop_oldest | pause_ingest | summarise).
+    """
+    policy = linkage.get("overflow_policy", DEFAULT_OVERFLOW_POLICY)
+    if policy not in OVERFLOW_POLICIES:
+        logger.warning(f"Неизвестная overflow_policy '{policy}', используется {DEFAULT_OVERFLOW_POLICY}.")
+        policy = DEFAULT_OVERFLOW_POLICY
+    return (
+        int(linkage.get("max_pending", DEFAULT_MAX_PENDING)),
+        float(linkage.get("pending_ttl", DEFAULT_PENDING_TTL)),
+        policy,
+    )
+
+
+def summarise(items):
+    """Сворачивает несколько новостей в одну новость-сводку из их первых предложений."""
+    lines = []
+    for news in items:
+        first_sentence = re.split(r"(?<=[.!?])\s", news.get("txt") or "", maxsplit=1)[0]
+        lines.append(f"• {first_sentence[:SUMMARY_LINE_LENGTH]}")
+    return {
+        "id": get_next_id(),
+        "type": "summary",
+        "txt": "\n".join(lines)[:1024],
+        "img": None,
+        "src": "summary",
+        "src_name": f"Сводка {len(items)} новостей",
+        "queued_at": time.time(),
+    }
+
+
+def admit_pending(linkage, news):
+    """
+    Добавляет новость в pending_news с учётом лимита связки.
+
+    Возвращает (admitted, evicted, summary):
+        admitted — новость добавлена (False при pause_ingest и полной очереди);
+        evicted  — вытесненные новости (их изображения нужно удалить);
+        summary  — новость-сводка при политике summarise (её нужно отправить на модерацию).
+
+    pending_news хранится в resources.json, поэтому NewsRecord попадает туда словарём.
+    """
+    max_pending, _, policy = pending_limits(linkage)
+    pending_news = linkage.setdefault("pending_news", [])
+    news.setdefault("queued_at", time.time())
+    if isinstance(news, NewsRecord):
+        news = news.to_dict()
+    evicted, summary = [], None
+
+    if len(pending_news) >= max_pending:
+        if policy == "pause_ingest":
+            return False, evicted, summary
+
+        overflow = len(pending_news) - max_pending + 1
+        if policy == "summarise":
+            batch = max(overflow, min(SUMMARY_BATCH, len(pending_news)))
+            evicted = _pop_oldest(linkage, batch)
+            summary = summarise(evicted)
+            linkage["pending_news"].append(summary)
+        else:
+            evicted = _pop_oldest(linkage, overflow)
+
+    linkage["pending_news"].append(news)
+    return True, evicted, summary
+
+
+def _pop_oldest(linkage, count):
+    pending_news = linkage.get("pending_news", [])
+    candidates = sorted((n for n in pending_news if n.get("type") != "summary"),
+                        key=lambda n: n.get("queued_at", 0))[:count]
+    removed_ids = {n["id"] for n in candidates}
+    linkage["pending_news"] = [n for n in pending_news if n["id"] not in removed_ids]
+    _prune_digests(linkage)
+    return candidates
+
+
+def expire_pending(linkage, now=None):
+    """Удаляет из pending_news новости старше pending_ttl. Возвращает удалённые."""
+    _, ttl, _ = pending_limits(linkage)
+    now = now or time.time()
+    pending_news = linkage.get("pending_news", [])
+    expired = [n for n in pending_news if now - n.get("queued_at", now) > ttl]
+    if expired:
+        expired_ids = {n["id"] for n in expired}
+        linkage["pending_news"] = [n for n in pending_news if n["id"] not in expired_ids]
+        _prune_digests(linkage)
+    return expired
+
+
+def _prune_digests(linkage):
+    """Убирает из дайджестов новости, которых больше нет в pending_news, и пустые дайджесты."""
+    digests = linkage.get("digests")
+    if not digests:
+        return
+    pending_ids = {n["id"] for n in linkage.get("pending_news", [])}
+    for digest_id in list(digests):
+        digest = digests[digest_id]
+        digest["items"] = [news_id for news_id in digest["items"] if news_id in pending_ids]
+        digest["selected"] = [news_id for news_id in digest.get("selected", []) if news_id in pending_ids]
+        if not digest["items"]:
+            del digests[digest_id]
+
+
+def is_ingest_paused(linkage, queued=0, now=None):
+    """
+    Нужно ли приостановить сбор новостей для связки.
+
+    queued — новости связки, уже стоящие в очереди moderation.
+    Сбор останавливается, если очередь заполнена и политика pause_ingest,
+    либо если очередь заполнена и модераторы не нажимали кнопки дольше
+    MODERATION_IDLE_AFTER секунд — новости всё равно некому смотреть.
+    """
+    max_pending, _, policy = pending_limits(linkage)
+    depth = len(linkage.get("pending_news", [])) + queued
+    if depth < max_pending:
+        return False
+    if policy == "pause_ingest":
+        return True
+    now = now or time.time()
+    last_moderated_at = linkage.get("last_moderated_at", 0)
+    return now - last_moderated_at > MODERATION_IDLE_AFTER
+
+
+def find_orphan_images(folder, referenced, max_age=ORPHAN_IMAGE_AGE, now=None):
+    """
+    Изображения в папке старше max_age, не входящие в referenced — пути,
+    на которые ещё ссылаются новости модерации, задачи очередей и индекс изображений.
+    """
+    if not os.path.isdir(folder):
+        return []
+    now = now or time.time()
+    referenced = {os.path.normpath(path) for path in referenced if path}
+    orphans = []
+    for name in os.listdir(folder):
+        path = os.path.normpath(os.path.join(folder, name))
+        if path in referenced or not os.path.isfile(path):
+            continue
+        if now - os.path.getmtime(path) > max_age:
+            orphans.append(path)
+    return orphans
@@ -0,0 +1,92 @@
+"""
+Локальная замена openai для бенчмарка. ChatCompletion.acreate возвращает
+текст пользовательского сообщения после настраиваемой задержки и может
+выбрасывать ошибки с заданной вероятностью. С stream=True текст отдаётся
+фрагментами (как потоковый ответ). На запрос с несколькими пронумерованными
+задачами отвечает JSON {"outputs": [...]}.
+"""
+import asyncio
+import json
+import random
+import re
+import sys
+import types
+
+
+class OpenAIError(Exception):
+    pass
+
+
+class InvalidRequestError(OpenAIError):
+    pass
+
+
+class RateLimitError(OpenAIError):
+    pass
+
+
+class FakeOpenAIBackend:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.prompt_chars = 0
+        self.completion_chunks = 0
+
+
+class ChatCompletion:
+    backend = None
+
+    @classmethod
+    async def acreate(cls, model=None, messages=None, stream=False, **kwargs):
+        backend = cls.backend
+        backend.calls += 1
+        backend.prompt_chars += sum(len(m["content"]) for m in messages or [])
+        if backend.latency:
+            await asyncio.sleep(backend.latency)
+        if backend.error_rate and backend.random.random() < backend.error_rate:
+            backend.errors += 1
+            raise RateLimitError("Injected OpenAI error")
+
+        content = messages[-1]["content"] if messages else ""
+        tasks = re.findall(r"^\d+\. ", content.split("\n\nSource text:")[0], re.M)
+        if len(tasks) > 1:
+            # Запрос с несколькими промптами: по одному результату на задачу.
+            source = content.split("Source text:\n\n", 1)[-1]
+            content = json.dumps({"outputs": [f"{number}: {source}" for number in range(1, len(tasks) + 1)]},
+                                 ensure_ascii=False)
+        if stream:
+            return cls._stream(content)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(content) // 4, "completion_tokens": len(content) // 4},
+        }
+
+
+    @classmethod
+    async def _stream(cls, content, chunk_size=16):
+        for start in range(0, len(content), chunk_size):
+            cls.backend.completion_chunks += 1
+            await asyncio.sleep(0)
+            yield {"choices": [{"delta": {"content": content[start:start + chunk_size]}, "finish_reason": None}]}
+
+
+def install(backend):
+    """Подменяет модуль openai в sys.modules локальной реализацией."""
+    ChatCompletion.backend = backend
+
+    openai = types.ModuleType("openai")
+    openai.api_key = None
+    openai.ChatCompletion = ChatCompletion
+
+    error = types.ModuleType("openai.error")
+    error.OpenAIError = OpenAIError
+    error.InvalidRequestError = InvalidRequestError
+    error.RateLimitError = RateLimitError
+    openai.error = error
+
+    sys.modules["openai"] = openai
+    sys.modules["openai.error"] = error
+    return openai
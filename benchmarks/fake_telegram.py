@@ -0,0 +1,235 @@
+"""
+Локальная замена Telethon для бенчмарка: клиент, события и кнопки
+с настраиваемой задержкой и долей ошибок. Все отправленные сообщения
+фиксируются в FakeTelegramBackend, откуда бенчмарк забирает карточки
+модерации и публикации.
+"""
+import asyncio
+import io
+import itertools
+import os
+import random
+import sys
+import time
+import types
+
+from PIL import Image
+
+
+class FakeRPCError(Exception):
+    pass
+
+
+def story_image(size, key, fmt="PNG"):
+    """
+    Фото новости: мозаика 8x8, зависящая от key. У разных новостей разные
+    фото (иначе image_index отсеял бы их как дубли), повтор key даёт то же фото.
+    """
+    rng = random.Random(key)
+    mosaic = Image.new("L", (8, 8))
+    mosaic.putdata([rng.randrange(256) for _ in range(64)])
+    out = io.BytesIO()
+    mosaic.resize(size, Image.NEAREST).save(out, format=fmt, **({"compress_level": 1} if fmt == "PNG" else {}))
+    return out.getvalue()
+
+
+class FakeTelegramBackend:
+    def __init__(self, latency=0.0, error_rate=0.0, image_path=None, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.image_path = image_path
+        self.random = random.Random(seed)
+        self.message_ids = itertools.count(1)
+        self.channel_posts = {}
+        self.sent = []
+        self.edits = []
+        self.calls = 0
+        self.errors = 0
+        self.on_publish = None
+
+    async def rpc(self):
+        """Имитирует сетевой вызов Telegram API."""
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            raise FakeRPCError("Injected Telegram error")
+
+    def post_to_channel(self, username, text, with_photo=True, title=None):
+        """Кладёт новое сообщение в «исходный» канал для TelegramParser."""
+        message = FakeMessage(next(self.message_ids), text,
+                              photo=object() if with_photo and self.image_path else None,
+                              chat=types.SimpleNamespace(title=title or username))
+        self.channel_posts.setdefault(username, []).insert(0, message)
+        return message
+
+    def take_cards(self):
+        """Возвращает и очищает список ещё не обработанных карточек модерации."""
+        cards = [m for m in self.sent if m.buttons and not m.handled]
+        for card in cards:
+            card.handled = True
+        return cards
+
+
+class FakeMessage:
+    def __init__(self, message_id, text, photo=None, chat=None, buttons=None, peer=None, file=None):
+        self.id = message_id
+        self.text = text
+        self.message = text
+        self.photo = photo
+        self.chat = chat
+        self.buttons = buttons
+        self.peer = peer
+        self.file = file
+        self.date = time.time()
+        self.handled = False
+
+
+class FakeButton:
+    def __init__(self, text, data=None):
+        self.text = text
+        self.data = data.encode() if isinstance(data, str) else data
+
+
+class Button:
+    @staticmethod
+    def inline(text, data=None):
+        return FakeButton(text, data)
+
+    @staticmethod
+    def text(text, **kwargs):
+        return FakeButton(text)
+
+
+class _Event:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class _Events(types.ModuleType):
+    NewMessage = type("NewMessage", (_Event,), {})
+    CallbackQuery = type("CallbackQuery", (_Event,), {})
+    ChatAction = type("ChatAction", (_Event,), {})
+
+
+class TelegramClient:
+    backend = None
+
+    def __init__(self, session, api_id, api_hash, **kwargs):
+        self.session = session
+        self.handlers = []
+        self._connected = False
+
+    def start(self, *args, **kwargs):
+        self._connected = True
+        return self
+
+    def on(self, event):
+        def decorator(func):
+            self.handlers.append((event, func))
+            return func
+        return decorator
+
+    def add_event_handler(self, func, event=None):
+        self.handlers.append((event, func))
+
+    def is_connected(self):
+        return self._connected
+
+    async def connect(self):
+        self._connected = True
+
+    async def disconnect(self):
+        self._connected = False
+
+    async def is_user_authorized(self):
+        return True
+
+    async def get_me(self):
+        return types.SimpleNamespace(id=1, username="bench_bot")
+
+    async def run_until_disconnected(self):
+        while self._connected:
+            await asyncio.sleep(1)
+
+    async def get_entity(self, link):
+        await self.backend.rpc()
+        return types.SimpleNamespace(id=hash(link), link=link, admin_rights=True)
+
+    async def get_messages(self, entity, limit=1, **kwargs):
+        await self.backend.rpc()
+        return self.backend.channel_posts.get(entity, [])[:limit]
+
+    async def download_media(self, media, file=None):
+        await self.backend.rpc()
+        folder = file or "."
+        os.makedirs(folder, exist_ok=True)
+        target = os.path.join(folder, f"photo_{next(self.backend.message_ids)}.png")
+        with Image.open(self.backend.image_path) as img:
+            size = img.size
+        with open(target, "wb") as f:
+            f.write(story_image(size, id(media)))
+        return target
+
+    async def send_message(self, entity, message, buttons=None, **kwargs):
+        await self.backend.rpc()
+        return self._record(entity, message, buttons, None)
+
+    async def send_file(self, entity, file=None, caption=None, buttons=None, **kwargs):
+        await self.backend.rpc()
+        return self._record(entity, caption, buttons, file)
+
+    async def edit_message(self, entity, message=None, text=None, buttons=None, **kwargs):
+        await self.backend.rpc()
+        self.backend.edits.append((entity, message, text))
+
+    def _record(self, entity, text, buttons, file):
+        flat = [b for row in buttons for b in row] if buttons else None
+        message = FakeMessage(next(self.backend.message_ids), text, buttons=flat, peer=entity, file=file)
+        self.backend.sent.append(message)
+        if not flat and not isinstance(entity, int) and self.backend.on_publish:
+            self.backend.on_publish(message)
+        return message
+
+
+class FakeCallbackEvent:
+    """Нажатие inline-кнопки модератором."""
+
+    def __init__(self, backend, card, button):
+        self.backend = backend
+        self.card = card
+        self.data = button.data
+        self.chat_id = card.peer
+        self.sender_id = 42
+        self.message_id = card.id
+
+    async def answer(self, *args, **kwargs):
+        await self.backend.rpc()
+
+    async def edit(self, text=None, buttons=None, **kwargs):
+        await self.backend.rpc()
+        self.backend.edits.append((self.chat_id, self.message_id, text))
+
+    async def get_message(self):
+        return self.card
+
+
+def install(backend):
+    """Подменяет модуль telethon в sys.modules локальной реализацией."""
+    TelegramClient.backend = backend
+
+    telethon = types.ModuleType("telethon")
+    telethon.TelegramClient = TelegramClient
+    telethon.Button = Button
+    telethon.events = _Events("telethon.events")
+
+    errors = types.ModuleType("telethon.errors")
+    errors.RPCError = FakeRPCError
+    telethon.errors = errors
+
+    sys.modules["telethon"] = telethon
+    sys.modules["telethon.events"] = telethon.events
+    sys.modules["telethon.errors"] = errors
+    return telethon
@@ -0,0 +1,479 @@
+"""
+Офлайн-бенчмарк конвейера бота.
+
+Поднимает локальный HTTP сервер, который отдаёт записанные RSS ленты,
+HTML статей и изображения из benchmarks/recorded, подменяет Telegram и
+OpenAI локальными реализациями (fake_telegram, fake_openai) и прогоняет
+реальный путь: IngestWorker.poll_once -> очередь moderation ->
+send_to_moderation -> handle_moderation_action / process_moderation_action ->
+очередь transform -> TransformWorker -> очередь publish -> publish_news
+для N связок × M источников.
+
+Пример:
+    python benchmarks/run_benchmark.py --linkages 4 --sources 10 --rounds 5 \\
+        --tg-latency 0.02 --gpt-latency 0.3 --json-out bench.json
+
+Сравнение с сохранённым результатом (код возврата 1 при регрессии):
+    python benchmarks/run_benchmark.py --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import re
+import resource
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RECORDED_DIR = os.path.join(BENCH_DIR, "recorded")
+
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_openai  # noqa: E402
+import fake_telegram  # noqa: E402
+from metrics import metrics  # noqa: E402
+from config import CHECK_INTERVAL, MAX_POLL_INTERVAL  # noqa: E402
+from scheduler import PollScheduler  # noqa: E402
+
+MARKER_RE = re.compile(r"\[bench:([^\]]+)\]")
+FEED_DEPTH = 5
+DEAD_HOST = "http://127.0.0.1:9"
+
+
+def _template(name):
+    with open(os.path.join(RECORDED_DIR, name), "r", encoding="utf-8") as f:
+        return string.Template(f.read())
+
+
+class RecordedSite:
+    """
+    Состояние записанных «сайтов»: номер текущего раунда определяет,
+    какие элементы видны в каждой ленте.
+    """
+
+    def __init__(self, latency=0.0, image_name="photo.png", quiet_fraction=0.0, quiet_every=10):
+        self.latency = latency
+        self.image_name = image_name
+        self.quiet_every = quiet_every
+        self.quiet_stride = int(round(1 / quiet_fraction)) if quiet_fraction > 0 else 0
+        self.round = 0
+        self.base_url = None
+        self.requests = 0
+        self.feed_tpl = _template("feed.xml")
+        self.item_tpl = _template("feed_item.xml")
+        self.article_tpl = _template("article.html")
+        with open(os.path.join(RECORDED_DIR, image_name), "rb") as f:
+            self.image = f.read()
+        with Image.open(io.BytesIO(self.image)) as img:
+            self.image_size = img.size
+        self._images = {}
+        self._images_lock = threading.Lock()
+
+    def story_image(self, key):
+        """Фото конкретной новости ленты (кэшируется: записи повторяются в ленте несколько раундов)."""
+        with self._images_lock:
+            body = self._images.get(key)
+            if body is None:
+                fmt = "PNG" if self.image_name.endswith(".png") else "WEBP"
+                body = self._images[key] = fake_telegram.story_image(self.image_size, key, fmt)
+            return body
+
+    def is_quiet(self, source_key):
+        """Тихие источники публикуют только каждый quiet_every-й раунд."""
+        if not self.quiet_stride:
+            return False
+        return int(re.sub(r"\D", "", source_key) or 0) % self.quiet_stride == 0
+
+    def latest_round(self, source_key):
+        if self.is_quiet(source_key):
+            return self.round - self.round % self.quiet_every
+        return self.round
+
+    def feed(self, source_key):
+        items = []
+        latest = self.latest_round(source_key)
+        for r in range(latest, max(latest - FEED_DEPTH, 0), -1):
+            items.append(self.item_tpl.substitute(
+                headline=f"Headline {source_key} #{r}",
+                link=f"{self.base_url}/articles/{source_key}/{r}.html",
+                guid=f"{source_key}-{r}",
+                pub_date=formatdate(time.time() - (self.round - r) * 60),
+                image_url=f"{self.base_url}/images/{self.image_name}?src={source_key}&r={r}",
+            ))
+        return self.feed_tpl.substitute(title=f"Bench feed {source_key}", base_url=self.base_url,
+                                        items="\n".join(items))
+
+    def article(self, source_key, r):
+        return self.article_tpl.substitute(
+            headline=f"Headline {source_key} #{r}",
+            marker=f"[bench:{source_key}:{r}]",
+            image_url=f"{self.base_url}/images/{self.image_name}",
+        )
+
+
+def start_site(site):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            site.requests += 1
+            if site.latency:
+                time.sleep(site.latency)
+            path = self.path.split("?")[0].strip("/").split("/")
+            body, content_type = None, "text/html; charset=utf-8"
+            if len(path) == 2 and path[0] == "feeds":
+                body = site.feed(path[1].rsplit(".", 1)[0]).encode("utf-8")
+                content_type = "application/rss+xml; charset=utf-8"
+            elif len(path) == 3 and path[0] == "articles":
+                body = site.article(path[1], path[2].rsplit(".", 1)[0]).encode("utf-8")
+            elif len(path) == 2 and path[0] == "images":
+                query = self.path.partition("?")[2]
+                body = site.story_image(query) if query else site.image
+                content_type = "image/png" if site.image_name.endswith(".png") else "image/webp"
+
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    site.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def build_linkages(args, site):
+    """Формирует resources.json с N связками по M источников."""
+    linkages = {}
+    tg_every = int(round(1 / args.tg_fraction)) if args.tg_fraction > 0 else 0
+    dead_every = int(round(1 / args.dead_fraction)) if args.dead_fraction > 0 else 0
+    for i in range(args.linkages):
+        resources = []
+        for j in range(args.sources):
+            key = f"s{j}" if args.shared_sources else f"l{i}s{j}"
+            if tg_every and j % tg_every == 0:
+                resources.append({"url": f"https://t.me/bench_{key}"})
+            elif dead_every and j % dead_every == dead_every - 1:
+                resources.append({"url": f"{DEAD_HOST}/feeds/{key}.xml"})
+            else:
+                resources.append({"url": f"{site.base_url}/feeds/{key}.xml"})
+        linkages[f"bench_{i}"] = {
+            "resources": resources,
+            "moderation_bot": -1000000 - i,
+            "publication_channel": f"https://t.me/bench_pub_{i}",
+            "pending_news": [],
+            "is_active": True,
+        }
+        if args.digest:
+            linkages[f"bench_{i}"]["moderation_mode"] = "digest"
+            linkages[f"bench_{i}"]["digest_size"] = args.digest
+    return {"linkages": linkages}
+
+
+class VirtualClock:
+    """Модельное время для планировщика: каждый раунд сдвигает его на --round-seconds."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+virtual_clock = VirtualClock()
+
+
+async def run(args, main_bot, site, tg_backend, gpt_backend):
+    from rss_parser import NewsFetcher
+    from tg_parser import TelegramParser
+    from workers import IngestWorker, TransformWorker
+    from work_queue import consume, MODERATION_QUEUE, PUBLISH_QUEUE
+
+    scheduler = PollScheduler(state_file=None, min_interval=CHECK_INTERVAL, max_interval=MAX_POLL_INTERVAL,
+                              clock=virtual_clock)
+    main_bot.ingest_worker = IngestWorker(main_bot.work_queue, NewsFetcher(), TelegramParser(0, ""),
+                                          scheduler=scheduler)
+    transform_worker = TransformWorker(main_bot.work_queue)
+    emitted = {}
+    latencies = []
+    published = []
+
+    def on_publish(message):
+        match = MARKER_RE.search(message.text or "")
+        if match and match.group(1) in emitted:
+            latencies.append(time.perf_counter() - emitted[match.group(1)])
+            published.append(match.group(1))
+
+    tg_backend.on_publish = on_publish
+
+    data = build_linkages(args, site)
+    main_bot.save_linkages(data)
+    tg_channels = sorted({res["url"].split("/")[-1] for linkage in data["linkages"].values()
+                          for res in linkage["resources"] if "t.me" in res["url"]})
+    rss_keys = sorted({res["url"].split("/")[-1].rsplit(".", 1)[0] for linkage in data["linkages"].values()
+                       for res in linkage["resources"]
+                       if "t.me" not in res["url"] and not res["url"].startswith(DEAD_HOST)})
+
+    # Сколько связок получает новость каждого источника (с --shared-sources — все).
+    subscribers = Counter(res["url"].split("/")[-1].rsplit(".", 1)[0] if "t.me" not in res["url"]
+                          else res["url"].split("/")[-1]
+                          for linkage in data["linkages"].values() for res in linkage["resources"])
+
+    semaphore = asyncio.Semaphore(args.moderators)
+    cards_total = 0
+    handler_failures = 0
+
+    async def moderate(card):
+        reject = tg_backend.random.random() < args.reject_ratio
+        if card.buttons[0].data.startswith(b"dg:"):
+            decision = "dg:none" if reject else "dg:all"
+        else:
+            decision = "reject" if reject else "accept"
+        button = next(b for b in card.buttons if b.data.decode().startswith(decision))
+        nonlocal handler_failures
+        async with semaphore:
+            event = fake_telegram.FakeCallbackEvent(tg_backend, card, button)
+            try:
+                if button.data.startswith(b"dg:"):
+                    await main_bot.handle_digest_action(event)
+                else:
+                    await main_bot.handle_moderation_action(event)
+            except Exception:
+                # Внесённые ошибки Telegram (--tg-error-rate) попадают в отчёт, а не обрывают прогон.
+                handler_failures += 1
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        site.round += 1
+        virtual_clock.now += args.round_seconds
+        now = time.perf_counter()
+        for key in rss_keys:
+            if site.latest_round(key) == site.round:
+                emitted[f"{key}:{site.round}"] = now
+        for channel in tg_channels:
+            if site.latest_round(channel) != site.round:
+                continue
+            key = f"{channel}:{site.round}"
+            emitted[key] = now
+            tg_backend.post_to_channel(channel, f"[bench:{key}] Telegram breaking update #{site.round} "
+                                                f"from {channel} with enough text to pass filters.")
+
+        await main_bot.ingest_worker.poll_once()
+        await consume(main_bot.work_queue, MODERATION_QUEUE, main_bot.deliver_to_moderation, "bench",
+                      stop_when_empty=True)
+        if args.digest:
+            await main_bot.flush_digests(force=True)
+
+        cards = tg_backend.take_cards()
+        cards_total += len(cards)
+        await asyncio.gather(*(moderate(card) for card in cards))
+
+        await transform_worker.run_once()
+        await consume(main_bot.work_queue, PUBLISH_QUEUE, main_bot.deliver_publication, "bench",
+                      stop_when_empty=True)
+
+        if args.interval:
+            await asyncio.sleep(args.interval)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "linkages": args.linkages,
+        "sources": args.sources,
+        "rounds": args.rounds,
+        "elapsed_sec": elapsed,
+        "items_emitted": len(emitted),
+        "copies_expected": sum(subscribers[key.rsplit(":", 1)[0]] for key in emitted),
+        "cards": cards_total,
+        "published": len(set(published)),
+        "copies_published": len(published),
+        "handler_failures": handler_failures,
+        "items_per_sec": len(set(published)) / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p90": percentile(latencies, 0.90),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies) if latencies else 0.0,
+        "http_requests": site.requests,
+        "polls_skipped": metrics.counter_total("polls_skipped_total"),
+        "telegram_calls": tg_backend.calls,
+        "telegram_errors": tg_backend.errors,
+        "gpt_calls": gpt_backend.calls,
+        "gpt_errors": gpt_backend.errors,
+    }
+
+
+def print_report(result, stages):
+    print("\n=== Результаты бенчмарка ===")
+    print(f"Связок × источников: {result['linkages']} × {result['sources']}, раундов: {result['rounds']}")
+    print(f"Время: {result['elapsed_sec']:.2f} с, карточек: {result['cards']}, "
+          f"опубликовано: {result['published']} из {result['items_emitted']} "
+          f"(копий по связкам: {result['copies_published']} из {result['copies_expected']})")
+    if result["handler_failures"]:
+        print(f"Ошибок обработчиков модерации: {result['handler_failures']}")
+    print(f"Пропускная способность: {result['items_per_sec']:.2f} новостей/с")
+    print(f"Задержка end-to-end: p50 {result['latency_p50']:.3f} с, p90 {result['latency_p90']:.3f} с, "
+          f"p99 {result['latency_p99']:.3f} с, max {result['latency_max']:.3f} с")
+    print(f"Память: maxrss {result['maxrss_mb']:.1f} МБ"
+          + (f", пик tracemalloc {result['tracemalloc_peak_mb']:.1f} МБ" if "tracemalloc_peak_mb" in result else ""))
+    print(f"Пропущено опросов планировщиком: {result['polls_skipped']}")
+    print(f"Вызовы: HTTP {result['http_requests']}, Telegram {result['telegram_calls']} "
+          f"(ошибок {result['telegram_errors']}), GPT {result['gpt_calls']} (ошибок {result['gpt_errors']})")
+    if stages:
+        print("\nЭтапы:")
+        for stage, entry in sorted(stages.items()):
+            if entry["count"]:
+                print(f"  {stage:16} {entry['count']:6d} шт.  ср. {entry['sum'] / entry['count'] * 1000:8.1f} мс  "
+                      f"итого {entry['sum']:7.2f} с  ошибок {entry['errors']}")
+
+
+def compare_with_baseline(result, baseline_path, max_regression):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    failures = []
+    if baseline.get("items_per_sec") and result["items_per_sec"] < baseline["items_per_sec"] * (1 - max_regression):
+        failures.append(f"items_per_sec {result['items_per_sec']:.2f} < {baseline['items_per_sec']:.2f}")
+    for key in ("latency_p90", "latency_p99"):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + max_regression):
+            failures.append(f"{key} {result[key]:.3f} > {baseline[key]:.3f}")
+    if baseline.get("maxrss_mb") and result["maxrss_mb"] > baseline["maxrss_mb"] * (1 + max_regression):
+        failures.append(f"maxrss_mb {result['maxrss_mb']:.1f} > {baseline['maxrss_mb']:.1f}")
+
+    if failures:
+        print("\n❌ Регрессия относительно базовой линии:")
+        for failure in failures:
+            print(f"  • {failure}")
+        return False
+    print("\n✅ Регрессий относительно базовой линии нет.")
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера модерации новостей.")
+    parser.add_argument("--linkages", type=int, default=3, help="Количество связок (N).")
+    parser.add_argument("--sources", type=int, default=5, help="Источников в каждой связке (M).")
+    parser.add_argument("--rounds", type=int, default=3, help="Количество циклов опроса.")
+    parser.add_argument("--interval", type=float, default=0.0, help="Пауза между циклами, с.")
+    parser.add_argument("--round-seconds", type=float, default=60.0,
+                        help="Модельное время между циклами для планировщика опроса, с.")
+    parser.add_argument("--quiet-fraction", type=float, default=0.0,
+                        help="Доля тихих источников, публикующих раз в 10 раундов.")
+    parser.add_argument("--shared-sources", action="store_true",
+                        help="Все связки подписаны на одни и те же источники.")
+    parser.add_argument("--tg-fraction", type=float, default=0.2, help="Доля Telegram-источников.")
+    parser.add_argument("--dead-fraction", type=float, default=0.0,
+                        help="Доля RSS-источников на недоступном хосте.")
+    parser.add_argument("--moderators", type=int, default=1, help="Параллельных нажатий кнопок модерации.")
+    parser.add_argument("--digest", type=int, default=0,
+                        help="Режим дайджеста модерации с указанным размером (0 — отдельные карточки).")
+    parser.add_argument("--reject-ratio", type=float, default=0.0, help="Доля отклоняемых новостей.")
+    parser.add_argument("--http-latency", type=float, default=0.0, help="Задержка ответа сайтов, с.")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="Задержка вызовов Telegram, с.")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0, help="Доля ошибок Telegram.")
+    parser.add_argument("--gpt-latency", type=float, default=0.0, help="Задержка ответа OpenAI, с.")
+    parser.add_argument("--gpt-error-rate", type=float, default=0.0, help="Доля ошибок OpenAI.")
+    parser.add_argument("--image", default="photo.png", choices=["photo.png", "photo.webp"],
+                        help="Какое записанное изображение отдавать в лентах.")
+    parser.add_argument("--tracemalloc", action="store_true", help="Замерять пик памяти через tracemalloc.")
+    parser.add_argument("--log-level", default="WARNING", help="Уровень логирования бота.")
+    parser.add_argument("--json-out", help="Сохранить результат в JSON.")
+    parser.add_argument("--baseline", help="JSON с базовой линией для сравнения.")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Допустимое ухудшение относительно базовой линии (доля).")
+    parser.add_argument("--keep-workdir", action="store_true", help="Не удалять рабочую директорию.")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    tg_backend = fake_telegram.FakeTelegramBackend(latency=args.tg_latency, error_rate=args.tg_error_rate,
+                                                   image_path=os.path.join(RECORDED_DIR, "photo.png"),
+                                                   seed=args.seed)
+    gpt_backend = fake_openai.FakeOpenAIBackend(latency=args.gpt_latency, error_rate=args.gpt_error_rate,
+                                                seed=args.seed)
+    fake_telegram.install(tg_backend)
+    fake_openai.install(gpt_backend)
+
+    site = RecordedSite(latency=args.http_latency, image_name=args.image, quiet_fraction=args.quiet_fraction)
+    server = start_site(site)
+
+    workdir = tempfile.mkdtemp(prefix="news_bot_bench_")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    with open("password.txt", "w", encoding="utf-8") as f:
+        f.write("bench")
+
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            import main_bot
+        root_logger = logging.getLogger()
+        for handler in list(root_logger.handlers):
+            if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+                root_logger.removeHandler(handler)
+        root_logger.setLevel(args.log_level.upper())
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = asyncio.run(run(args, main_bot, site, tg_backend, gpt_backend))
+        if args.tracemalloc:
+            result["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        result["maxrss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        stages = metrics.stage_summary("stage")
+    finally:
+        os.chdir(previous_cwd)
+        server.shutdown()
+        if args.keep_workdir:
+            print(f"Рабочая директория: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result, stages)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=4)
+
+    if args.baseline and not compare_with_baseline(result, args.baseline, args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Пул ботов: связки распределяются между несколькими токенами.
+
+У каждого бота свои лимиты Telegram (FloodWait), поэтому карточки модерации,
+их правки и публикации связок отправляются через бота, за которым закреплена
+связка, и пропускная способность растёт с числом токенов в BOT_TOKENS.
+
+Бот новой связки выбирается хэшированием по наибольшему весу (rendezvous
+hashing) от ID бота (часть токена до ':') и названия связки и записывается
+в неё ("bot_id"): именно этот бот добавляется в её чат модерации и канал
+публикации, поэтому связка больше никуда не переезжает. Связки, созданные
+до появления пула, при старте закрепляются за первым ботом — он и был
+добавлен в их чаты. Если бота связки нет в BOT_TOKENS, связка не
+обслуживается (UnknownBotError), а не молча переходит к чужому боту.
+
+Интерфейс администратора (личные сообщения) обслуживает первый бот пула.
+Обработчики кнопок и событий чатов регистрируются во всех ботах: нажатие
+кнопки приходит тому боту, который отправил карточку, и он же её правит.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+
+from telethon import TelegramClient
+
+from config import API_ID, API_HASH, BOT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownBotError(Exception):
+    """Бот, за которым закреплена связка, отсутствует в BOT_TOKENS."""
+
+
+def _score(bot_id, linkage_name):
+    digest = hashlib.blake2b(f"{bot_id}:{linkage_name}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class BotShard:
+    """Один бот пула: токен, клиент и имя пользователя (известно после запуска)."""
+
+    def __init__(self, token, session):
+        self.token = token
+        self.bot_id = token.split(":", 1)[0]
+        self.client = TelegramClient(session, API_ID, API_HASH).start(bot_token=token)
+        self.username = None
+
+    @property
+    def name(self):
+        return f"@{self.username}" if self.username else self.bot_id
+
+
+class BotPool:
+    """Боты пула и закрепление связок за ними."""
+
+    def __init__(self, tokens=BOT_TOKENS):
+        if not tokens:
+            raise ValueError("BOT_TOKENS не должен быть пустым")
+        self.shards = []
+        for index, token in enumerate(tokens):
+            bot_id = token.split(":", 1)[0]
+            # У первого бота прежнее имя сессии, чтобы не авторизовываться заново.
+            session = 'bot_session' if index == 0 else f'bot_session_{bot_id}'
+            self.shards.append(BotShard(token, session))
+        self.by_id = {shard.bot_id: shard for shard in self.shards}
+        self.primary = self.shards[0]
+
+    def on(self, event):
+        """Декоратор: обработчик регистрируется в клиентах всех ботов пула."""
+        def decorator(func):
+            for shard in self.shards:
+                shard.client.add_event_handler(func, event)
+            return func
+        return decorator
+
+    def shard_for_new(self, linkage_name):
+        """Бот для создаваемой связки (выбор хэшированием)."""
+        return max(self.shards, key=lambda shard: _score(shard.bot_id, linkage_name))
+
+    def shard_for(self, linkage_name, linkage):
+        """Бот, закреплённый за связкой; связка без "bot_id" принадлежит первому боту."""
+        pinned = linkage.get("bot_id")
+        if pinned is None:
+            return self.primary
+        shard = self.by_id.get(str(pinned))
+        if shard is None:
+            raise UnknownBotError(f"Бот {pinned} связки '{linkage_name}' отсутствует в BOT_TOKENS")
+        return shard
+
+    def client_for(self, linkage_name, linkage):
+        return self.shard_for(linkage_name, linkage).client
+
+    def pin_unassigned(self, linkages):
+        """Закрепляет связки без "bot_id" за первым ботом. Возвращает их названия."""
+        pinned = [name for name, linkage in linkages.items() if linkage.get("bot_id") is None]
+        for name in pinned:
+            linkages[name]["bot_id"] = self.primary.bot_id
+        return pinned
+
+    def describe_shard(self, linkage_name, linkage):
+        """Бот связки для view_linkages; отсутствующий бот показывается как ошибка."""
+        try:
+            return self.shard_for(linkage_name, linkage).name
+        except UnknownBotError:
+            return f"⚠️ {linkage.get('bot_id')} нет в BOT_TOKENS, связка не обслуживается"
+
+    def shard_of(self, client):
+        return next((shard for shard in self.shards if shard.client is client), self.primary)
+
+    def load(self, linkages):
+        """Число связок на каждом боте пула: {BotShard: n} и число связок без бота."""
+        load = Counter({shard: 0 for shard in self.shards})
+        orphaned = 0
+        for name, linkage in linkages.items():
+            try:
+                load[self.shard_for(name, linkage)] += 1
+            except UnknownBotError:
+                orphaned += 1
+        return load, orphaned
+
+    def describe_load(self, linkages):
+        """Строка для сводки метрик: боты пула и число связок на каждом."""
+        load, orphaned = self.load(linkages)
+        text = ", ".join(f"{shard.name} — {count}" for shard, count in load.items())
+        return f"{text}; ⚠️ без бота — {orphaned}" if orphaned else text
+
+    async def start(self):
+        for shard in self.shards:
+            await shard.client.start(bot_token=shard.token)
+            me = await shard.client.get_me()
+            shard.username = me.username
+        logger.info(f"Ботов в пуле: {len(self.shards)} ({', '.join(shard.name for shard in self.shards)}).")
+
+    async def run_until_disconnected(self):
+        await asyncio.gather(*(shard.client.run_until_disconnected() for shard in self.shards))
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+from helpers import SourceError
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(SourceError):
+    """Хост временно в карантине: запрос не выполнялся."""
+
+
+class CircuitBreaker:
+    """
+    Автомат состояний для одного хоста.
+
+    closed    — запросы идут как обычно, ошибки подряд считаются;
+    open      — после failure_threshold ошибок хост в карантине на quarantine секунд;
+    half_open — по истечении карантина пропускается один пробный запрос.
+                Успех закрывает автомат, ошибка снова открывает его
+                с удвоенным карантином (до max_quarantine).
+    """
+
+    def __init__(self, failure_threshold=3, base_quarantine=60, max_quarantine=3600, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.base_quarantine = base_quarantine
+        self.max_quarantine = max_quarantine
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.quarantine = base_quarantine
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.probe_started_at = None
+        self.last_error = None
+
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.quarantine:
+                return False
+            self.state = HALF_OPEN
+            self.probe_in_flight = False
+        if self.probe_in_flight and self.clock() - self.probe_started_at < self.base_quarantine:
+            return False
+        self.probe_in_flight = True
+        self.probe_started_at = self.clock()
+        return True
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.quarantine = self.base_quarantine
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.last_error = None
+
+    def record_failure(self, error=None):
+        self.failures += 1
+        self.last_error = str(error) if error else None
+        if self.state == HALF_OPEN:
+            self.quarantine = min(self.quarantine * 2, self.max_quarantine)
+            self._open()
+        elif self.state == CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.probe_in_flight = False
+
+    def retry_in(self):
+        if self.state != OPEN:
+            return 0
+        return max(0, int(self.quarantine - (self.clock() - self.opened_at)))
+
+
+class HostHealthRegistry:
+    """
+    Автоматы по хостам источников. Для HTTP ключом служит хост, для
+    Telegram-каналов — сама ссылка на канал, т.к. каналы одного t.me
+    недоступны независимо друг от друга.
+    """
+
+    def __init__(self, **breaker_options):
+        self.breaker_options = breaker_options
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url):
+        if "t.me" in url and not url.startswith(("http://", "https://")):
+            url = "https://" + url
+        parsed = urlparse(url)
+        if parsed.netloc == "t.me":
+            return f"t.me{parsed.path}".rstrip("/")
+        return parsed.netloc or url
+
+    def _breaker(self, key):
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(**self.breaker_options)
+        return breaker
+
+    def is_available(self, url):
+        """
+        Дешёвая проверка без смены состояния: False, только пока карантин хоста не истёк.
+        Используется планировщиком, чтобы не тратить цикл на заведомо мёртвые источники.
+        """
+        with self._lock:
+            breaker = self.breakers.get(self.key(url))
+            return breaker is None or breaker.state != OPEN or breaker.retry_in() == 0
+
+    def allow(self, url):
+        """Можно ли сейчас обращаться к хосту. В half-open пропускает один пробный запрос."""
+        key = self.key(url)
+        with self._lock:
+            allowed = self._breaker(key).allow()
+        if not allowed:
+            metrics.inc("circuit_rejected_total", host=key)
+        return allowed
+
+    def check(self, url):
+        """Как allow, но выбрасывает CircuitOpenError, если хост в карантине."""
+        if not self.allow(url):
+            raise CircuitOpenError(f"Хост {self.key(url)} в карантине")
+
+    def record_success(self, url):
+        key = self.key(url)
+        with self._lock:
+            breaker = self._breaker(key)
+            was_open = breaker.state != CLOSED
+            breaker.record_success()
+        if was_open:
+            logger.info(f"Хост {key} снова доступен, автомат закрыт.")
+
+    def record_failure(self, url, error=None):
+        key = self.key(url)
+        with self._lock:
+            breaker = self._breaker(key)
+            previous = breaker.state
+            breaker.record_failure(error)
+            opened = breaker.state == OPEN and previous != OPEN
+            quarantine = breaker.quarantine
+        if opened:
+            metrics.inc("circuit_opened_total", host=key)
+            logger.warning(f"Хост {key} помещён в карантин на {quarantine} с после ошибок: {error}")
+
+    def describe(self, url):
+        """Статус хоста для view_linkages."""
+        key = self.key(url)
+        with self._lock:
+            breaker = self.breakers.get(key)
+            if breaker is None or (breaker.state == CLOSED and not breaker.failures):
+                return "🟢"
+            if breaker.state == CLOSED:
+                return f"🟡 ошибок: {breaker.failures}"
+            if breaker.state == HALF_OPEN:
+                return "🟡 пробный запрос"
+            return f"🔴 карантин ещё {breaker.retry_in()} с"
+
+
+host_health = HostHealthRegistry()
@@ -0,0 +1,54 @@
+API_ID = 00000000
+API_HASH = 'ADD API_HASH'
+BOT_TOKEN = 'ADD BOT TOKEN'
+BOT_TOKENS = [BOT_TOKEN]
+
+LINKAGES_FILE = 'resources.json'
+PASSWORD_FILE = 'password.txt'
+QUEUE_FILE = 'work_queue.db'
+SESSIONS_FILE = 'sessions.json'
+RSS_CURSOR_FILE = 'rss_cursors.json'
+ARCHIVE_DIR = 'archive'
+
+PARSER_SESSIONS = ['parser_session']
+PARSER_LOAD_WINDOW = 600
+
+CHECK_INTERVAL = 10
+MAX_POLL_INTERVAL = 3600
+# Сколько загрузок источников делается за один проход опроса; делится между связками по весам.
+FETCHES_PER_CYCLE = 100
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+
+RSS_MAX_ENTRIES = 20
+RSS_ARTICLE_WORKERS = 8
+
+HTTP_POOL_HOSTS = 32
+HTTP_PER_HOST = 2
+DNS_TTL = 300
+
+PREVIEW_EDIT_INTERVAL = 1.5
+# Сколько секунд задача принятой новости ждёт текст недописанного предпросмотра.
+PREVIEW_HANDOFF_TIMEOUT = 120
+
+GPT_MODEL = 'gpt-3.5-turbo'
+GPT_INPUT_TOKENS = 512
+GPT_PRICE_INPUT = 0.0005
+GPT_PRICE_OUTPUT = 0.0015
+GPT_USAGE_FILE = 'gpt_usage.json'
+GPT_USAGE_DAYS = 90
+
+TRANSFORM_BATCH_WINDOW = 30
+
+IMAGE_INDEX_FILE = 'image_index.json'
+IMAGE_HASH_DISTANCE = 6
+IMAGE_HASH_WORKERS = 2
+IMAGE_DUPLICATE_WINDOW = 24 * 3600
+
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_THRESHOLD = 0.5
+LOOP_STALL_HISTORY = 20
+PROFILE_DURATION = 15
+PROFILE_SAMPLE_INTERVAL = 0.01
+
+LANE_LATENCY_TARGETS = {'high': 300, 'normal': 3600, 'low': 21600}
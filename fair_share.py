@@ -0,0 +1,88 @@
+"""
+Взвешенное справедливое разделение общих ресурсов между связками.
+
+Общие ресурсы — вызовы GPT (очередь transform), отправки бота в Telegram
+(очереди moderation и publish) и загрузки источников (цикл опроса).
+Когда работы ждут несколько связок, ресурс достаётся им пропорционально
+весу связки ("weight" в конфигурации, по умолчанию 1): связка с весом 2
+получает вдвое больше вызовов, чем связка с весом 1, а связка со
+100 источниками не может занять ресурс целиком, пока ждут остальные.
+
+Используется справедливая очередь со стартовыми метками (start-time fair
+queueing): у каждой связки есть метка окончания её последней порции работы,
+обслуживается связка с наименьшей стартовой меткой max(виртуальное время,
+метка окончания), после чего её метка сдвигается на cost / weight.
+Связка, долго не имевшая работы, не копит «кредит»: её метка подтягивается
+к текущему виртуальному времени.
+"""
+import threading
+from collections import Counter
+
+from linkage_config import LinkageWatcher
+from metrics import metrics
+
+DEFAULT_WEIGHT = 1.0
+
+_watcher = LinkageWatcher()
+_watcher_lock = threading.Lock()
+
+
+def linkage_weight(linkage_name):
+    """Вес связки из текущей конфигурации."""
+    with _watcher_lock:
+        _watcher.refresh()
+        linkage = _watcher.linkages.get(linkage_name) or {}
+    return float(linkage.get("weight", DEFAULT_WEIGHT))
+
+
+class FairShare:
+    """Справедливая очередь одного общего ресурса."""
+
+    def __init__(self, resource, weight_of=linkage_weight):
+        self.resource = resource
+        self.weight_of = weight_of
+        self.virtual_time = 0.0
+        self.finish = {}
+        self.usage = Counter()
+        self._lock = threading.Lock()
+
+    def _start_tag(self, linkage_name):
+        return max(self.virtual_time, self.finish.get(linkage_name, 0.0))
+
+    def pick(self, linkage_names):
+        """Связка, чья очередь обслуживается следующей (при равенстве — первая в списке)."""
+        with self._lock:
+            return min(linkage_names, key=self._start_tag)
+
+    def charge(self, linkage_name, cost=1.0):
+        """Учитывает, что связка использовала ресурс в объёме cost."""
+        weight = max(self.weight_of(linkage_name), 1e-6)
+        with self._lock:
+            start = self._start_tag(linkage_name)
+            self.virtual_time = start
+            self.finish[linkage_name] = start + cost / weight
+            self.usage[linkage_name] += cost
+        metrics.inc("fair_share_units_total", cost, resource=self.resource, linkage=linkage_name)
+
+    def share_of(self, linkage_name):
+        """Доля ресурса, полученная связкой с запуска процесса (0..1)."""
+        with self._lock:
+            total = sum(self.usage.values())
+            return self.usage[linkage_name] / total if total else 0.0
+
+
+fair_shares = {
+    "gpt": FairShare("gpt"),
+    "send": FairShare("send"),
+    "fetch": FairShare("fetch"),
+}
+
+RESOURCE_NAMES = {"gpt": "GPT", "send": "отправки", "fetch": "загрузки"}
+
+
+def describe_shares(linkage_name):
+    """Строка для view_linkages: вес связки и её доли общих ресурсов."""
+    shares = ", ".join(f"{RESOURCE_NAMES[name]} {share.share_of(linkage_name):.0%}"
+                       for name, share in fair_shares.items() if share.usage)
+    weight = f"вес {linkage_weight(linkage_name):g}"
+    return f"{weight}; {shares}" if shares else weight
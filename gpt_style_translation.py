@@ -1,7 +1,12 @@
+import json
 import openai
 import re
 import logging
 
+from config import GPT_MODEL, GPT_INPUT_TOKENS
+from metrics import metrics
+from token_budget import count_message_tokens, count_tokens, gpt_usage, token_budget, trim_to_tokens
+
 API_KEY = 'chat-gpt-token'
 
 openai.api_key = API_KEY
@@ -13,41 +18,68 @@ default_prompt = (f"Translate the following text into Azerbaijani, "
           f"interesting and up to 1024 characters")
 
 
-def preprocess_text(original_text):
+def preprocess_text(original_text, max_tokens=None):
     """
-    Удаляет повторяющиеся шаблоны и сокращает текст до 1024 символов.
+    Удаляет повторяющиеся шаблоны и сокращает текст: до max_tokens токенов
+    (входной бюджет GPT) или, если max_tokens не задан, до 1024 символов
+    (текст для публикации без GPT).
     """
     text = re.sub(r"(.)\1{5,}", r"\1\1\1", original_text)
 
-    text = text[:1024]
+    if max_tokens is None:
+        text = text[:1024]
+    else:
+        text = trim_to_tokens(text, max_tokens)
 
     return text.strip()
 
 
-async def transform_text_gpt(original_text, custom_prompt=None):
+def build_messages(original_text, custom_prompt=None, max_tokens=GPT_INPUT_TOKENS):
+    """Собирает сообщения запроса: промпт и текст новости входят в них ровно один раз."""
+    cleaned_text = preprocess_text(original_text, max_tokens)
+    prompt = custom_prompt or default_prompt
+    return [
+        {
+            "role": "system",
+            "content": "You are a professional CHAT-GPT"
+        },
+        {
+            "role": "user",
+            "content": f"{prompt}:\n\n{cleaned_text}"
+        }
+    ]
+
+
+def cap_reached(linkage_name, linkage):
+    """Проверяет дневной лимит GPT связки и учитывает пропущенный из-за него запрос."""
+    reason = gpt_usage.cap_reached(linkage_name, linkage)
+    if reason:
+        metrics.inc("gpt_capped_total", linkage=linkage_name)
+    return reason
+
+
+async def transform_text_gpt(original_text, custom_prompt=None, linkage_name=None, linkage=None):
     """
     Переводит текст на азербайджанский с использованием ChatGPT.
     Если custom_prompt передан, используется он. Иначе используется стандартный.
+    Вход обрезается до бюджета токенов связки, расход записывается в gpt_usage;
+    при исчерпанном дневном лимите связки GPT не вызывается.
     """
+    if cap_reached(linkage_name, linkage):
+        return preprocess_text(original_text)
+
     try:
-        cleaned_text = preprocess_text(original_text)
-
-        prompt = custom_prompt or f"{default_prompt} \n\n{cleaned_text}"
-
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a professional CHAT-GPT"
-                },
-                {
-                    "role": "user",
-                    "content": f"{prompt}:\n\n{cleaned_text}"
-                }
-            ]
-        )
+        messages = build_messages(original_text, custom_prompt, token_budget(linkage))
+
+        response = await openai.ChatCompletion.acreate(model=GPT_MODEL, messages=messages)
         translated_text = response['choices'][0]['message']['content'].strip()
+
+        usage = response.get('usage') or {}
+        gpt_usage.record(
+            linkage_name,
+            usage.get('prompt_tokens') or count_message_tokens(messages),
+            usage.get('completion_tokens') or count_tokens(translated_text),
+        )
         return translated_text
 
     except openai.error.InvalidRequestError as e:
@@ -56,4 +88,134 @@ async def transform_text_gpt(original_text, custom_prompt=None):
 
     except Exception as e:
         logging.error(f"Ошибка при переводе: {e}")
-        return original_text
\ No newline at end of file
+        return original_text
+
+
+MULTI_SYSTEM_PROMPT = (
+    "You are a professional CHAT-GPT. You receive one source text and several numbered tasks. "
+    "Perform every task independently on the source text and answer only with a JSON object "
+    "{\"outputs\": [...]} holding exactly one string per task, in task order."
+)
+MULTI_OUTPUT_MAX_CHARS = 4096
+
+
+def build_multi_messages(original_text, prompts, max_tokens=GPT_INPUT_TOKENS):
+    """Сообщения запроса с несколькими промптами к одному тексту: текст входит в запрос один раз."""
+    cleaned_text = preprocess_text(original_text, max_tokens)
+    tasks = "\n".join(f"{number}. {prompt}" for number, prompt in enumerate(prompts, 1))
+    return [
+        {
+            "role": "system",
+            "content": MULTI_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Tasks:\n{tasks}\n\nSource text:\n\n{cleaned_text}"
+        }
+    ]
+
+
+def parse_multi_outputs(content, count):
+    """
+    Разбирает ответ на запрос с несколькими промптами. Возвращает список из
+    count элементов: текст результата или None, если результат не прошёл проверку.
+    """
+    content = re.sub(r"^```(?:json)?\s*|\s*```$", "", content.strip())
+    try:
+        outputs = json.loads(content).get("outputs")
+    except (ValueError, AttributeError):
+        return [None] * count
+    if not isinstance(outputs, list):
+        return [None] * count
+
+    results = []
+    for index in range(count):
+        output = outputs[index] if index < len(outputs) else None
+        if isinstance(output, str) and output.strip() and len(output) <= MULTI_OUTPUT_MAX_CHARS:
+            results.append(output.strip())
+        else:
+            results.append(None)
+    return results
+
+
+async def transform_text_gpt_multi(original_text, targets):
+    """
+    Преобразует один текст по промптам нескольких связок одним запросом.
+
+    targets — список (linkage_name, linkage, prompt). Возвращает тексты в том
+    же порядке. Одинаковые промпты выполняются один раз; связки с исчерпанным
+    дневным лимитом получают очищенный исходный текст; результаты, не прошедшие
+    проверку (или все, если запрос не удался), запрашиваются по отдельности
+    через transform_text_gpt. Расход запроса делится между связками поровну.
+    """
+    results = [None] * len(targets)
+    by_prompt = {}
+    for index, (linkage_name, linkage, prompt) in enumerate(targets):
+        if cap_reached(linkage_name, linkage):
+            results[index] = preprocess_text(original_text)
+        else:
+            by_prompt.setdefault(prompt or default_prompt, []).append(index)
+
+    prompts = list(by_prompt)
+    if len(prompts) > 1:
+        linkage_names = sorted({targets[index][0] for indexes in by_prompt.values() for index in indexes},
+                               key=str)
+        budget = min(token_budget(targets[indexes[0]][1]) for indexes in by_prompt.values())
+        messages = build_multi_messages(original_text, prompts, budget)
+        try:
+            response = await openai.ChatCompletion.acreate(model=GPT_MODEL, messages=messages)
+            content = response['choices'][0]['message']['content']
+            usage = response.get('usage') or {}
+            prompt_tokens = usage.get('prompt_tokens') or count_message_tokens(messages)
+            completion_tokens = usage.get('completion_tokens') or count_tokens(content)
+            for linkage_name in linkage_names:
+                gpt_usage.record(linkage_name, round(prompt_tokens / len(linkage_names)),
+                                 round(completion_tokens / len(linkage_names)))
+            outputs = parse_multi_outputs(content, len(prompts))
+        except Exception as e:
+            logging.error(f"Ошибка при преобразовании по нескольким промптам: {e}")
+            outputs = [None] * len(prompts)
+
+        failed = outputs.count(None)
+        metrics.inc("gpt_multi_targets_total", len(prompts) - failed, result="ok")
+        if failed:
+            metrics.inc("gpt_multi_targets_total", failed, result="fallback")
+            logging.warning(f"{failed} из {len(prompts)} результатов общего запроса не прошли проверку, "
+                            f"они будут запрошены по отдельности.")
+        for prompt, output in zip(prompts, outputs):
+            for index in by_prompt[prompt]:
+                results[index] = output
+
+    for prompt, indexes in by_prompt.items():
+        if results[indexes[0]] is None:
+            linkage_name, linkage, _ = targets[indexes[0]]
+            output = await transform_text_gpt(original_text, prompt, linkage_name, linkage)
+            for index in indexes:
+                results[index] = output
+    return results
+
+
+async def stream_text_gpt(original_text, custom_prompt=None, linkage_name=None, linkage=None):
+    """
+    Потоковый вариант transform_text_gpt: асинхронный генератор, который после
+    каждого фрагмента ответа отдаёт весь накопленный к этому моменту текст.
+    Ошибки не перехватываются. Закрытие генератора (aclose или отмена задачи)
+    закрывает поток ответа, и модель перестаёт генерировать токены.
+    Потоковый ответ не сообщает расход, поэтому он считается токенизатором
+    по фактически полученному тексту.
+    """
+    messages = build_messages(original_text, custom_prompt, token_budget(linkage))
+
+    response = await openai.ChatCompletion.acreate(model=GPT_MODEL, messages=messages, stream=True)
+    text = ""
+    try:
+        async for chunk in response:
+            delta = chunk['choices'][0].get('delta', {}).get('content')
+            if delta:
+                text += delta
+                yield text
+    finally:
+        gpt_usage.record(linkage_name, count_message_tokens(messages), count_tokens(text))
+        aclose = getattr(response, "aclose", None)
+        if aclose:
+            await aclose()
@@ -4,22 +4,63 @@ import re
 import glob
 import logging
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class SourceError(Exception):
+    """Источник новостей (RSS лента или Telegram-канал) недоступен."""
+
 
 def is_url(path):
     return bool(re.match(r'^https?:\/\/', path))
 
 
+def atomic_write_json(path, data, indent=4):
+    """
+    Атомарно записывает JSON: во временный файл рядом, fsync и переименование.
+    При падении процесса на диске остаётся либо старая, либо новая версия файла.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+def fsync_dir(path):
+    """Сбрасывает на диск запись каталога (нужно после rename), где это поддерживается."""
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
 def get_next_id(counter_file="id_counter.json"):
     """
     Возвращает следующий доступный ID в виде строки.
     Если файл не существует, создаёт его, начиная с 0.
     При каждом вызове счётчик увеличивается на 1.
+    Файл блокируется на время чтения и записи, поэтому счётчик можно
+    использовать из нескольких ingest-воркеров одновременно.
     """
     if not os.path.exists(counter_file):
         with open(counter_file, 'w', encoding='utf-8') as file:
             json.dump({"current_id": 0}, file, ensure_ascii=False, indent=4)
 
     with open(counter_file, 'r+', encoding='utf-8') as file:
+        if fcntl:
+            fcntl.flock(file, fcntl.LOCK_EX)
         data = json.load(file)
         next_id = data["current_id"]
         data["current_id"] = next_id + 1
@@ -30,6 +71,25 @@ def get_next_id(counter_file="id_counter.json"):
     return str(next_id)
 
 
+def delete_news_image(news):
+    """
+    Удаляет файл изображения новости, если он есть и не нужен другим
+    новостям (общие изображения учитываются в image_index).
+    """
+    # image_index сам зависит от helpers, поэтому импортируется здесь.
+    from image_index import image_index
+
+    if news.get("img") and os.path.exists(news["img"]):
+        if image_index.release(news["img"]):
+            logging.debug(f"Изображение {news['img']} используется другими новостями и не удаляется.")
+            return
+        try:
+            os.remove(news["img"])
+            logging.info(f"Изображение {news['img']} удалено.")
+        except Exception as e:
+            logging.error(f"Ошибка удаления изображения {news['img']}: {e}")
+
+
 def clear_images(folder_path):
     """
     Удаляет только файлы изображений из указанной папки.
@@ -0,0 +1,98 @@
+"""
+Общий HTTP-клиент для загрузки лент, статей и изображений.
+
+Один requests.Session на процесс: соединения с хостом переиспользуются
+(keep-alive), пул каждого хоста ограничен HTTP_PER_HOST соединениями —
+лишние запросы ждут свободного соединения, а не открывают новые.
+Результаты DNS кэшируются на DNS_TTL секунд. Ответы запрашиваются
+сжатыми (gzip/deflate, а при установленном brotli — ещё и br).
+"""
+import logging
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import connection as urllib3_connection
+
+from config import HTTP_POOL_HOSTS, HTTP_PER_HOST, DNS_TTL
+
+try:
+    import brotli  # noqa: F401 — urllib3 сам распаковывает br, если модуль установлен
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (compatible; NewsModerationBot/1.0)"
+
+
+class DNSCache:
+    """Кэш getaddrinfo с ограниченным временем жизни записей."""
+
+    def __init__(self, ttl=DNS_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port, family=0):
+        key = (host, port, family)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                return entry[1]
+        addresses = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        with self._lock:
+            self._entries[key] = (now, addresses)
+        return addresses
+
+    def forget(self, host):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == host]:
+                del self._entries[key]
+
+
+dns_cache = DNSCache()
+_original_create_connection = urllib3_connection.create_connection
+
+
+def _cached_create_connection(address, *args, **kwargs):
+    """Замена create_connection из urllib3: адреса хоста берутся из DNSCache."""
+    host, port = address
+    try:
+        addresses = dns_cache.resolve(host, port)
+    except socket.gaierror:
+        return _original_create_connection(address, *args, **kwargs)
+
+    last_error = None
+    for _, _, _, _, sockaddr in addresses:
+        try:
+            return _original_create_connection((sockaddr[0], port), *args, **kwargs)
+        except OSError as e:
+            last_error = e
+    # Адреса могли устареть — в следующий раз хост будет разрешён заново.
+    dns_cache.forget(host)
+    raise last_error
+
+
+urllib3_connection.create_connection = _cached_create_connection
+
+
+def build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_PER_HOST, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING})
+    return session
+
+
+http = build_session()
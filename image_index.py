@@ -0,0 +1,254 @@
+"""
+Индекс изображений по перцептивному хэшу.
+
+Одно и то же агентское фото приходит из разных лент и каналов под разными
+URL и именами файлов. После загрузки изображение хэшируется (dHash, 64 бита:
+уменьшенная серая копия и сравнение соседних пикселей), и если в индексе
+уже есть изображение на расстоянии Хэмминга не больше IMAGE_HASH_DISTANCE,
+новая копия удаляется, а новость ссылается на уже сохранённый файл.
+Файл хранится со счётчиком ссылок и удаляется, когда его отпускает
+последняя новость (helpers.delete_news_image).
+
+Новость, чьё изображение за последние IMAGE_DUPLICATE_WINDOW секунд уже
+приходило в ту же связку из другого источника, помечается как возможный
+дубль ("image_duplicate_of": {"id", "src", "src_name"}), и это видно
+в карточке модерации: новость с тем же стоковым фото может быть другой,
+поэтому решает модератор. Повторы изображения в одном источнике (логотипы,
+заставки) и в разных связках только разделяют файл и дублем не считаются.
+
+Индекс хранится в IMAGE_INDEX_FILE, общем для бота и воркеров, и журнале
+изменений рядом (.wal): регистрация и освобождение дописывают в журнал
+только изменившиеся записи под блокировкой файла, а журнал больше
+COMPACT_AFTER_BYTES сворачивается в снимок. Хэширование выполняется
+в пуле потоков, а не в event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from config import IMAGE_INDEX_FILE, IMAGE_HASH_DISTANCE, IMAGE_HASH_WORKERS, IMAGE_DUPLICATE_WINDOW
+from helpers import atomic_write_json
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+COMPACT_AFTER_BYTES = 256 * 1024
+
+
+def dhash(path, size=HASH_SIZE):
+    """Перцептивный разностный хэш изображения (size * size бит)."""
+    with Image.open(path) as img:
+        # Для JPEG draft декодирует сразу уменьшенную копию — заметно быстрее полного декодирования.
+        img.draft("L", (size * 8, size * 8))
+        img.thumbnail((size * 8, size * 8), Image.BOX)
+        pixels = img.convert("L").resize((size + 1, size), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ImageIndex:
+    """
+    Изображения по хэшу: {hex: {path, refs, news_id, src, src_name, seen_at, linkages}},
+    где linkages — {связка: {id, src, src_name, seen_at}} последнего появления в связке.
+    """
+
+    def __init__(self, path=IMAGE_INDEX_FILE, max_distance=IMAGE_HASH_DISTANCE, workers=IMAGE_HASH_WORKERS,
+                 clock=time.time):
+        self.path = path
+        self.journal = path + ".wal"
+        self.max_distance = max_distance
+        self.clock = clock
+        self.entries = {}
+        self._signature = None
+        self._journal_end = 0
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-hash")
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reload(self):
+        """Перечитывает снимок, если его сменили, и дочитывает новые записи журнала."""
+        snapshot = self._stat(self.path)
+        if snapshot != self._signature:
+            self.entries, self._journal_end = {}, 0
+            if snapshot is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self.entries = json.load(f)
+                except (json.JSONDecodeError, OSError) as e:
+                    logger.error(f"Не удалось прочитать индекс изображений {self.path}: {e}")
+            self._signature = snapshot
+        try:
+            with open(self.journal, 'r', encoding='utf-8') as f:
+                f.seek(self._journal_end)
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Повреждённая запись в {self.journal} пропущена.")
+                    else:
+                        if record.get("value") is None:
+                            self.entries.pop(record["key"], None)
+                        else:
+                            self.entries[record["key"]] = record["value"]
+                    self._journal_end += len(line.encode('utf-8'))
+        except FileNotFoundError:
+            self._journal_end = 0
+
+    def _save(self, keys):
+        """Дописывает в журнал текущие версии записей keys (удалённые — с value null)."""
+        lines = "".join(json.dumps({"key": key, "value": self.entries.get(key)}, ensure_ascii=False) + "\n"
+                        for key in keys)
+        with open(self.journal, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        self._journal_end += len(lines.encode('utf-8'))
+        if self._journal_end > COMPACT_AFTER_BYTES:
+            atomic_write_json(self.path, self.entries, indent=None)
+            # Падение здесь безопасно: записи журнала повторно применяются к новому снимку без изменений.
+            with open(self.journal, 'w', encoding='utf-8'):
+                pass
+            self._signature, self._journal_end = self._stat(self.path), 0
+
+    def _locked(self):
+        lock = open(self.path + ".lock", 'a')
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _nearest(self, value, dropped):
+        """
+        Ближайшее изображение в пределах max_distance; записи об удалённых
+        файлах выбрасываются, и их ключи добавляются в dropped.
+        """
+        best, best_distance = None, self.max_distance + 1
+        for key, entry in list(self.entries.items()):
+            distance = hamming(value, int(key, 16))
+            if distance >= best_distance:
+                continue
+            if not os.path.exists(entry["path"]):
+                del self.entries[key]
+                dropped.append(key)
+                continue
+            best, best_distance = key, distance
+        return best
+
+    def register(self, path, news, linkage_name=None):
+        """
+        Добавляет загруженное изображение новости связки в индекс. Возвращает путь,
+        по которому изображение хранится (путь уже известной копии, если она нашлась).
+        """
+        if not path or not os.path.exists(path):
+            return path
+        try:
+            with metrics.timer("image_hash", None, news.get("src")):
+                value = dhash(path)
+        except Exception as e:
+            logger.warning(f"Не удалось вычислить хэш изображения {path}: {e}")
+            return path
+
+        now = self.clock()
+        sighting = {"id": news.get("id"), "src": news.get("src"), "src_name": news.get("src_name"), "seen_at": now}
+        with self._lock, self._locked():
+            self._reload()
+            changed = []
+            key = self._nearest(value, changed)
+            if key is None:
+                key = f"{value:016x}"
+                self.entries[key] = {
+                    "path": path, "refs": 1, "news_id": news.get("id"),
+                    "src": news.get("src"), "src_name": news.get("src_name"), "seen_at": now,
+                    "linkages": {linkage_name or "": sighting},
+                }
+                self._save(changed + [key])
+                return path
+
+            entry = self.entries[key]
+            entry["refs"] += 1
+            linkages = {name: seen for name, seen in entry.get("linkages", {}).items()
+                        if now - seen["seen_at"] <= IMAGE_DUPLICATE_WINDOW}
+            previous = linkages.get(linkage_name or "")
+            if previous and previous["src"] != news.get("src"):
+                news["image_duplicate_of"] = {"id": previous["id"], "src": previous["src"],
+                                              "src_name": previous["src_name"]}
+                metrics.inc("items_image_duplicate_total", linkage=linkage_name, source=news.get("src"))
+            linkages[linkage_name or ""] = sighting
+            entry.update(news_id=news.get("id"), src=news.get("src"), src_name=news.get("src_name"), seen_at=now,
+                         linkages=linkages)
+            self._save(changed + [key])
+
+        if os.path.normpath(path) != os.path.normpath(entry["path"]):
+            os.remove(path)
+        metrics.inc("images_reused_total", source=news.get("src"))
+        logger.info(f"Изображение {path} совпадает с уже сохранённым {entry['path']}, используется оно.")
+        return entry["path"]
+
+    async def register_async(self, path, news, linkage_name=None):
+        """register в пуле потоков — для вызова из event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.register, path, news,
+                                                                linkage_name)
+
+    def release(self, path):
+        """
+        Отпускает ссылку новости на изображение. Возвращает True, если файл
+        ещё нужен другим новостям и удалять его не надо.
+        """
+        normalized = os.path.normpath(path)
+        with self._lock, self._locked():
+            self._reload()
+            key = next((k for k, e in self.entries.items() if os.path.normpath(e["path"]) == normalized), None)
+            if key is None:
+                return False
+            entry = self.entries[key]
+            entry["refs"] -= 1
+            if entry["refs"] <= 0:
+                del self.entries[key]
+            self._save([key])
+            return entry["refs"] > 0
+
+    def referenced_paths(self):
+        """Файлы, на которые в индексе ещё есть ссылки новостей."""
+        with self._lock, self._locked():
+            self._reload()
+            return {entry["path"] for entry in self.entries.values() if entry.get("refs", 0) > 0}
+
+    def forget(self, path):
+        """Удаляет из индекса запись о файле, удалённом в обход release."""
+        normalized = os.path.normpath(path)
+        with self._lock, self._locked():
+            self._reload()
+            keys = [k for k, e in self.entries.items() if os.path.normpath(e["path"]) == normalized]
+            for key in keys:
+                del self.entries[key]
+            if keys:
+                self._save(keys)
+
+
+image_index = ImageIndex()
@@ -0,0 +1,170 @@
+"""
+Горячая перезагрузка конфигурации связок.
+
+LinkageWatcher следит за версией хранилища связок (linkage_store) и при
+её изменении перечитывает связки, проверяет их и рассылает подписчикам
+список изменений: появившиеся и удалённые связки и источники, изменённые
+настройки. Связка с ошибками (например, после ручной правки resources.json)
+не применяется — до исправления продолжает действовать её прежняя версия.
+"""
+import logging
+
+from backpressure import OVERFLOW_POLICIES
+from linkage_store import linkages_version, load_linkages
+from news_filter import validate_filters
+from priority import validate_priority
+
+logger = logging.getLogger(__name__)
+
+# Настройки связки; остальные ключи (pending_news, digests, last_moderated_at)
+# — её рабочее состояние, их изменения не порождают событий.
+CONFIG_KEYS = (
+    "moderation_bot", "publication_channel", "is_active", "prompt",
+    "moderation_mode", "digest_size", "digest_interval",
+    "max_pending", "pending_ttl", "overflow_policy", "filters", "stream_preview",
+    "token_budget", "daily_token_cap", "daily_cost_cap", "priority_keywords", "weight",
+)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_linkage(linkage):
+    """Проверяет структуру связки. Возвращает список ошибок (пустой, если всё в порядке)."""
+    if not isinstance(linkage, dict):
+        return ["связка должна быть объектом"]
+
+    errors = []
+    resources = linkage.get("resources", [])
+    if not isinstance(resources, list):
+        errors.append("resources должен быть списком")
+    else:
+        for resource in resources:
+            if not isinstance(resource, dict) or not isinstance(resource.get("url"), str) or not resource["url"]:
+                errors.append(f"ресурс без url: {resource!r}")
+            elif "poll_interval" in resource and not (_is_number(resource["poll_interval"])
+                                                      and resource["poll_interval"] > 0):
+                errors.append(f"poll_interval ресурса {resource['url']} должен быть положительным числом")
+
+    if linkage.get("moderation_bot") is not None and not isinstance(linkage["moderation_bot"], int):
+        errors.append("moderation_bot должен быть ID чата")
+    for key in ("publication_channel", "prompt"):
+        if linkage.get(key) is not None and not isinstance(linkage[key], str):
+            errors.append(f"{key} должен быть строкой")
+    for key in ("is_active", "stream_preview"):
+        if not isinstance(linkage.get(key, False), bool):
+            errors.append(f"{key} должен быть true или false")
+    if linkage.get("moderation_mode", "single") not in ("single", "digest"):
+        errors.append("moderation_mode должен быть single или digest")
+    if linkage.get("overflow_policy", OVERFLOW_POLICIES[0]) not in OVERFLOW_POLICIES:
+        errors.append(f"overflow_policy должен быть одним из: {', '.join(OVERFLOW_POLICIES)}")
+    for key in ("digest_size", "digest_interval", "max_pending", "pending_ttl",
+                "token_budget", "daily_token_cap", "daily_cost_cap", "weight"):
+        if key in linkage and not (_is_number(linkage[key]) and linkage[key] > 0):
+            errors.append(f"{key} должен быть положительным числом")
+    if "filters" in linkage:
+        errors += validate_filters(linkage["filters"])
+    if isinstance(resources, list):
+        errors += validate_priority(linkage)
+    if not isinstance(linkage.get("pending_news", []), list):
+        errors.append("pending_news должен быть списком")
+    return errors
+
+
+def _resources_by_url(linkage):
+    return {resource["url"]: resource for resource in linkage.get("resources", [])}
+
+
+def diff_linkages(old, new):
+    """
+    Сравнивает две версии связок ({name: linkage}) и возвращает список изменений:
+        {"type": "linkage_added" | "linkage_removed" | "linkage_updated", "linkage": name, "fields": [...]}
+        {"type": "source_added" | "source_removed" | "source_updated", "linkage": name, "url": url,
+         "poll_interval": seconds | None, "priority": lane | None}
+    Удаление связки сопровождается удалением всех её источников, добавление — добавлением.
+    """
+    changes = []
+    names = list(new) + [name for name in old if name not in new]
+    for name in names:
+        if name not in new:
+            changes.append({"type": "linkage_removed", "linkage": name, "fields": []})
+        elif name not in old:
+            changes.append({"type": "linkage_added", "linkage": name, "fields": list(CONFIG_KEYS)})
+        else:
+            fields = [key for key in CONFIG_KEYS if old[name].get(key) != new[name].get(key)]
+            if fields:
+                changes.append({"type": "linkage_updated", "linkage": name, "fields": fields})
+
+    for name in names:
+        old_sources = _resources_by_url(old.get(name, {}))
+        new_sources = _resources_by_url(new.get(name, {}))
+        for url in old_sources.keys() - new_sources.keys():
+            changes.append({"type": "source_removed", "linkage": name, "url": url,
+                            "poll_interval": None, "priority": None})
+        for url, resource in new_sources.items():
+            if url not in old_sources:
+                change_type = "source_added"
+            elif (old_sources[url].get("poll_interval") != resource.get("poll_interval")
+                  or old_sources[url].get("priority") != resource.get("priority")):
+                change_type = "source_updated"
+            else:
+                continue
+            changes.append({"type": change_type, "linkage": name, "url": url,
+                            "poll_interval": resource.get("poll_interval"), "priority": resource.get("priority")})
+    return changes
+
+
+class LinkageWatcher:
+    """
+    Держит в памяти проверенную конфигурацию связок и обновляет её по месту,
+    когда хранилище меняется. Подписчики (subscribe) получают список изменений
+    из diff_linkages. Проверка версии — два вызова stat, поэтому refresh()
+    можно вызывать на каждом тике цикла опроса.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.linkages = {}
+        self._listeners = []
+        self._rejected = {}
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def refresh(self):
+        """Применяет изменения хранилища, если оно менялось. Возвращает список изменений."""
+        version = linkages_version()
+        if version == self.version:
+            return []
+        data = load_linkages()
+        self.version = version
+
+        accepted = {}
+        for name, linkage in data.get("linkages", {}).items():
+            errors = validate_linkage(linkage)
+            if errors:
+                if self._rejected.get(name) != errors:
+                    logger.error(f"Конфигурация связки '{name}' отклонена: {'; '.join(errors)}. "
+                                 f"Продолжает действовать предыдущая версия.")
+                    self._rejected[name] = errors
+                if name in self.linkages:
+                    accepted[name] = self.linkages[name]
+                continue
+            self._rejected.pop(name, None)
+            accepted[name] = linkage
+
+        changes = diff_linkages(self.linkages, accepted)
+        for name in self.linkages.keys() - accepted.keys():
+            del self.linkages[name]
+        for name, linkage in accepted.items():
+            current = self.linkages.setdefault(name, {})
+            if current is not linkage:
+                current.clear()
+                current.update(linkage)
+
+        if changes:
+            logger.info(f"Конфигурация связок обновлена: {len(changes)} изменений.")
+            for listener in self._listeners:
+                listener(changes)
+        return changes
@@ -0,0 +1,270 @@
+"""
+Хранилище связок с журналом изменений.
+
+Состояние связок складывается из снимка (resources.json) и журнала
+(resources.json.wal). save_linkages не переписывает весь файл, а дописывает
+в журнал изменившиеся связки — по строке на связку с контрольной суммой —
+и делает fsync. Когда журнал вырастает больше COMPACT_AFTER_BYTES, он
+сворачивается в новый снимок (временный файл, fsync, rename) и обнуляется.
+
+При загрузке снимок дополняется записями журнала; оборванная при падении
+последняя запись отбрасывается, поэтому после перезапуска состояние
+соответствует последнему завершённому сохранению. recover_linkages при
+старте процесса сворачивает журнал в снимок. Если снимок после ручной
+правки не разбирается, процесс продолжает работать с последним прочитанным
+состоянием, а файл остаётся как есть до исправления.
+"""
+import copy
+import json
+import logging
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+
+from config import LINKAGES_FILE
+from helpers import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = LINKAGES_FILE + ".wal"
+LOCK_FILE = LINKAGES_FILE + ".lock"
+COMPACT_AFTER_BYTES = 256 * 1024
+
+EMPTY_STATE = {"linkages": {}}
+
+# Последнее прочитанное или записанное этим процессом состояние.
+# signature — inode, mtime и размер снимка и журнала, по ним видно, что файлы
+# менял другой процесс и кэш нужно перечитать.
+# journal_end — конец последней целой записи журнала.
+_committed = {"signature": None, "data": None, "serialized": {}, "journal_end": 0}
+# _committed читают и меняют и event loop, и потоки (очередь задач, хэширование).
+_state_lock = threading.RLock()
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _signature():
+    return _file_signature(LINKAGES_FILE), _file_signature(JOURNAL_FILE)
+
+
+@contextmanager
+def _locked():
+    """Межпроцессная блокировка на время записи в журнал или сворачивания."""
+    with _state_lock, open(LOCK_FILE, 'a') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _encode_record(record):
+    body = json.dumps(record, ensure_ascii=False)
+    return f"{zlib.crc32(body.encode('utf-8')):08x} {body}\n"
+
+
+def _decode_record(line):
+    if not line.endswith("\n"):
+        return None
+    checksum, _, body = line.rstrip("\n").partition(" ")
+    try:
+        if int(checksum, 16) != zlib.crc32(body.encode('utf-8')):
+            return None
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def _read_snapshot():
+    if not os.path.exists(LINKAGES_FILE) or os.stat(LINKAGES_FILE).st_size == 0:
+        logger.info(f"{LINKAGES_FILE} отсутствует или пуст. Инициализация с пустой структурой.")
+        atomic_write_json(LINKAGES_FILE, EMPTY_STATE)
+        return copy.deepcopy(EMPTY_STATE)
+
+    try:
+        with open(LINKAGES_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if "linkages" not in data:
+            raise ValueError("Неверная структура JSON: отсутствует 'linkages'.")
+        return data
+    except (json.JSONDecodeError, ValueError) as e:
+        if _committed["data"] is not None:
+            # Неудачная ручная правка: файл не трогаем, действует последнее прочитанное состояние.
+            logger.error(f"Ошибка при чтении {LINKAGES_FILE}: {e}. Изменения не применены, "
+                         f"действует последнее успешно прочитанное состояние.")
+            return None
+        logger.error(f"Ошибка при чтении {LINKAGES_FILE}: {e}. Повторная инициализация файла.")
+        atomic_write_json(LINKAGES_FILE, EMPTY_STATE)
+        return copy.deepcopy(EMPTY_STATE)
+
+
+def _replay_journal(data):
+    """
+    Применяет к снимку записи журнала. Возвращает смещение конца последней
+    целой записи — всё, что дальше, осталось от оборванной записи.
+    """
+    if not os.path.exists(JOURNAL_FILE):
+        return 0
+
+    valid_offset = 0
+    with open(JOURNAL_FILE, 'r', encoding='utf-8', newline='\n') as f:
+        for line in f:
+            record = _decode_record(line)
+            if record is None:
+                logger.warning(f"Повреждённая запись в {JOURNAL_FILE}, журнал прочитан до смещения {valid_offset}.")
+                break
+            if record["op"] == "set":
+                data["linkages"][record["name"]] = record["value"]
+            elif record["op"] == "delete":
+                data["linkages"].pop(record["name"], None)
+            valid_offset += len(line.encode('utf-8'))
+    return valid_offset
+
+
+def _serialize(data):
+    return {name: json.dumps(linkage, ensure_ascii=False, sort_keys=True)
+            for name, linkage in data["linkages"].items()}
+
+
+def _load_committed():
+    """Возвращает последнее сохранённое состояние, перечитывая файлы только если они менялись."""
+    signature = _signature()
+    if signature != _committed["signature"] or _committed["data"] is None:
+        data = _read_snapshot()
+        if data is None:
+            # Ошибка уже в логе; до следующего изменения файла не перечитываем.
+            _committed["signature"] = signature
+            return _committed["data"]
+        _committed["journal_end"] = _replay_journal(data)
+        _committed["data"] = data
+        _committed["serialized"] = _serialize(data)
+        _committed["signature"] = signature
+    return _committed["data"]
+
+
+def linkages_version():
+    """
+    Дешёвый признак версии хранилища: меняется при каждом сохранении
+    (в том числе другим процессом). Позволяет кэшировать производные данные.
+    """
+    return _signature()
+
+
+class LoadedLinkages(dict):
+    """
+    Данные связок из load_linkages. base — связки в момент загрузки
+    (сериализованные): save_linkages сравнивает с ними, а не с текущим
+    состоянием на диске, и не затирает изменения других процессов.
+    """
+    base = None
+
+
+def load_linkages():
+    """Загружает данные связок: снимок из JSON файла и изменения из журнала."""
+    logger.debug("Загрузка связок из JSON файла.")
+    with _state_lock:
+        data = LoadedLinkages(copy.deepcopy(_load_committed()))
+        data.base = dict(_committed["serialized"])
+    return data
+
+
+def _apply(data, records):
+    for record in records:
+        if record["op"] == "set":
+            data["linkages"][record["name"]] = copy.deepcopy(record["value"])
+        else:
+            data["linkages"].pop(record["name"], None)
+
+
+def save_linkages(data):
+    """
+    Сохраняет обновлённые данные связок: дописывает в журнал только связки,
+    изменённые или удалённые вызывающим с момента load_linkages; связки,
+    которые тем временем добавил или изменил другой процесс, не трогаются.
+    Для данных не из load_linkages записываются только отличия от сохранённых,
+    без удалений. Запись считается сохранённой после fsync журнала.
+    """
+    logger.debug("Сохранение обновлённых связок в журнал.")
+    try:
+        with _locked():
+            _load_committed()
+            serialized = _serialize(data)
+            base = getattr(data, "base", None)
+            reference = _committed["serialized"] if base is None else base
+            records = [{"op": "set", "name": name, "value": data["linkages"][name]}
+                       for name, text in serialized.items() if reference.get(name) != text]
+            if base is not None:
+                records += [{"op": "delete", "name": name}
+                            for name in base if name not in serialized and name in _committed["serialized"]]
+            if not records:
+                return
+
+            if (_file_signature(JOURNAL_FILE) or (0, 0, 0))[2] > _committed["journal_end"]:
+                # Хвост от записи, оборванной падением другого процесса: новые
+                # записи после него не прочитались бы.
+                os.truncate(JOURNAL_FILE, _committed["journal_end"])
+
+            with open(JOURNAL_FILE, 'a', encoding='utf-8', newline='\n') as f:
+                f.write("".join(_encode_record(record) for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+
+            _apply(_committed["data"], records)
+            for record in records:
+                if record["op"] == "set":
+                    _committed["serialized"][record["name"]] = serialized[record["name"]]
+                else:
+                    _committed["serialized"].pop(record["name"], None)
+            if base is not None:
+                data.base = serialized
+            _committed["journal_end"] = os.path.getsize(JOURNAL_FILE)
+            _committed["signature"] = _signature()
+            logger.debug(f"В журнал записано изменений связок: {len(records)}")
+
+            if os.path.getsize(JOURNAL_FILE) > COMPACT_AFTER_BYTES:
+                _compact()
+    except Exception as e:
+        logger.error(f"Не удалось сохранить связки в {LINKAGES_FILE}: {e}")
+
+
+def _compact():
+    """Сворачивает журнал в новый снимок. Вызывается под блокировкой."""
+    atomic_write_json(LINKAGES_FILE, _committed["data"])
+    # Если процесс упадёт здесь, повторное применение журнала к новому
+    # снимку ничего не изменит: записи содержат связки целиком.
+    with open(JOURNAL_FILE, 'w', encoding='utf-8'):
+        pass
+    _committed["journal_end"] = 0
+    _committed["signature"] = _signature()
+    logger.debug(f"Журнал {JOURNAL_FILE} свёрнут в снимок {LINKAGES_FILE}.")
+
+
+def recover_linkages():
+    """
+    Восстанавливает состояние при старте процесса: применяет журнал к снимку,
+    отбрасывает оборванную последнюю запись и сворачивает журнал в снимок.
+    """
+    with _locked():
+        data = _read_snapshot()
+        if data is None:
+            return copy.deepcopy(_committed["data"])
+        valid_offset = _replay_journal(data)
+        if os.path.exists(JOURNAL_FILE) and os.path.getsize(JOURNAL_FILE) > 0:
+            if valid_offset < os.path.getsize(JOURNAL_FILE):
+                logger.warning(f"Отброшен оборванный хвост журнала {JOURNAL_FILE} "
+                               f"({os.path.getsize(JOURNAL_FILE) - valid_offset} байт).")
+            _committed["data"] = data
+            _committed["serialized"] = _serialize(data)
+            _compact()
+            logger.info(f"Состояние связок восстановлено из журнала {JOURNAL_FILE}.")
+    return data
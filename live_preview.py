@@ -0,0 +1,111 @@
+"""
+Потоковый предпросмотр GPT в карточке модерации.
+
+Если у связки включён "stream_preview": true, после отправки карточки бот
+запрашивает у GPT преобразованный текст в потоковом режиме и по мере
+поступления токенов редактирует карточку — не чаще раза в
+PREVIEW_EDIT_INTERVAL секунд (FloodWait от Telegram отодвигает следующую
+правку). Готовый текст передаётся в on_done и используется при публикации
+без повторного запроса к GPT. Если новость приняли до завершения, поток
+отвязывается от карточки (detach): он дописывается, но карточку больше не
+правит, а его текст передаётся в уже поставленную задачу преобразования.
+Отклонение или истечение срока новости отменяет запрос: поток ответа
+закрывается, и токены больше не тратятся.
+"""
+import asyncio
+import logging
+import time
+
+import gpt_style_translation
+from config import PREVIEW_EDIT_INTERVAL
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PreviewStreams:
+    """Задачи потокового предпросмотра по ключу (связка, ID новости)."""
+
+    def __init__(self, interval=PREVIEW_EDIT_INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.tasks = {}
+        self.detached = set()
+
+    def start(self, key, news, prompt, linkage, render, edit, on_done):
+        """
+        Запускает предпросмотр. render(text, done) строит текст карточки,
+        edit(text) — корутина правки карточки, on_done(text) вызывается
+        с полным ответом GPT.
+        """
+        self.cancel(key)
+        task = asyncio.create_task(self._run(key, news, prompt, linkage, render, edit, on_done))
+        self.tasks[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def _forget(self, key, task):
+        if self.tasks.get(key) is task:
+            self.tasks.pop(key, None)
+            self.detached.discard(key)
+
+    def cancel(self, key):
+        """Отменяет предпросмотр, если он ещё идёт. Возвращает True, если было что отменять."""
+        task = self.tasks.pop(key, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        logger.info(f"Потоковый предпросмотр новости {key[1]} связки '{key[0]}' отменён.")
+        return True
+
+    def running(self, key):
+        """Ещё идущая задача предпросмотра или None; её результат — полный текст GPT (None при ошибке)."""
+        task = self.tasks.get(key)
+        return task if task is not None and not task.done() else None
+
+    def detach(self, key):
+        """
+        Отвязывает идущий предпросмотр от карточки: поток дописывается, но
+        карточку больше не правит. Возвращает задачу предпросмотра или None.
+        """
+        task = self.running(key)
+        if task is not None:
+            self.detached.add(key)
+        return task
+
+    async def _run(self, key, news, prompt, linkage, render, edit, on_done):
+        linkage_name = key[0]
+        text, shown = "", ""
+        next_edit = self.clock() + self.interval
+        stream = gpt_style_translation.stream_text_gpt(news["txt"], prompt, linkage_name, linkage)
+        try:
+            with metrics.timer("gpt_stream", linkage_name, news.get("src")):
+                async for text in stream:
+                    if self.clock() >= next_edit and text != shown and key not in self.detached:
+                        next_edit = await self._edit(edit, render(text, False))
+                        shown = text
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка потокового предпросмотра новости {key[1]} связки '{linkage_name}': {e}")
+            return None
+        finally:
+            await stream.aclose()
+
+        if not text:
+            return None
+        if key not in self.detached:
+            await self._edit(edit, render(text, True))
+            on_done(text)
+        return text
+
+    async def _edit(self, edit, text):
+        """Правит карточку и возвращает время, раньше которого следующая правка не делается."""
+        try:
+            await edit(text)
+        except Exception as e:
+            # FloodWaitError сообщает, сколько секунд ждать; MessageNotModified и прочее не критичны.
+            wait = getattr(e, "seconds", 0) or 0
+            logger.debug(f"Не удалось обновить карточку предпросмотра: {e}")
+            return self.clock() + max(self.interval, wait)
+        return self.clock() + self.interval
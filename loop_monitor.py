@@ -0,0 +1,152 @@
+"""
+Контроль задержек event loop и выборочный профилировщик живого процесса.
+
+Блокирующий вызов в асинхронном коде (feedparser.parse, requests.get,
+BeautifulSoup, конвертация изображений, синхронный файловый ввод-вывод)
+останавливает весь процесс: бот не отвечает на кнопки, воркеры не опрашивают
+источники. LoopWatchdog замечает такие остановки сам:
+
+* корутина-пульс каждые LOOP_LAG_INTERVAL секунд отмечается и измеряет, насколько
+  позже положенного она проснулась (гистограмма loop_lag_seconds);
+* поток-сторож проверяет пульс и, если его нет дольше LOOP_LAG_THRESHOLD,
+  снимает стек потока event loop — то место, где он стоит прямо сейчас;
+* когда loop оживает, остановка записывается в лог вместе со стеком,
+  считается в loop_stalls_total и попадает в историю (последние LOOP_STALL_HISTORY).
+
+profile_stacks снимает стеки всех потоков с заданной частотой в течение
+заданного времени и возвращает их в свёрнутом формате ("поток;кадр;кадр N"),
+который понимают flamegraph.pl, speedscope и inferno.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from config import LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD, LOOP_STALL_HISTORY, PROFILE_SAMPLE_INTERVAL
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STACK_LIMIT = 64
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _frame_stack(frame, limit=STACK_LIMIT):
+    """Кадры от корня к вершине стека."""
+    stack = []
+    while frame is not None and len(stack) < limit:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class LoopWatchdog:
+    """Пульс event loop и поток, снимающий стек при его остановке."""
+
+    def __init__(self, threshold=LOOP_LAG_THRESHOLD, interval=LOOP_LAG_INTERVAL, history=LOOP_STALL_HISTORY,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.interval = interval
+        self.clock = clock
+        self.stalls = deque(maxlen=history)
+        self.last_beat = None
+        self.loop_thread_id = None
+        self._stack = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    async def run(self):
+        """Корутина-пульс; запускает поток-сторож при первом вызове."""
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = self.clock()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._thread.start()
+        logger.info(f"Контроль задержек event loop запущен (порог {self.threshold} с).")
+
+        while True:
+            await asyncio.sleep(self.interval)
+            now = self.clock()
+            lag = max(now - self.last_beat - self.interval, 0.0)
+            with self._lock:
+                self.last_beat = now
+                stack, self._stack = self._stack, None
+            metrics.observe("loop_lag_seconds", lag, buckets=LAG_BUCKETS)
+            if lag >= self.threshold:
+                self._record_stall(lag, stack)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if self._stack is not None or self.clock() - self.last_beat - self.interval < self.threshold:
+                    continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = _frame_stack(frame) if frame is not None else []
+            with self._lock:
+                self._stack = stack
+
+    def _record_stall(self, lag, stack):
+        metrics.inc("loop_stalls_total")
+        self.stalls.append({"at": time.time(), "duration": lag, "stack": stack or []})
+        where = "\n  ".join(stack) if stack else "стек не снят"
+        logger.warning(f"Event loop не отвечал {lag:.2f} с. Стек в момент остановки:\n  {where}")
+
+    def format_stalls(self):
+        """Текстовый отчёт о последних остановках (новые сверху)."""
+        if not self.stalls:
+            return ""
+        parts = []
+        for stall in reversed(self.stalls):
+            at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stall["at"]))
+            stack = "\n  ".join(stall["stack"]) or "стек не снят"
+            parts.append(f"{at} — {stall['duration']:.2f} с\n  {stack}")
+        return "\n\n".join(parts) + "\n"
+
+
+def profile_stacks(duration, interval=PROFILE_SAMPLE_INTERVAL):
+    """
+    Выборочный профиль всех потоков процесса (кроме вызывающего). Блокирует
+    вызывающий поток на duration секунд — из event loop вызывается через
+    run_in_executor. Возвращает Counter {"поток;кадр;...;кадр": число выборок}.
+    """
+    own = threading.get_ident()
+    deadline = time.monotonic() + duration
+    samples = Counter()
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = [names.get(thread_id, str(thread_id))] + _frame_stack(frame)
+            samples[";".join(stack)] += 1
+        time.sleep(interval)
+    return samples
+
+
+def collapsed_report(samples):
+    """Свёрнутые стеки для flamegraph.pl / speedscope: по строке "стек число"."""
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def top_frames(samples, thread_name, limit=10):
+    """Кадры, на которых поток чаще всего находился (вершина стека), с долей выборок."""
+    leaves = Counter()
+    for stack, count in samples.items():
+        frames = stack.split(";")
+        if frames[0] == thread_name and len(frames) > 1:
+            leaves[frames[-1]] += count
+    total = sum(leaves.values())
+    return [(frame, count / total) for frame, count in leaves.most_common(limit)] if total else []
+
+
+loop_watchdog = LoopWatchdog()
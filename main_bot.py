@@ -1,32 +1,58 @@
+import argparse
 import asyncio
+import io
 import os
-import json
 import sys
 
-from telethon import TelegramClient, events, Button
+from telethon import events, Button
+from helpers import delete_news_image, get_next_id
 from rss_parser import NewsFetcher
 from tg_parser import TelegramParser
 
 import logging
-import shutil
+import time
 
 import gpt_style_translation
-
-API_ID = 00000000
-API_HASH = 'ADD API_HASH'
-BOT_TOKEN = 'ADD BOT TOKEN'
-
-LINKAGES_FILE = 'resources.json'
-PASSWORD_FILE = 'password.txt'
-user_states = {}
-authenticated_users = set()
-
-CHECK_INTERVAL = 10
-
-client = TelegramClient('bot_session', API_ID, API_HASH).start(bot_token=BOT_TOKEN)
-
-rss_fetcher = NewsFetcher()
-telegram_parser = TelegramParser(API_ID, API_HASH)
+from config import (API_ID, API_HASH, PASSWORD_FILE, CHECK_INTERVAL, METRICS_HOST, METRICS_PORT,
+                    TRANSFORM_BATCH_WINDOW, PROFILE_DURATION, PREVIEW_HANDOFF_TIMEOUT)
+from linkage_store import linkages_version, load_linkages, recover_linkages, save_linkages
+from metrics import metrics, start_metrics_server
+from backpressure import admit_pending, expire_pending, find_orphan_images, pending_limits
+from scheduler import PollScheduler
+from circuit_breaker import host_health
+from image_index import image_index
+from work_queue import WorkQueue, consume, default_worker_id, MODERATION_QUEUE, TRANSFORM_QUEUE, PUBLISH_QUEUE
+from workers import IngestWorker, TransformWorker
+from session_store import SessionStore
+from live_preview import PreviewStreams
+from token_budget import gpt_usage
+from priority import LANE_MARKS, lane_of, record_latency
+from fair_share import describe_shares
+from bot_pool import BotPool, UnknownBotError
+from loop_monitor import collapsed_report, loop_watchdog, profile_stacks, top_frames
+
+sessions = SessionStore()
+user_states = sessions.states
+authenticated_users = sessions.authenticated
+
+PENDING_SWEEP_INTERVAL = 60
+
+DIGEST_SIZE = 10
+DIGEST_INTERVAL = 300
+DIGEST_PAGE_SIZE = 10
+DIGEST_PREVIEW_LENGTH = 150
+PREVIEW_LENGTH = 350
+
+bots = BotPool()
+# Первый бот пула обслуживает интерфейс администратора.
+client = bots.primary.client
+
+work_queue = WorkQueue()
+preview_streams = PreviewStreams()
+ingest_worker = None
+profile_lock = asyncio.Lock()
+
+_moderation_chats = {"version": None, "ids": frozenset()}
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -51,110 +77,85 @@ def load_password():
         sys.exit(1)
 
 
-def load_linkages():
-    """Загружает данные связок из JSON файла."""
-    logger.debug("Загрузка связок из JSON файла.")
-    if not os.path.exists(LINKAGES_FILE) or os.stat(LINKAGES_FILE).st_size == 0:
-        logger.info(f"{LINKAGES_FILE} отсутствует или пуст. Инициализация с пустой структурой.")
-        with open(LINKAGES_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"linkages": {}}, f, ensure_ascii=False, indent=4)
-        return {"linkages": {}}
-
-    try:
-        with open(LINKAGES_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if "linkages" not in data:
-                raise ValueError("Неверная структура JSON: отсутствует 'linkages'.")
-            logger.debug(f"Связки загружены: {data}")
-            return data
-    except (json.JSONDecodeError, ValueError) as e:
-        logger.error(f"Ошибка при чтении {LINKAGES_FILE}: {e}. Повторная инициализация файла.")
-        with open(LINKAGES_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"linkages": {}}, f, ensure_ascii=False, indent=4)
-        return {"linkages": {}}
-
-
-def save_linkages(data):
-    """Сохраняет обновлённые данные связок обратно в JSON файл с созданием резервной копии."""
-    logger.debug("Сохранение обновлённых связок в JSON файл.")
-    try:
-
-        if os.path.exists(LINKAGES_FILE):
-            backup_file = LINKAGES_FILE + ".bak"
-            shutil.copy(LINKAGES_FILE, backup_file)
-            logger.debug(f"Резервная копия {LINKAGES_FILE} создана как {backup_file}")
-
-        with open(LINKAGES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        logger.debug(f"Обновлённые связки сохранены: {data}")
-    except Exception as e:
-        logger.error(f"Не удалось сохранить связки в {LINKAGES_FILE}: {e}")
-
-        backup_file = LINKAGES_FILE + ".bak"
-        if os.path.exists(backup_file):
-            shutil.copy(backup_file, LINKAGES_FILE)
-            logger.debug(f"{LINKAGES_FILE} восстановлен из резервной копии.")
+def parse_resources(text):
+    """
+    Разбирает список ресурсов, введённых через ';'.
+    Через '|' можно закрепить интервал опроса в секундах: "https://t.me/example | 300".
+    """
+    resources = []
+    for item in text.split(";"):
+        url, _, interval = item.partition("|")
+        url = url.strip()
+        if not url:
+            continue
+        resource = {"url": url}
+        if interval.strip().isdigit():
+            resource["poll_interval"] = int(interval.strip())
+        resources.append(resource)
+    return resources
+
+
+def pin_linkage_bots():
+    """Закрепляет связки, созданные до появления пула ботов, за первым ботом."""
+    data = load_linkages()
+    pinned = bots.pin_unassigned(data["linkages"])
+    if pinned:
+        save_linkages(data)
+        logger.info(f"Связки без бота закреплены за {bots.primary.name}: {', '.join(pinned)}.")
+    for name, linkage in data["linkages"].items():
+        try:
+            bots.shard_for(name, linkage)
+        except UnknownBotError as e:
+            logger.error(f"{e}: карточки и публикации связки не отправляются.")
 
 
 def is_moderation_chat(chat_id):
     """
     Проверяет, является ли данный чат модерационным для какой-либо связки.
-    Возвращает True, если чат модерационный, иначе False.
+    Множество чатов пересчитывается, только когда меняется хранилище связок.
     """
-    data = load_linkages()
-    for linkage in data["linkages"].values():
-        if linkage.get("moderation_bot") == chat_id:
-            return True
-    return False
+    version = linkages_version()
+    if version != _moderation_chats["version"]:
+        data = load_linkages()
+        _moderation_chats["ids"] = frozenset(linkage.get("moderation_bot") for linkage in data["linkages"].values())
+        _moderation_chats["version"] = version
+    return chat_id in _moderation_chats["ids"]
 
 
-async def moderate_news():
-    """Основной цикл обработки новостей."""
-    while True:
-        data = load_linkages()
-        linkages = data.get("linkages", {})
-
-        for linkage_name, linkage_data in linkages.items():
-            if not linkage_data.get("is_active", False):
-                continue
-
-            if not linkage_data.get("moderation_bot"):
-                logger.warning(f"Связка '{linkage_name}' не имеет модерационного чата. Пропускаем.")
-                continue
-
-            if not linkage_data.get("publication_channel"):
-                logger.warning(f"Связка '{linkage_name}' не имеет канала публикации. Пропускаем.")
-                continue
-
-            try:
-                resources = linkage_data.get("resources", [])
-                if not resources:
-                    logger.warning(f"Нет ресурсов для связки {linkage_name}. Пропускаем...")
-                    continue
-
-                for resource in resources:
-                    url = resource.get("url")
-                    if "rss" in url or "feed" in url:
-                        logger.info(f"Обрабатываем RSS канал: {url}")
-                        rss_news = rss_fetcher.fetch_new_rss_news([url], f"rss_db_{linkage_name}.csv")
-                        for news in rss_news:
-                            await send_to_moderation(news, linkage_name, linkage_data["moderation_bot"])
-
-                    elif "t.me" in url:
-                        logger.info(f"Обрабатываем Telegram-канал: {url}")
-                        tg_news = await telegram_parser.fetch_new_telegram_news([url], f"tg_db_{linkage_name}.csv")
-                        for news in tg_news:
-                            await send_to_moderation(news, linkage_name, linkage_data["moderation_bot"])
-
-            except Exception as e:
-                logger.error(f"Ошибка обработки связки '{linkage_name}': {e}")
+async def deliver_to_moderation(payload):
+    """Отправляет новость из очереди moderation в чат модерации её связки."""
+    linkage_name = payload["linkage_name"]
+    linkage = load_linkages()["linkages"].get(linkage_name)
+    if not linkage or not linkage.get("moderation_bot"):
+        logger.warning(f"Связка '{linkage_name}' не найдена или не имеет чата модерации. Новость пропущена.")
+        return
+    if linkage.get("moderation_mode") == "digest" and lane_of(payload["news"]) != "high":
+        await queue_for_digest(payload["news"], linkage_name)
+        return
+    await send_to_moderation(payload["news"], linkage_name, linkage["moderation_bot"])
 
-        await asyncio.sleep(CHECK_INTERVAL)
+
+async def deliver_publication(payload):
+    """
+    Публикует обработанную GPT новость из очереди publish и удаляет её изображение.
+    Ошибка публикации пробрасывается: задача возвращается в очередь, изображение остаётся.
+    """
+    news = payload["news"]
+    linkage_name = payload["linkage_name"]
+    linkage = load_linkages()["linkages"].get(linkage_name)
+    if not linkage or not linkage.get("publication_channel"):
+        logger.warning(f"Связка '{linkage_name}' не найдена или не имеет канала публикации. Новость пропущена.")
+    else:
+        await publish_news(news, linkage["publication_channel"], payload["text"], linkage_name, linkage)
+
+    delete_news_image(news)
 
 
 async def send_to_moderation(news, linkage_name, moderation_group_link):
     """
     Отправляет новость в модерационный чат с изображением, если оно есть.
+    Ошибка отправки пробрасывается, чтобы задача очереди moderation была повторена;
+    повторная попытка не добавляет новость в pending_news второй раз.
 
     Параметры:
         news (dict): Данные новости, включая текст, путь к изображению (если есть), источник и т.д.
@@ -172,65 +173,134 @@ async def send_to_moderation(news, linkage_name, moderation_group_link):
             logger.warning(f"Связка '{linkage_name}' не найдена.")
             return
 
+        bot = bots.client_for(linkage_name, linkage)
+        summary = None
         pending_news = linkage.get("pending_news", [])
         if not any(n.get("id") == news["id"] for n in pending_news):
-            pending_news.append(news)
-            linkage["pending_news"] = pending_news
+            admitted, evicted, summary = admit_pending(linkage, news)
+            if not admitted:
+                logger.warning(f"Очередь модерации связки '{linkage_name}' заполнена. Новость ID {news['id']} отброшена.")
+                metrics.inc("items_dropped_total", linkage=linkage_name, reason="overflow")
+                delete_news_image(news)
+                return
             save_linkages(data)
+            discard_evicted(evicted, linkage_name)
             logger.debug(f"Новость добавлена в pending_news для связки '{linkage_name}'.")
 
-        text = f"📰 **Новая новость для модерации:**\n\n{news['txt'][:500]}"
+        text = f"{LANE_MARKS[lane_of(news)]}📰 **Новая новость для модерации:**\n\n{news['txt'][:500]}"
+        duplicate = news.get("image_duplicate_of")
+        if duplicate:
+            text += f"\n\n🖼 Возможный дубль: это изображение уже было у {duplicate.get('src_name') or duplicate.get('src')}"
         buttons = [
             [Button.inline("✅ Принять", f"accept:{news['id']}:{linkage_name}")],
             [Button.inline("❌ Отклонить", f"reject:{news['id']}:{linkage_name}")]
         ]
 
-        if news.get("img"):
-            img_path = news["img"]
-
-            if os.path.exists(img_path):
-                try:
-
-                    await client.send_file(
-                        moderation_group_link,
-                        file=img_path,
-                        caption=text,
-                        buttons=buttons,
-                        parse_mode='md'
-                    )
-                    logger.info(f"Новость с изображением отправлена в модерационный чат {moderation_group_link}.")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке изображения: {e}. Отправляем только текстовое сообщение.")
-
-                    await client.send_message(
+        with metrics.timer("moderation_send", linkage_name, news.get("src")):
+            if news.get("img"):
+                img_path = news["img"]
+
+                if os.path.exists(img_path):
+                    try:
+
+                        message = await bot.send_file(
+                            moderation_group_link,
+                            file=img_path,
+                            caption=text,
+                            buttons=buttons,
+                            parse_mode='md'
+                        )
+                        logger.info(f"Новость с изображением отправлена в модерационный чат {moderation_group_link}.")
+                    except Exception as e:
+                        logger.error(f"Ошибка при отправке изображения: {e}. Отправляем только текстовое сообщение.")
+
+                        message = await bot.send_message(
+                            moderation_group_link,
+                            text,
+                            buttons=buttons,
+                            parse_mode='md'
+                        )
+                else:
+                    logger.warning(f"Файл изображения не найден: {img_path}. Отправляем только текстовое сообщение.")
+                    message = await bot.send_message(
                         moderation_group_link,
                         text,
                         buttons=buttons,
                         parse_mode='md'
                     )
             else:
-                logger.warning(f"Файл изображения не найден: {img_path}. Отправляем только текстовое сообщение.")
-                await client.send_message(
+
+                logger.info(f"Изображение для новости ID {news['id']} отсутствует. Отправляем только текстовое сообщение.")
+                message = await bot.send_message(
                     moderation_group_link,
                     text,
                     buttons=buttons,
                     parse_mode='md'
                 )
-        else:
+        metrics.inc("items_moderation_total", linkage=linkage_name, source=news.get("src"))
 
-            logger.info(f"Изображение для новости ID {news['id']} отсутствует. Отправляем только текстовое сообщение.")
-            await client.send_message(
-                moderation_group_link,
-                text,
-                buttons=buttons,
-                parse_mode='md'
-            )
+        if linkage.get("stream_preview"):
+            start_preview(news, linkage_name, linkage, bot, moderation_group_link, message, text, buttons)
 
     except Exception as e:
         logger.error(f"Ошибка при отправке новости на модерацию: {e}")
+        raise
+
+    if summary:
+        try:
+            await send_to_moderation(summary, linkage_name, moderation_group_link)
+        except Exception:
+            # Сводка о вытесненных новостях остаётся в pending_news; карточку основной новости не повторяем.
+            pass
 
 
-@client.on(events.CallbackQuery(pattern=r"^(accept|reject):(\d+):(.+)$"))
+def transform_batch_delay(data, linkage_name, news):
+    """
+    Если та же новость ещё ждёт модерации в других связках, задача transform
+    откладывается на TRANSFORM_BATCH_WINDOW секунд: принятые за это время
+    копии будут преобразованы одним запросом. Новости полосы high не ждут.
+    """
+    if lane_of(news) == "high" or news.get("transformed"):
+        return 0
+    for name, linkage in data["linkages"].items():
+        if name != linkage_name and any(n.get("txt") == news["txt"] for n in linkage.get("pending_news", [])):
+            return TRANSFORM_BATCH_WINDOW
+    return 0
+
+
+def start_preview(news, linkage_name, linkage, bot, moderation_group_link, message, card_text, buttons):
+    """Запускает потоковый предпросмотр GPT в отправленной карточке модерации."""
+    if gpt_style_translation.cap_reached(linkage_name, linkage):
+        return
+
+    def render(text, done):
+        status = "готово" if done else "пишет…"
+        return f"{card_text}\n\n✍️ **GPT ({status}):**\n{text[:PREVIEW_LENGTH]}"
+
+    async def edit(text):
+        await bot.edit_message(moderation_group_link, message, text, buttons=buttons, parse_mode='md')
+
+    def on_done(text):
+        remember_transformed(linkage_name, news["id"], text)
+
+    prompt = linkage.get("prompt", gpt_style_translation.default_prompt)
+    preview_streams.start((linkage_name, str(news["id"])), news, prompt, linkage, render, edit, on_done)
+
+
+def remember_transformed(linkage_name, news_id, text):
+    """Сохраняет готовый текст предпросмотра в новости из pending_news, чтобы не запрашивать GPT повторно."""
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name)
+    if not linkage:
+        return
+    news = next((n for n in linkage.get("pending_news", []) if n["id"] == news_id), None)
+    if news is None:
+        return
+    news["transformed"] = text
+    save_linkages(data)
+
+
+@bots.on(events.CallbackQuery(pattern=r"^(accept|reject):(\d+):(.+)$"))
 async def handle_moderation_action(event):
     """
     Обрабатывает действия модерации (только в модерационных чатах).
@@ -292,21 +362,27 @@ async def process_moderation_action(event, linkage_name):
             return
 
         if action == "accept":
-
-            await publish_news(news, linkage["publication_channel"])
-            new_text = f"✅ **Новость принята и опубликована.**\n\n**Текст новости:**\n{news['txt'][:300]}\n\nИсточник: {news['src']}"
+            stream = preview_streams.detach((linkage_name, news_id))
+            if stream is None:
+                work_queue.put(TRANSFORM_QUEUE, {"linkage_name": linkage_name, "news": news},
+                               delay=transform_batch_delay(data, linkage_name, news))
+            else:
+                # Задача ставится сразу и ждёт текст предпросмотра; если процесс
+                # упадёт раньше, через PREVIEW_HANDOFF_TIMEOUT она выполнится обычным запросом.
+                job_id = work_queue.put(TRANSFORM_QUEUE, {"linkage_name": linkage_name, "news": news},
+                                        delay=PREVIEW_HANDOFF_TIMEOUT)
+                asyncio.create_task(attach_preview_text(stream, job_id, linkage_name, dict(news)))
+            new_text = f"✅ **Новость принята и отправлена на публикацию.**\n\n**Текст новости:**\n{news['txt'][:300]}\n\nИсточник: {news['src']}"
         else:
             new_text = f"❌ **Новость отклонена.**\n\n**Текст новости:**\n{news['txt'][:300]}\n\nИсточник: {news['src']}"
 
-        if news.get("img") and os.path.exists(news["img"]):
-            try:
-                os.remove(news["img"])
-                logger.info(f"Изображение {news['img']} успешно удалено после действия {action}.")
-            except Exception as e:
-                logger.error(f"Ошибка удаления изображения {news['img']}: {e}")
+        if action != "accept":
+            preview_streams.cancel((linkage_name, news_id))
+            delete_news_image(news)
 
         pending_news.remove(news)
         linkage["pending_news"] = pending_news
+        linkage["last_moderated_at"] = time.time()
         save_linkages(data)
 
         await event.edit(new_text, buttons=None)
@@ -319,49 +395,385 @@ async def process_moderation_action(event, linkage_name):
         await event.answer("❌ Произошла ошибка. Повторите позже.", alert=True)
 
 
-async def publish_news(news, publication_channel_link):
+async def attach_preview_text(stream, job_id, linkage_name, news):
     """
-    Публикует новость в указанный канал.
+    Передаёт текст дописанного предпросмотра в задачу преобразования принятой
+    новости и отпускает её; если поток оборвался, новость преобразуется обычным запросом.
     """
     try:
-        logger.debug(f"Обрабатываем публикацию новости ID {news['id']} в канал {publication_channel_link}.")
+        text = await stream
+    except (asyncio.CancelledError, Exception):
+        text = None
+    if text:
+        news["transformed"] = text
+    try:
+        delay = 0 if text else transform_batch_delay(load_linkages(), linkage_name, news)
+        if not work_queue.reschedule(job_id, TRANSFORM_QUEUE, {"linkage_name": linkage_name, "news": news}, delay):
+            logger.info(f"Задача {job_id} новости {news['id']} уже взята, текст предпросмотра не понадобился.")
+    except Exception as e:
+        logger.error(f"Не удалось передать предпросмотр новости {news['id']} связки '{linkage_name}' в задачу {job_id}: {e}")
+
+
+def discard_evicted(evicted, linkage_name, reason="overflow"):
+    """
+    Удаляет изображения новостей, вытесненных из pending_news, отменяет их
+    предпросмотр и учитывает их в метриках.
+    """
+    for news in evicted:
+        preview_streams.cancel((linkage_name, str(news["id"])))
+        delete_news_image(news)
+    if evicted:
+        metrics.inc("items_dropped_total", len(evicted), linkage=linkage_name, reason=reason)
+        logger.info(f"Из очереди модерации связки '{linkage_name}' удалено {len(evicted)} новостей ({reason}).")
+
+
+async def run_pending_sweeper():
+    """
+    Периодически удаляет из pending_news новости старше pending_ttl,
+    давно лежащие в failed задачи очереди и изображения, на которые
+    больше не ссылается ни одна новость.
+    """
+    while True:
+        try:
+            data = load_linkages()
+            changed = False
+            for linkage_name, linkage in data["linkages"].items():
+                expired = expire_pending(linkage)
+                if expired:
+                    changed = True
+                    discard_evicted(expired, linkage_name, reason="expired")
+            if changed:
+                save_linkages(data)
+
+            purged = work_queue.purge_failed()
+            if purged:
+                logger.info(f"Из очереди удалено задач, слишком долго лежавших в failed: {purged}.")
+
+            # Изображение нужно, пока на него ссылается новость в модерации,
+            # задача в очереди или запись индекса изображений.
+            referenced = {n.get("img") for linkage in data["linkages"].values()
+                          for n in linkage.get("pending_news", [])}
+            referenced |= work_queue.image_paths()
+            referenced |= image_index.referenced_paths()
+            for path in find_orphan_images("images", referenced):
+                os.remove(path)
+                image_index.forget(path)
+                logger.info(f"Удалено осиротевшее изображение {path}.")
+        except Exception as e:
+            logger.error(f"Ошибка очистки очередей модерации: {e}")
+        await asyncio.sleep(PENDING_SWEEP_INTERVAL)
+
+
+async def queue_for_digest(news, linkage_name):
+    """
+    Режим дайджеста: новость ждёт в pending_news, пока не наберётся
+    digest_size новостей или самая старая не прождёт digest_interval секунд.
+    """
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name)
+    if not linkage:
+        logger.warning(f"Связка '{linkage_name}' не найдена.")
+        return
+
+    if not any(n.get("id") == news["id"] for n in linkage.get("pending_news", [])):
+        news["awaiting_digest"] = True
+        admitted, evicted, summary = admit_pending(linkage, news)
+        if not admitted:
+            logger.warning(f"Очередь модерации связки '{linkage_name}' заполнена. Новость ID {news['id']} отброшена.")
+            metrics.inc("items_dropped_total", linkage=linkage_name, reason="overflow")
+            delete_news_image(news)
+            return
+        if summary:
+            summary["awaiting_digest"] = True
+        save_linkages(data)
+        discard_evicted(evicted, linkage_name)
+        logger.debug(f"Новость ID {news['id']} ждёт дайджеста в связке '{linkage_name}'.")
+
+    waiting = sum(1 for n in linkage["pending_news"] if n.get("awaiting_digest"))
+    if waiting >= linkage.get("digest_size", DIGEST_SIZE):
+        await flush_digests(linkage_names=[linkage_name])
+
 
+async def flush_digests(linkage_names=None, force=False):
+    """Отправляет накопившиеся дайджесты по связкам в режиме digest."""
+    data = load_linkages()
+    now = time.time()
+    outgoing = []
+
+    for linkage_name, linkage in data["linkages"].items():
+        if linkage_names is not None and linkage_name not in linkage_names:
+            continue
+        if linkage.get("moderation_mode") != "digest" or not linkage.get("moderation_bot"):
+            continue
+
+        digest_size = linkage.get("digest_size", DIGEST_SIZE)
+        waiting = [n for n in linkage.get("pending_news", []) if n.get("awaiting_digest")]
+        if not waiting:
+            continue
+        oldest_age = now - min(n.get("queued_at", now) for n in waiting)
+        if len(waiting) < digest_size and oldest_age < linkage.get("digest_interval", DIGEST_INTERVAL) and not force:
+            continue
+
+        for start in range(0, len(waiting), digest_size):
+            chunk = waiting[start:start + digest_size]
+            digest_id = get_next_id()
+            for news in chunk:
+                news.pop("awaiting_digest", None)
+                news["digest"] = digest_id
+            linkage.setdefault("digests", {})[digest_id] = {
+                "items": [n["id"] for n in chunk],
+                "selected": [],
+                "page": 0,
+            }
+            outgoing.append((linkage_name, linkage, digest_id))
+
+    if not outgoing:
+        return
+    save_linkages(data)
+
+    for linkage_name, linkage, digest_id in outgoing:
+        await send_digest(linkage_name, linkage, digest_id)
+
+
+def render_digest(digest_id, digest, pending_by_id):
+    """Формирует текст и кнопки страницы дайджеста."""
+    items = [pending_by_id[news_id] for news_id in digest["items"] if news_id in pending_by_id]
+    pages = max(1, -(-len(items) // DIGEST_PAGE_SIZE))
+    page = min(digest.get("page", 0), pages - 1)
+    offset = page * DIGEST_PAGE_SIZE
+    selected = set(digest.get("selected", []))
+
+    text = f"📰 **Дайджест для модерации #{digest_id}**"
+    if pages > 1:
+        text += f" (стр. {page + 1}/{pages})"
+    text += "\n\n"
+    for number, news in enumerate(items[offset:offset + DIGEST_PAGE_SIZE], start=offset + 1):
+        mark = "☑️" if news["id"] in selected else "☐"
+        preview = news["txt"][:DIGEST_PREVIEW_LENGTH]
+        text += f"{mark} **{number}.** {preview}{'…' if len(news['txt']) > DIGEST_PREVIEW_LENGTH else ''}\n" \
+                f"_{news.get('src_name', news.get('src'))}_\n\n"
+
+    toggles = []
+    for number, news in enumerate(items[offset:offset + DIGEST_PAGE_SIZE], start=offset + 1):
+        mark = "☑️" if news["id"] in selected else "☐"
+        toggles.append(Button.inline(f"{mark} {number}", f"dg:t:{digest_id}:{news['id']}"))
+    buttons = [toggles[i:i + 5] for i in range(0, len(toggles), 5)]
+
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(Button.inline("◀️", f"dg:p:{digest_id}:{page - 1}"))
+        if page < pages - 1:
+            navigation.append(Button.inline("▶️", f"dg:p:{digest_id}:{page + 1}"))
+        buttons.append(navigation)
+
+    buttons.append([Button.inline(f"✅ Принять выбранные ({len(selected)})", f"dg:sel:{digest_id}")])
+    buttons.append([Button.inline("✅ Принять все", f"dg:all:{digest_id}"),
+                    Button.inline("❌ Отклонить все", f"dg:none:{digest_id}")])
+    return text, buttons
+
+
+async def send_digest(linkage_name, linkage, digest_id):
+    """Отправляет дайджест: альбом изображений (если есть) и сообщение с кнопками."""
+    pending_by_id = {n["id"]: n for n in linkage.get("pending_news", [])}
+    digest = linkage["digests"][digest_id]
+    items = [pending_by_id[news_id] for news_id in digest["items"] if news_id in pending_by_id]
+    moderation_chat = linkage["moderation_bot"]
+    bot = bots.client_for(linkage_name, linkage)
+
+    try:
+        with metrics.timer("moderation_send", linkage_name, "digest"):
+            album = [(number, n["img"]) for number, n in enumerate(items, start=1)
+                     if n.get("img") and os.path.exists(n["img"])][:10]
+            if album:
+                try:
+                    await bot.send_file(
+                        moderation_chat,
+                        file=[path for _, path in album],
+                        caption=[f"#{digest_id} · {number}" for number, _ in album]
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка отправки альбома дайджеста #{digest_id}: {e}")
+
+            text, buttons = render_digest(digest_id, digest, pending_by_id)
+            await bot.send_message(moderation_chat, text, buttons=buttons, parse_mode='md')
+        metrics.inc("items_moderation_total", len(items), linkage=linkage_name, source="digest")
+        logger.info(f"Дайджест #{digest_id} из {len(items)} новостей отправлен в чат {moderation_chat}.")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке дайджеста #{digest_id} связки '{linkage_name}': {e}")
+        requeue_digest(linkage_name, digest_id)
+
+
+def requeue_digest(linkage_name, digest_id):
+    """Возвращает новости неотправленного дайджеста в ожидание: их отправит следующий проход flush_digests."""
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name)
+    if not linkage or digest_id not in linkage.get("digests", {}):
+        return
+    del linkage["digests"][digest_id]
+    for news in linkage.get("pending_news", []):
+        if news.get("digest") == digest_id:
+            news.pop("digest", None)
+            news["awaiting_digest"] = True
+    save_linkages(data)
+
+
+async def run_digest_flusher():
+    """Периодически отправляет дайджесты, самая старая новость которых ждёт дольше digest_interval."""
+    while True:
+        await asyncio.sleep(CHECK_INTERVAL)
+        try:
+            await flush_digests()
+        except Exception as e:
+            logger.error(f"Ошибка отправки дайджестов: {e}")
+
+
+def apply_bulk_decision(data, linkage_name, linkage, accepted_ids, rejected_ids):
+    """
+    Применяет решения модератора по нескольким новостям одной транзакцией:
+    одно сохранение связок и одна пачка задач в очередь transform.
+    """
+    accepted_ids, rejected_ids = set(accepted_ids), set(rejected_ids)
+    pending_news = linkage.get("pending_news", [])
+    accepted, rejected, remaining = [], [], []
+    for news in pending_news:
+        if news["id"] in accepted_ids:
+            accepted.append(news)
+        elif news["id"] in rejected_ids:
+            rejected.append(news)
+        else:
+            remaining.append(news)
+
+    if accepted:
+        work_queue.put_many(TRANSFORM_QUEUE, [{"linkage_name": linkage_name, "news": n} for n in accepted])
+    linkage["pending_news"] = remaining
+    linkage["last_moderated_at"] = time.time()
+    save_linkages(data)
+
+    for news in rejected:
+        delete_news_image(news)
+    return accepted, rejected
+
+
+@bots.on(events.CallbackQuery(pattern=r"^dg:(t|p|sel|all|none):(\d+)(?::(\d+))?$"))
+async def handle_digest_action(event):
+    """
+    Обрабатывает кнопки дайджеста: переключение отметки (t), страницы (p)
+    и массовые действия: принять выбранные (sel), принять все (all), отклонить все (none).
+    """
+    try:
+        parts = event.data.decode().split(":")
+        op, digest_id = parts[1], parts[2]
+        argument = parts[3] if len(parts) > 3 else None
         data = load_linkages()
-        linkage_name = next(
-            (name for name, linkage in data["linkages"].items() if linkage["publication_channel"] == publication_channel_link),
-            None
+        linkage_name, linkage = next(
+            ((name, l) for name, l in data["linkages"].items() if l.get("moderation_bot") == event.chat_id),
+            (None, None)
         )
+        if not linkage:
+            await event.answer("❌ Этот чат не связан с модерацией.", alert=True)
+            return
 
-        custom_prompt = data["linkages"].get(linkage_name, {}).get(
-            "prompt",
-            "Translate the following text into Azerbaijani, "
-            "without prefaces, and remove various links or mentions of channels "
-            "or watermarks, if text is too small do not add nothing new to it. "
-            "This is text for news channels. The text needs to be made interesting and up to 1024 characters."
-        )
+        digest = linkage.get("digests", {}).get(digest_id)
+        if not digest:
+            await event.answer("❌ Дайджест уже обработан.", alert=True)
+            return
 
-        translated_text = await gpt_style_translation.transform_text_gpt(news['txt'], custom_prompt)
+        pending_by_id = {n["id"]: n for n in linkage.get("pending_news", [])}
+        items = [news_id for news_id in digest["items"] if news_id in pending_by_id]
 
-        channel_entity = await client.get_entity(publication_channel_link)
+        if op in ("t", "p"):
+            if op == "t":
+                selected = digest.setdefault("selected", [])
+                if argument in selected:
+                    selected.remove(argument)
+                elif argument in items:
+                    selected.append(argument)
+            else:
+                digest["page"] = int(argument)
+            linkage["last_moderated_at"] = time.time()
+            save_linkages(data)
+            text, buttons = render_digest(digest_id, digest, pending_by_id)
+            await event.edit(text, buttons=buttons, parse_mode='md')
+            await event.answer()
+            return
 
-        if news.get("img") and os.path.exists(news["img"]):
-            await client.send_file(
-                channel_entity,
-                file=news["img"],
-                caption=translated_text[:1024],
-                parse_mode='md'
-            )
+        if op == "sel":
+            accepted_ids = [news_id for news_id in items if news_id in digest.get("selected", [])]
+        elif op == "all":
+            accepted_ids = items
         else:
-            await client.send_message(
-                channel_entity,
-                translated_text,
-                parse_mode='md'
-            )
+            accepted_ids = []
+        rejected_ids = [news_id for news_id in items if news_id not in accepted_ids]
+
+        del linkage["digests"][digest_id]
+        accepted, rejected = apply_bulk_decision(data, linkage_name, linkage, accepted_ids, rejected_ids)
+
+        await event.edit(
+            f"🗂 **Дайджест #{digest_id} обработан.**\n\n"
+            f"✅ Принято и отправлено на публикацию: {len(accepted)}\n"
+            f"❌ Отклонено: {len(rejected)}",
+            buttons=None
+        )
+        await event.answer("✔️ Действие обработано.")
+        logger.info(f"Дайджест #{digest_id} связки '{linkage_name}': принято {len(accepted)}, отклонено {len(rejected)}.")
+
+    except Exception as e:
+        logger.error(f"Ошибка обработки действия дайджеста: {e}")
+        await event.answer("❌ Произошла ошибка. Повторите позже.", alert=True)
+
+
+async def publish_news(news, publication_channel_link, translated_text=None, linkage_name=None, linkage=None):
+    """
+    Публикует новость в указанный канал.
+    Если translated_text не передан, текст предварительно обрабатывается GPT.
+    Ошибка публикации пробрасывается вызывающему.
+    """
+    try:
+        logger.debug(f"Обрабатываем публикацию новости ID {news['id']} в канал {publication_channel_link}.")
+
+        if linkage is None:
+            data = load_linkages()
+            if linkage_name is None:
+                linkage_name = next(
+                    (name for name, linkage in data["linkages"].items()
+                     if linkage["publication_channel"] == publication_channel_link),
+                    None
+                )
+            linkage = data["linkages"].get(linkage_name, {})
+        bot = bots.client_for(linkage_name, linkage)
+
+        if translated_text is None:
+            custom_prompt = linkage.get("prompt", gpt_style_translation.default_prompt)
+
+            with metrics.timer("gpt_transform", linkage_name, news.get("src")):
+                translated_text = await gpt_style_translation.transform_text_gpt(
+                    news['txt'], custom_prompt, linkage_name, linkage)
+
+        with metrics.timer("publish", linkage_name, news.get("src")):
+            channel_entity = await bot.get_entity(publication_channel_link)
+
+            if news.get("img") and os.path.exists(news["img"]):
+                await bot.send_file(
+                    channel_entity,
+                    file=news["img"],
+                    caption=translated_text[:1024],
+                    parse_mode='md'
+                )
+            else:
+                await bot.send_message(
+                    channel_entity,
+                    translated_text,
+                    parse_mode='md'
+                )
+        metrics.inc("items_published_total", linkage=linkage_name, source=news.get("src"))
+        record_latency(news, linkage_name)
 
         logger.info(f"Новость ID {news['id']} успешно опубликована в {publication_channel_link}.")
 
     except Exception as e:
         logger.error(f"Ошибка публикации новости: {e}")
+        raise
 
 
 async def manage_linkages(event):
@@ -401,78 +813,151 @@ async def view_linkages(event):
         await event.reply("❌ Связок пока нет.")
         return
 
+    schedule = ingest_worker.scheduler if ingest_worker else PollScheduler.from_state_files()
     message = "📋 **Список текущих связок:**\n\n"
     for name, details in linkages.items():
         status = "✅ Активна" if details["is_active"] else "⏸️ Приостановлена"
         publication_channel = details.get("publication_channel", "Не указано")
         resources = details.get("resources", [])
-        resources_text = "\n".join(f"• {res['url']}" for res in resources) if resources else "Нет добавленных ресурсов"
+        resources_text = "\n".join(
+            f"• {host_health.describe(res['url'])} {res['url']} "
+            f"({schedule.describe(res['url'], res.get('poll_interval'))})" for res in resources
+        ) if resources else "Нет добавленных ресурсов"
         prompt = details.get("prompt", gpt_style_translation.default_prompt)
+        moderation_mode = "дайджесты" if details.get("moderation_mode") == "digest" else "отдельные карточки"
+        max_pending, _, overflow_policy = pending_limits(details)
 
         message += (
             f"🔑 **Название связки:** {name}\n"
             f"📢 **Канал публикации:** {publication_channel}\n"
             f"🔗 **Ресурсы:**\n{resources_text}\n"
             f"📝 **Промпт:**\n{prompt}\n"
+            f"🗂 **Модерация:** {moderation_mode}\n"
+            f"📥 **Ожидают модерации:** {len(details.get('pending_news', []))}/{max_pending} ({overflow_policy})\n"
+            f"💰 **GPT сегодня:** {gpt_usage.describe(name, details)}\n"
+            f"⚖️ **Доля ресурсов:** {describe_shares(name)}\n"
+            f"🤖 **Бот:** {bots.describe_shard(name, details)}\n"
             f"📌 **Статус:** {status}\n\n"
         )
 
     await event.reply(message)
 
 
-@client.on(events.ChatAction)
+async def view_metrics(event):
+    """Показывает сводку метрик конвейера: длительности этапов, дубли, публикации."""
+    user_id = event.sender_id
+
+    if user_id not in authenticated_users:
+        await event.reply("🔒 Пожалуйста, введите пароль для доступа к боту:")
+        user_states[user_id] = {"step": "AWAITING_PASSWORD"}
+        return
+
+    summary = metrics.format_summary()
+    if len(bots.shards) > 1:
+        summary += f"\n🤖 **Связок на бот:** {bots.describe_load(load_linkages()['linkages'])}\n"
+    if ingest_worker:
+        summary += f"\n📡 **Сессии парсера:**\n{ingest_worker.telegram_parser.pool.describe()}\n"
+    await event.reply(summary)
+
+
+async def view_stalls(event):
+    """Присылает последние остановки event loop со стеками, на которых он стоял."""
+    user_id = event.sender_id
+
+    if user_id not in authenticated_users:
+        await event.reply("🔒 Пожалуйста, введите пароль для доступа к боту:")
+        user_states[user_id] = {"step": "AWAITING_PASSWORD"}
+        return
+
+    report = loop_watchdog.format_stalls()
+    if not report:
+        await event.reply(f"⏱ Остановок event loop дольше {loop_watchdog.threshold} с не было.")
+        return
+    stalls = io.BytesIO(report.encode("utf-8"))
+    stalls.name = "loop_stalls.txt"
+    await client.send_file(event.chat_id, stalls,
+                           caption=f"⏱ Последние остановки event loop: {len(loop_watchdog.stalls)}")
+
+
+async def run_profile(event):
+    """
+    Снимает выборочный профиль процесса за PROFILE_DURATION секунд и присылает
+    свёрнутые стеки (для flamegraph.pl или speedscope) и самые частые кадры event loop.
+    """
+    user_id = event.sender_id
+
+    if user_id not in authenticated_users:
+        await event.reply("🔒 Пожалуйста, введите пароль для доступа к боту:")
+        user_states[user_id] = {"step": "AWAITING_PASSWORD"}
+        return
+
+    if profile_lock.locked():
+        await event.reply("⏳ Профиль уже снимается, дождитесь результата.")
+        return
+
+    async with profile_lock:
+        await event.reply(f"🔥 Снимаю профиль процесса, {PROFILE_DURATION} с...")
+        logger.info(f"Профилирование процесса на {PROFILE_DURATION} с по запросу пользователя {user_id}.")
+        samples = await asyncio.get_running_loop().run_in_executor(None, profile_stacks, PROFILE_DURATION)
+
+    caption = f"🔥 Профиль за {PROFILE_DURATION} с, выборок: {sum(samples.values())}"
+    top = top_frames(samples, "MainThread")
+    if top:
+        caption += "\n\nEvent loop чаще всего в:\n" + "\n".join(f"• {share:.0%} {frame}" for frame, share in top)
+    report = io.BytesIO(collapsed_report(samples).encode("utf-8"))
+    report.name = "profile.folded"
+    await client.send_file(event.chat_id, report, caption=caption[:1024])
+
+
+@bots.on(events.ChatAction)
 async def handle_bot_added_to_moderation_chat(event):
     """
-    Обрабатывает добавление бота в чат модерации.
+    Обрабатывает добавление бота в чат модерации. Засчитывается только бот
+    пула, за которым закреплена создаваемая связка.
     """
-    bot_user = await client.get_me()
+    bot_user = await event.client.get_me()
     if event.user_id == bot_user.id:
         chat_id = event.chat_id
         user_id = event.action_message.from_id.user_id
-        logger.info(f"Бот добавлен в модерационный чат {chat_id} пользователем {user_id}.")
+        logger.info(f"Бот {bot_user.username} добавлен в модерационный чат {chat_id} пользователем {user_id}.")
 
         user_state = user_states.get(user_id)
         if user_state and user_state.get("step") == "AWAITING_MODERATION_CHAT":
             linkage_name = user_state["linkage_name"]
+            shard = bots.shard_for_new(linkage_name)
+            if shard.client is not event.client:
+                await client.send_message(
+                    user_id,
+                    f"⚠️ Связку **{linkage_name}** обслуживает бот {shard.name}. "
+                    "Добавьте в чат модерации его."
+                )
+                return
             user_states[user_id]["moderation_chat_id"] = chat_id
             user_states[user_id]["step"] = "AWAITING_PUBLICATION_CHANNEL"
             await client.send_message(
                 user_id,
                 f"🔑 Название связки: **{linkage_name}**\n\n"
-                "✅ Чат модерации установлен. Теперь введите ссылку на канал публикации, в котором я являюсь администратором."
+                f"✅ Чат модерации установлен. Теперь введите ссылку на канал публикации, "
+                f"в котором бот {shard.name} является администратором."
             )
 
 
-@client.on(events.NewMessage)
-async def handle_publication_channel(event):
+async def handle_publication_channel(event, user_state, text):
     """
     Обрабатывает ввод канала для публикации, завершает создание связки.
     """
     user_id = event.sender_id
-    text = event.text.strip()
-
-    if not event.is_private:
-
-        if is_moderation_chat(event.chat_id):
-            return
-        else:
-            return
-
-    user_state = user_states.get(user_id)
-    if not user_state or user_state.get("step") != "AWAITING_PUBLICATION_CHANNEL":
-        return
-
     linkage_name = user_state["linkage_name"]
     publication_channel = text
 
     try:
 
-        channel_entity = await client.get_entity(publication_channel)
+        channel_entity = await bots.shard_for_new(linkage_name).client.get_entity(publication_channel)
 
         if not channel_entity.admin_rights:
             await event.reply(
-                "⚠️ Я не являюсь администратором в указанном канале. "
-                "Пожалуйста, добавьте меня как администратора и попробуйте снова."
+                f"⚠️ Бот {bots.shard_for_new(linkage_name).name} не является администратором в указанном канале. "
+                "Пожалуйста, добавьте его как администратора и попробуйте снова."
             )
             return
     except Exception as e:
@@ -485,6 +970,7 @@ async def handle_publication_channel(event):
             "resources": user_state["resources"],
             "moderation_bot": user_state.get("moderation_chat_id"),
             "publication_channel": publication_channel,
+            "bot_id": bots.shard_for_new(linkage_name).bot_id,
             "pending_news": [],
             "is_active": True
         }
@@ -500,21 +986,30 @@ async def handle_publication_channel(event):
         f"✅ Связка успешно создана и активирована! Новости из указанных ресурсов будут направляться в чат модерации."
     )
 
+    if not ingest_worker:
+        return
+
     for resource in user_state["resources"]:
         url = resource.get("url")
         try:
-            if "rss" in url or "feed" in url:
-                rss_news = rss_fetcher.fetch_new_rss_news([url], f"rss_db_{linkage_name}.csv")
-                for news in rss_news:
-                    await send_to_moderation(news, linkage_name, data["linkages"][linkage_name]["moderation_bot"])
-            elif "t.me" in url:
-                tg_news = await telegram_parser.fetch_new_telegram_news([url], f"tg_db_{linkage_name}.csv")
-                for news in tg_news:
-                    await send_to_moderation(news, linkage_name, data["linkages"][linkage_name]["moderation_bot"])
+            for news in await ingest_worker.fetch_resource(url, linkage_name):
+                work_queue.put(MODERATION_QUEUE, {"linkage_name": linkage_name, "news": news})
         except Exception as e:
             logger.error(f"Ошибка обработки ресурса '{url}' для связки '{linkage_name}': {e}")
 
 
+def edit_action_keyboard(linkage):
+    """Клавиатура действий редактирования связки с учётом её текущего состояния."""
+    toggle_action = "⏸️ Pause Linkage" if linkage.get("is_active", True) else "▶️ Resume Linkage"
+    mode_action = "🃏 Single Cards" if linkage.get("moderation_mode") == "digest" else "🗂 Digest Mode"
+    return [
+        [Button.text("➕ Add Resources"), Button.text("🗑️ Remove Resources")],
+        [Button.text("✏️ Edit Prompt"), Button.text(mode_action)],
+        [Button.text(toggle_action)],
+        [Button.text("⬅️ Back to Linkage Selection")]
+    ]
+
+
 async def edit_linkage(event):
     """
     Открывает меню выбора связки для редактирования.
@@ -539,255 +1034,233 @@ async def edit_linkage(event):
     await event.reply("✏️ Выберите связку для редактирования:", buttons=buttons)
 
 
-@client.on(events.NewMessage)
-async def handle_menu_buttons(event):
-    """
-    Обрабатывает нажатия кнопок и текстовые команды.
-    """
-    if not event.is_private:
+async def handle_password(event, user_state, text):
+    user_id = event.sender_id
+    if text == PASSWORD:
 
-        if is_moderation_chat(event.chat_id):
-            logger.info(f"Сообщение из модерационного чата {event.chat_id} проигнорировано.")
-            return
-        else:
-            logger.info(f"Сообщение из группового чата {event.chat_id} проигнорировано.")
-            return
+        authenticated_users.add(user_id)
+        user_states.pop(user_id)
+        await event.reply("✅ Пароль верный! Добро пожаловать.")
+        await back_to_main_menu(event)
+    else:
 
-    user_id = event.sender_id
-    text = event.text.strip()
+        await event.reply("❌ Неверный пароль. Попробуйте снова.")
 
-    user_state = user_states.get(user_id)
-    if user_state and user_state.get("step") == "AWAITING_PASSWORD":
-        if text == PASSWORD:
 
-            authenticated_users.add(user_id)
-            user_states.pop(user_id)
-            await event.reply("✅ Пароль верный! Добро пожаловать.")
-            await back_to_main_menu(event)
-        else:
+async def create_linkage(event):
+    user_states[event.sender_id] = {"step": "AWAITING_LINKAGE_NAME"}
+    await event.reply("📝 Введите название новой связки.")
 
-            await event.reply("❌ Неверный пароль. Попробуйте снова.")
+
+async def delete_linkage(event):
+    data = load_linkages()
+    linkages = data.get("linkages", {})
+    if not linkages:
+        await event.reply("⚠️ Связок пока нет. Сначала создайте новую связку.")
         return
 
-    if user_id not in authenticated_users:
+    buttons = [[Button.text(name)] for name in linkages.keys()]
+    buttons.append([Button.text("⬅️ Back to Main Menu")])
+    user_states[event.sender_id] = {"step": "DELETE_LINKAGE", "allowed_linkages": list(linkages.keys())}
+    await event.reply("🔑 Выберите связку для удаления:", buttons=buttons)
 
-        user_states[user_id] = {"step": "AWAITING_PASSWORD"}
-        await event.reply("🔒 **Пожалуйста, введите пароль для доступа к боту:**")
-        return
 
-    if text == "🛠 Manage Linkages":
-        await manage_linkages(event)
-        return
-    elif text == "📋 View Linkages":
-        await view_linkages(event)
-        return
-    elif text == "⬅️ Back to Main Menu":
+async def handle_linkage_name(event, user_state, text):
+    user_id = event.sender_id
+    data = load_linkages()
+    linkage_name = text
+    if linkage_name in data["linkages"]:
+        await event.reply("⚠️ Связка с таким названием уже существует. Введите другое название.")
+    else:
+        user_states[user_id]["step"] = "AWAITING_RESOURCES"
+        user_states[user_id]["linkage_name"] = linkage_name
+        await event.reply(
+            f"🔑 Название связки: **{linkage_name}**\n\n"
+            "🔗 Введите ресурсы (ссылки на Telegram каналы или RSS ленты) через точку с запятой ;.\n"
+            "Через | можно закрепить интервал опроса в секундах.\n"
+            "Пример: https://t.me/example1; https://rss.example.com/feed | 600"
+        )
+
+
+async def handle_new_resources(event, user_state, text):
+    user_id = event.sender_id
+    resources = parse_resources(text)
+    if not resources:
+        await event.reply("⚠️ Вы не добавили ни одного ресурса. Попробуйте ещё раз.")
+    else:
+        user_states[user_id]["resources"] = resources
+        user_states[user_id]["step"] = "AWAITING_MODERATION_CHAT"
+        linkage_name = user_state["linkage_name"]
+        await event.reply(
+            f"🔑 Название связки: **{linkage_name}**\n\n"
+            f"✅ Ресурсы добавлены. Теперь добавьте бота {bots.shard_for_new(linkage_name).name} в чат модерации. "
+            "Я уведомлю вас, как только его добавят."
+        )
+
+
+async def handle_delete_linkage(event, user_state, text):
+    user_id = event.sender_id
+    data = load_linkages()
+    allowed_linkages = user_state.get("allowed_linkages", [])
+    if text in allowed_linkages:
+        linkages = data["linkages"]
+        del linkages[text]
+        save_linkages(data)
+        user_states.pop(user_id, None)
+        await event.reply(f"✅ Связка **{text}** успешно удалена.")
         await back_to_main_menu(event)
-        return
-    elif text == "➕ Create Linkage":
-        user_states[user_id] = {"step": "AWAITING_LINKAGE_NAME"}
-        await event.reply("📝 Введите название новой связки.")
-        return
-    elif text == "🗑️ Delete Linkage":
-        data = load_linkages()
-        linkages = data.get("linkages", {})
-        if not linkages:
-            await event.reply("⚠️ Связок пока нет. Сначала создайте новую связку.")
-            return
+    else:
+        await event.reply("⚠️ Пожалуйста, выберите существующую связку для удаления.")
 
-        buttons = [[Button.text(name)] for name in linkages.keys()]
-        buttons.append([Button.text("⬅️ Back to Main Menu")])
-        user_states[user_id] = {"step": "DELETE_LINKAGE", "allowed_linkages": list(linkages.keys())}
-        await event.reply("🔑 Выберите связку для удаления:", buttons=buttons)
-        return
-    elif text == "✏️ Edit Linkage":
-        await edit_linkage(event)
-        return
 
-    if user_state:
-        if user_state.get("step") == "AWAITING_LINKAGE_NAME":
-            if text in ["🛠 Manage Linkages", "📋 View Linkages", "➕ Create Linkage", "⬅️ Back to Main Menu"]:
-                return
-            data = load_linkages()
-            linkage_name = text
-            if linkage_name in data["linkages"]:
-                await event.reply("⚠️ Связка с таким названием уже существует. Введите другое название.")
-            else:
-                user_states[user_id]["step"] = "AWAITING_RESOURCES"
-                user_states[user_id]["linkage_name"] = linkage_name
-                await event.reply(
-                    f"🔑 Название связки: **{linkage_name}**\n\n"
-                    "🔗 Введите ресурсы (ссылки на Telegram каналы или RSS ленты) через точку с запятой ;.\n"
-                    "Пример: https://t.me/example1; https://rss.example.com/feed"
-                )
-        elif user_state.get("step") == "AWAITING_RESOURCES":
-            resources = [{"url": url.strip()} for url in text.split(";") if url.strip()]
-            if not resources:
-                await event.reply("⚠️ Вы не добавили ни одного ресурса. Попробуйте ещё раз.")
-            else:
-                user_states[user_id]["resources"] = resources
-                user_states[user_id]["step"] = "AWAITING_MODERATION_CHAT"
-                linkage_name = user_state["linkage_name"]
-                await event.reply(
-                    f"🔑 Название связки: **{linkage_name}**\n\n"
-                    "✅ Ресурсы добавлены. Теперь добавьте меня в чат модерации. "
-                    "Я уведомлю вас, как только меня добавят."
-                )
-        elif user_state.get("step") == "DELETE_LINKAGE":
-            data = load_linkages()
-            allowed_linkages = user_state.get("allowed_linkages", [])
-            if text in allowed_linkages:
-                linkages = data["linkages"]
-                del linkages[text]
-                save_linkages(data)
-                user_states.pop(user_id, None)
-                await event.reply(f"✅ Связка **{text}** успешно удалена.")
-                await back_to_main_menu(event)
-            elif text == "⬅️ Back to Main Menu":
-                user_states.pop(user_id, None)
-                await back_to_main_menu(event)
-            else:
-                await event.reply("⚠️ Пожалуйста, выберите существующую связку для удаления.")
-        elif user_state.get("step") == "SELECT_LINKAGE_TO_EDIT":
-            data = load_linkages()
-            linkages = data.get("linkages", {})
-            if text in linkages:
-                linkage = linkages[text]
-                is_active = linkage.get("is_active", True)
-                toggle_action = "⏸️ Pause Linkage" if is_active else "▶️ Resume Linkage"
-
-                user_states[user_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": text}
-                keyboard = [
-                    [Button.text("➕ Add Resources"), Button.text("🗑️ Remove Resources")],
-                    [Button.text("✏️ Edit Prompt")],
-                    [Button.text(toggle_action)],
-                    [Button.text("⬅️ Back to Linkage Selection")]
-                ]
-                await event.reply(f"✏️ Вы редактируете связку: **{text}**\n\nЧто вы хотите сделать?", buttons=keyboard)
-            elif text == "⬅️ Back to Main Menu":
-                user_states.pop(user_id, None)
-                await back_to_main_menu(event)
-            else:
-                await event.reply("⚠️ Пожалуйста, выберите существующую связку для редактирования.")
-        elif user_state.get("step") == "SELECT_EDIT_ACTION":
-            linkage_name = user_state["linkage_name"]
-            if text == "➕ Add Resources":
-                user_states[user_id] = {"step": "AWAITING_RESOURCES_TO_ADD", "linkage_name": linkage_name}
-                await event.reply(
-                    f"✏️ Вы редактируете связку: **{linkage_name}**.\n\nВведите ресурсы через ;, которые хотите добавить."
-                )
-            elif text == "✏️ Edit Prompt":
-                user_states[user_id] = {"step": "AWAITING_PROMPT_CHANGE", "linkage_name": linkage_name}
-                data = load_linkages()
-                linkage = data["linkages"].get(linkage_name, {})
-                current_prompt = linkage.get("prompt", gpt_style_translation.default_prompt)
-                await event.reply(
-                    f"✏️ Вы редактируете связку: **{linkage_name}**.\n\nТекущий промпт:\n{gpt_style_translation.default_prompt}\n\n"
-                    f"Введите новый промпт для обработки новостей."
-                )
-            elif text == "🗑️ Remove Resources":
-                data = load_linkages()
-                linkage = data["linkages"].get(linkage_name, {})
-                resources = linkage.get("resources", [])
-                if not resources:
-                    await event.reply("⚠️ В этой связке нет ресурсов для удаления.")
-                else:
-                    user_states[user_id] = {"step": "AWAITING_RESOURCE_TO_REMOVE", "linkage_name": linkage_name}
-                    buttons = [[Button.text(res["url"])] for res in resources]
-                    buttons.append([Button.text("⬅️ Back to Edit Menu")])
-                    await event.reply(f"✏️ Выберите ресурс для удаления из связки: **{linkage_name}**", buttons=buttons)
-            elif text == "⏸️ Pause Linkage" or text == "▶️ Resume Linkage":
-
-                data = load_linkages()
-                linkage = data["linkages"].get(linkage_name, {})
-                linkage["is_active"] = not linkage.get("is_active", True)
-                save_linkages(data)
+async def handle_select_linkage_to_edit(event, user_state, text):
+    user_id = event.sender_id
+    data = load_linkages()
+    linkages = data.get("linkages", {})
+    if text in linkages:
+        linkage = linkages[text]
+        user_states[user_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": text}
+        keyboard = edit_action_keyboard(linkage)
+        await event.reply(f"✏️ Вы редактируете связку: **{text}**\n\nЧто вы хотите сделать?", buttons=keyboard)
+    else:
+        await event.reply("⚠️ Пожалуйста, выберите существующую связку для редактирования.")
 
-                is_active = linkage["is_active"]
-                status = "✅ Активна" if is_active else "⏸️ Приостановлена"
-                toggle_action = "⏸️ Pause Linkage" if is_active else "▶️ Resume Linkage"
 
-                await event.reply(f"✅ Связка **{linkage_name}** {status}.")
+async def ask_resources_to_add(event, user_state, text):
+    linkage_name = user_state["linkage_name"]
+    user_states[event.sender_id] = {"step": "AWAITING_RESOURCES_TO_ADD", "linkage_name": linkage_name}
+    await event.reply(
+        f"✏️ Вы редактируете связку: **{linkage_name}**.\n\nВведите ресурсы через ;, которые хотите добавить."
+    )
 
-                keyboard = [
-                    [Button.text("➕ Add Resources"), Button.text("🗑️ Remove Resources")],
-                    [Button.text("✏️ Edit Prompt")],
-                    [Button.text(toggle_action)],
-                    [Button.text("⬅️ Back to Linkage Selection")]
-                ]
 
-                await event.reply(f"✏️ Вы редактируете связку: **{linkage_name}**\n\nЧто вы хотите сделать?",
-                                  buttons=keyboard)
-            elif text == "⬅️ Back to Linkage Selection":
-                user_states[user_id] = {"step": "SELECT_LINKAGE_TO_EDIT"}
-                await edit_linkage(event)
-            else:
-                await event.reply("⚠️ Пожалуйста, выберите допустимое действие.")
-        elif user_state.get("step") == "AWAITING_RESOURCES_TO_ADD":
-            linkage_name = user_state["linkage_name"]
+async def ask_prompt_change(event, user_state, text):
+    linkage_name = user_state["linkage_name"]
+    user_states[event.sender_id] = {"step": "AWAITING_PROMPT_CHANGE", "linkage_name": linkage_name}
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name, {})
+    current_prompt = linkage.get("prompt", gpt_style_translation.default_prompt)
+    await event.reply(
+        f"✏️ Вы редактируете связку: **{linkage_name}**.\n\nТекущий промпт:\n{gpt_style_translation.default_prompt}\n\n"
+        f"Введите новый промпт для обработки новостей."
+    )
 
-            if text in ["⬅️ Back to Edit Menu", '➕ Add Resources', '🗑️ Remove Resources', '✏️ Edit Linkage', '⏸️ Pause Linkage', '▶️ Resume Linkage']:
-                user_states[user_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": linkage_name}
-                await edit_linkage(event)
-                return
 
-            resources = [{"url": url.strip()} for url in text.split(";") if url.strip()]
-            if not resources:
-                await event.reply("⚠️ Вы не добавили ни одного ресурса. Попробуйте ещё раз.")
-            else:
-                data = load_linkages()
-                linkage = data["linkages"].get(linkage_name, {})
-                linkage["resources"].extend(resources)
-                save_linkages(data)
-                user_states.pop(user_id, None)
-                await event.reply(f"✅ Ресурсы успешно добавлены в связку: **{linkage_name}**.")
-                await back_to_main_menu(event)
-        elif user_state.get("step") == "AWAITING_RESOURCE_TO_REMOVE":
-            linkage_name = user_state["linkage_name"]
-            data = load_linkages()
-            linkage = data["linkages"].get(linkage_name, {})
-            resources = linkage.get("resources", [])
-            selected_resource = next((res for res in resources if res["url"] == text), None)
-            if selected_resource:
-                resources.remove(selected_resource)
-                save_linkages(data)
-                await event.reply(f"✅ Ресурс удалён: **{selected_resource['url']}**.")
-                if resources:
-                    buttons = [[Button.text(res["url"])] for res in resources]
-                    buttons.append([Button.text("⬅️ Back to Edit Menu")])
-                    await event.reply("Выберите следующий ресурс для удаления:", buttons=buttons)
-                else:
-                    user_states.pop(user_id, None)
-                    await back_to_main_menu(event)
-            elif text == "⬅️ Back to Edit Menu":
-                user_states[user_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": linkage_name}
-                await edit_linkage(event)
-            else:
-                await event.reply("⚠️ Пожалуйста, выберите корректный ресурс для удаления.")
-        elif user_state.get("step") == "AWAITING_PROMPT_CHANGE":
-            linkage_name = user_state["linkage_name"]
+async def ask_resource_to_remove(event, user_state, text):
+    linkage_name = user_state["linkage_name"]
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name, {})
+    resources = linkage.get("resources", [])
+    if not resources:
+        await event.reply("⚠️ В этой связке нет ресурсов для удаления.")
+    else:
+        user_states[event.sender_id] = {"step": "AWAITING_RESOURCE_TO_REMOVE", "linkage_name": linkage_name}
+        buttons = [[Button.text(res["url"])] for res in resources]
+        buttons.append([Button.text("⬅️ Back to Edit Menu")])
+        await event.reply(f"✏️ Выберите ресурс для удаления из связки: **{linkage_name}**", buttons=buttons)
 
-            if text in ["⬅️ Back to Linkage Selection", '➕ Add Resources', '🗑️ Remove Resources', '✏️ Edit Prompt', '⏸️ Pause Linkage']:
-                user_states[user_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": linkage_name}
-                await edit_linkage(event)
-                return
 
-            if text.startswith('/'):
-                return
+async def toggle_linkage_active(event, user_state, text):
+    linkage_name = user_state["linkage_name"]
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name, {})
+    linkage["is_active"] = not linkage.get("is_active", True)
+    save_linkages(data)
 
-            data = load_linkages()
-            linkage = data["linkages"].get(linkage_name)
-            if not linkage:
-                await event.reply("⚠️ Связка не найдена. Попробуйте снова.")
-                user_states.pop(user_id, None)
-                return
+    is_active = linkage["is_active"]
+    status = "✅ Активна" if is_active else "⏸️ Приостановлена"
 
-            linkage["prompt"] = text
-            save_linkages(data)
+    await event.reply(f"✅ Связка **{linkage_name}** {status}.")
+
+    await event.reply(f"✏️ Вы редактируете связку: **{linkage_name}**\n\nЧто вы хотите сделать?",
+                      buttons=edit_action_keyboard(linkage))
+
+
+async def toggle_moderation_mode(event, user_state, text):
+    linkage_name = user_state["linkage_name"]
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name, {})
+    linkage["moderation_mode"] = "digest" if text == "🗂 Digest Mode" else "single"
+    save_linkages(data)
+    if linkage["moderation_mode"] == "single":
+        await flush_digests(linkage_names=[linkage_name], force=True)
+
+    mode = "дайджестами" if linkage["moderation_mode"] == "digest" else "отдельными карточками"
+    await event.reply(f"✅ Новости связки **{linkage_name}** теперь приходят на модерацию {mode}.")
+    await event.reply(f"✏️ Вы редактируете связку: **{linkage_name}**\n\nЧто вы хотите сделать?",
+                      buttons=edit_action_keyboard(linkage))
+
+
+async def back_to_linkage_selection(event, user_state, text):
+    user_states[event.sender_id] = {"step": "SELECT_LINKAGE_TO_EDIT"}
+    await edit_linkage(event)
+
+
+async def back_to_edit_menu(event, user_state, text):
+    user_states[event.sender_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": user_state["linkage_name"]}
+    await edit_linkage(event)
+
+
+async def reject_edit_action(event, user_state, text):
+    await event.reply("⚠️ Пожалуйста, выберите допустимое действие.")
+
+
+async def handle_resources_to_add(event, user_state, text):
+    linkage_name = user_state["linkage_name"]
+    resources = parse_resources(text)
+    if not resources:
+        await event.reply("⚠️ Вы не добавили ни одного ресурса. Попробуйте ещё раз.")
+    else:
+        data = load_linkages()
+        linkage = data["linkages"].get(linkage_name, {})
+        linkage["resources"].extend(resources)
+        save_linkages(data)
+        user_states.pop(event.sender_id, None)
+        await event.reply(f"✅ Ресурсы успешно добавлены в связку: **{linkage_name}**.")
+        await back_to_main_menu(event)
+
+
+async def handle_resource_to_remove(event, user_state, text):
+    linkage_name = user_state["linkage_name"]
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name, {})
+    resources = linkage.get("resources", [])
+    selected_resource = next((res for res in resources if res["url"] == text), None)
+    if selected_resource:
+        resources.remove(selected_resource)
+        save_linkages(data)
+        await event.reply(f"✅ Ресурс удалён: **{selected_resource['url']}**.")
+        if resources:
+            buttons = [[Button.text(res["url"])] for res in resources]
+            buttons.append([Button.text("⬅️ Back to Edit Menu")])
+            await event.reply("Выберите следующий ресурс для удаления:", buttons=buttons)
+        else:
+            user_states.pop(event.sender_id, None)
+            await back_to_main_menu(event)
+    else:
+        await event.reply("⚠️ Пожалуйста, выберите корректный ресурс для удаления.")
+
+
+async def handle_prompt_change(event, user_state, text):
+    user_id = event.sender_id
+    linkage_name = user_state["linkage_name"]
+
+    if text.startswith('/'):
+        return
+
+    data = load_linkages()
+    linkage = data["linkages"].get(linkage_name)
+    if not linkage:
+        await event.reply("⚠️ Связка не найдена. Попробуйте снова.")
+        user_states.pop(user_id, None)
+        return
+
+    linkage["prompt"] = text
+    save_linkages(data)
 
-            await event.reply(f"✅ Промпт для связки **{linkage_name}** успешно обновлён!")
-            user_states[user_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": linkage_name}
-            await edit_linkage(event)
+    await event.reply(f"✅ Промпт для связки **{linkage_name}** успешно обновлён!")
+    user_states[user_id] = {"step": "SELECT_EDIT_ACTION", "linkage_name": linkage_name}
+    await edit_linkage(event)
 
 
 async def back_to_main_menu(event):
@@ -795,30 +1268,22 @@ async def back_to_main_menu(event):
     user_states.pop(user_id, None)
     keyboard = [
         [Button.text("🛠 Manage Linkages")],
-        [Button.text("📋 View Linkages")],
+        [Button.text("📋 View Linkages"), Button.text("📊 Metrics")],
     ]
     await event.reply("🤖 Главное меню\n\nВыберите опцию ниже:", buttons=keyboard)
 
 
-@client.on(events.NewMessage(pattern='/start'))
 async def start(event):
     """
-    Обрабатывает команду /start только в личных чатах и игнорирует её в модерационных чатах.
+    Обрабатывает команду /start в личном чате.
     """
-    if not event.is_private:
-
-        if is_moderation_chat(event.chat_id):
-            logger.info(f"Команда /start из модерационного чата {event.chat_id} проигнорирована.")
-            return
-        return
-
     user_id = event.sender_id
 
     if user_id in authenticated_users:
 
         keyboard = [
             [Button.text("🛠 Manage Linkages")],
-            [Button.text("📋 View Linkages")],
+            [Button.text("📋 View Linkages"), Button.text("📊 Metrics")],
         ]
         await event.respond(
             "🤖 **Добро пожаловать в модерационного бота!**\n\n"
@@ -833,16 +1298,132 @@ async def start(event):
         )
 
 
-async def main():
-    """Запуск бота."""
+# Команды главного меню: работают на любом шаге диалога.
+MENU_ROUTES = {
+    "/start": start,
+    "🛠 Manage Linkages": manage_linkages,
+    "📋 View Linkages": view_linkages,
+    "📊 Metrics": view_metrics,
+    "/metrics": view_metrics,
+    "/stalls": view_stalls,
+    "/profile": run_profile,
+    "⬅️ Back to Main Menu": back_to_main_menu,
+    "➕ Create Linkage": create_linkage,
+    "🗑️ Delete Linkage": delete_linkage,
+    "✏️ Edit Linkage": edit_linkage,
+}
+
+# Кнопки, которые на конкретном шаге означают действие, а не ввод данных.
+STEP_ROUTES = {
+    ("SELECT_EDIT_ACTION", "➕ Add Resources"): ask_resources_to_add,
+    ("SELECT_EDIT_ACTION", "✏️ Edit Prompt"): ask_prompt_change,
+    ("SELECT_EDIT_ACTION", "🗑️ Remove Resources"): ask_resource_to_remove,
+    ("SELECT_EDIT_ACTION", "⏸️ Pause Linkage"): toggle_linkage_active,
+    ("SELECT_EDIT_ACTION", "▶️ Resume Linkage"): toggle_linkage_active,
+    ("SELECT_EDIT_ACTION", "🗂 Digest Mode"): toggle_moderation_mode,
+    ("SELECT_EDIT_ACTION", "🃏 Single Cards"): toggle_moderation_mode,
+    ("SELECT_EDIT_ACTION", "⬅️ Back to Linkage Selection"): back_to_linkage_selection,
+    ("AWAITING_RESOURCES_TO_ADD", "⬅️ Back to Edit Menu"): back_to_edit_menu,
+    ("AWAITING_RESOURCES_TO_ADD", "➕ Add Resources"): back_to_edit_menu,
+    ("AWAITING_RESOURCES_TO_ADD", "🗑️ Remove Resources"): back_to_edit_menu,
+    ("AWAITING_RESOURCES_TO_ADD", "⏸️ Pause Linkage"): back_to_edit_menu,
+    ("AWAITING_RESOURCES_TO_ADD", "▶️ Resume Linkage"): back_to_edit_menu,
+    ("AWAITING_RESOURCE_TO_REMOVE", "⬅️ Back to Edit Menu"): back_to_edit_menu,
+    ("AWAITING_PROMPT_CHANGE", "⬅️ Back to Linkage Selection"): back_to_edit_menu,
+    ("AWAITING_PROMPT_CHANGE", "➕ Add Resources"): back_to_edit_menu,
+    ("AWAITING_PROMPT_CHANGE", "🗑️ Remove Resources"): back_to_edit_menu,
+    ("AWAITING_PROMPT_CHANGE", "✏️ Edit Prompt"): back_to_edit_menu,
+    ("AWAITING_PROMPT_CHANGE", "⏸️ Pause Linkage"): back_to_edit_menu,
+}
+
+# Обработчики произвольного текста на каждом шаге диалога.
+STEP_HANDLERS = {
+    "AWAITING_LINKAGE_NAME": handle_linkage_name,
+    "AWAITING_RESOURCES": handle_new_resources,
+    "AWAITING_PUBLICATION_CHANNEL": handle_publication_channel,
+    "DELETE_LINKAGE": handle_delete_linkage,
+    "SELECT_LINKAGE_TO_EDIT": handle_select_linkage_to_edit,
+    "SELECT_EDIT_ACTION": reject_edit_action,
+    "AWAITING_RESOURCES_TO_ADD": handle_resources_to_add,
+    "AWAITING_RESOURCE_TO_REMOVE": handle_resource_to_remove,
+    "AWAITING_PROMPT_CHANGE": handle_prompt_change,
+}
+
+
+@client.on(events.NewMessage)
+async def route_message(event):
+    """
+    Единая точка входа для всех новых сообщений.
+
+    Сообщения из групп (в том числе модерационных чатов) отбрасываются без
+    чтения конфигурации. Личные сообщения разбираются по таблицам:
+    команда меню -> кнопка текущего шага -> ввод данных для текущего шага.
+    """
+    if not event.is_private:
+        return
+
+    user_id = event.sender_id
+    text = event.text.strip()
+    user_state = user_states.get(user_id)
+    step = user_state.get("step") if user_state else None
+
+    if step == "AWAITING_PASSWORD" and text != "/start":
+        await handle_password(event, user_state, text)
+        return
+
+    if user_id not in authenticated_users:
+        await start(event)
+        return
+
+    menu_handler = MENU_ROUTES.get(text)
+    if menu_handler:
+        await menu_handler(event)
+        return
+
+    handler = STEP_ROUTES.get((step, text)) or STEP_HANDLERS.get(step)
+    if handler:
+        await handler(event, user_state, text)
+
+
+async def main(role="all"):
+    """
+    Запуск бота.
+
+    role="all"   — всё в одном процессе: бот, опрос источников и обработка GPT;
+    role="front" — только бот (интерфейс, модерация, публикация); опрос и GPT
+                   выполняют отдельные процессы workers.py.
+    """
+    global ingest_worker
+
     try:
-        await client.start()
-        logger.info("Бот запущен и работает...")
+        sessions.restore()
+        await bots.start()
+        logger.info(f"Бот запущен и работает (роль: {role})...")
 
-        if user_states:
-            logger.info(f"Восстановление состояний пользователей: {user_states}")
+        try:
+            await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Не удалось запустить эндпоинт метрик на порту {METRICS_PORT}: {e}")
+
+        recover_linkages()
+        pin_linkage_bots()
+
+        tasks = [
+            bots.run_until_disconnected(),
+            consume(work_queue, MODERATION_QUEUE, deliver_to_moderation, default_worker_id("front")),
+            consume(work_queue, PUBLISH_QUEUE, deliver_publication, default_worker_id("front")),
+            run_digest_flusher(),
+            run_pending_sweeper(),
+            sessions.run_flusher(),
+            gpt_usage.run_flusher(),
+            loop_watchdog.run(),
+        ]
+        if role == "all":
+            ingest_worker = IngestWorker(work_queue, NewsFetcher(), TelegramParser(API_ID, API_HASH))
+            tasks.append(ingest_worker.run())
+            tasks.append(TransformWorker(work_queue).run())
 
-        await asyncio.gather(client.run_until_disconnected(), moderate_news())
+        await asyncio.gather(*tasks)
     except Exception as e:
         logger.exception("Произошла ошибка при запуске бота.")
 
@@ -850,5 +1431,10 @@ async def main():
 PASSWORD = load_password()
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Бот модерации и публикации новостей.")
+    arg_parser.add_argument("--role", choices=["all", "front"], default="all",
+                            help="all — всё в одном процессе, front — только бот (воркеры запускаются через workers.py).")
+    cli_args = arg_parser.parse_args()
+
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
\ No newline at end of file
+    loop.run_until_complete(main(cli_args.role))
\ No newline at end of file
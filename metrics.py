@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    "feed_fetch",
+    "article_fetch",
+    "parse",
+    "dedup_check",
+    "filter",
+    "image_download",
+    "image_hash",
+    "moderation_send",
+    "gpt_stream",
+    "gpt_transform",
+    "publish",
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    parts = []
+    for k, v in key:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными границами корзин."""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Приближённый квантиль по границам корзин."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, c in zip(self.buckets, self.counts):
+            cumulative += c
+            if cumulative >= target:
+                return bound
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Счётчики и гистограммы этапов конвейера с метками (stage, linkage, source).
+    Потокобезопасен: часть этапов выполняется вне event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, stage, linkage=None, source=None):
+        """
+        Замеряет длительность этапа конвейера.
+        Ошибки внутри блока учитываются в stage_errors_total и пробрасываются дальше.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc("stage_errors_total", stage=stage, linkage=linkage, source=source)
+            raise
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - start,
+                         stage=stage, linkage=linkage, source=source)
+
+    def render_prometheus(self):
+        """Возвращает метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        seen = set()
+        for (name, key), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for (name, key), hist in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            cumulative = 0
+            for bound, c in zip(hist.buckets, hist.counts):
+                cumulative += c
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {hist.count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def stage_summary(self, by="stage"):
+        """
+        Агрегирует гистограммы этапов по одной метке (stage, linkage или source).
+        Возвращает {значение_метки: {"count", "sum", "max", "p95", "errors"}}.
+        """
+        result = {}
+        with self._lock:
+            for (name, key), hist in self._histograms.items():
+                if name != "stage_duration_seconds":
+                    continue
+                label = dict(key).get(by, "")
+                entry = result.setdefault(label, {"count": 0, "sum": 0.0, "max": 0.0, "p95": 0.0, "errors": 0})
+                entry["count"] += hist.count
+                entry["sum"] += hist.sum
+                entry["max"] = max(entry["max"], hist.max)
+                entry["p95"] = max(entry["p95"], hist.quantile(0.95))
+            for (name, key), value in self._counters.items():
+                if name == "stage_errors_total":
+                    label = dict(key).get(by, "")
+                    result.setdefault(label, {"count": 0, "sum": 0.0, "max": 0.0, "p95": 0.0, "errors": 0})
+                    result[label]["errors"] += value
+        return result
+
+    def histogram_summary(self, name, by):
+        """Агрегирует гистограммы name по метке by: {значение: {"count", "p95", "max"}}."""
+        result = {}
+        with self._lock:
+            for (hist_name, key), hist in self._histograms.items():
+                if hist_name != name:
+                    continue
+                entry = result.setdefault(dict(key).get(by, ""), {"count": 0, "p95": 0.0, "max": 0.0})
+                entry["count"] += hist.count
+                entry["p95"] = max(entry["p95"], hist.quantile(0.95))
+                entry["max"] = max(entry["max"], hist.max)
+        return result
+
+    def counter_total(self, name, **labels):
+        """Сумма счётчика по всем меткам, совпадающим с переданными."""
+        wanted = _labels_key(labels)
+        total = 0
+        with self._lock:
+            for (counter_name, key), value in self._counters.items():
+                if counter_name == name and set(wanted) <= set(key):
+                    total += value
+        return total
+
+    def format_summary(self):
+        """Краткая текстовая сводка для админ-команды бота."""
+        uptime = int(time.time() - self.started_at)
+        message = f"📊 **Метрики конвейера** (аптайм {uptime // 3600}ч {uptime % 3600 // 60}м)\n\n"
+
+        stages = self.stage_summary("stage")
+        for stage in STAGES + tuple(s for s in stages if s not in STAGES):
+            entry = stages.get(stage)
+            if not entry or not entry["count"]:
+                continue
+            avg = entry["sum"] / entry["count"]
+            message += (f"• `{stage}`: {entry['count']} шт., ср. {avg * 1000:.0f} мс, "
+                        f"p95 ≤ {entry['p95'] * 1000:.0f} мс, макс. {entry['max'] * 1000:.0f} мс, "
+                        f"ошибок {entry['errors']}\n")
+
+        message += (
+            f"\n📥 Получено новостей: {self.counter_total('items_fetched_total')}\n"
+            f"♻️ Отсеяно дублей: {self.counter_total('items_deduplicated_total')}\n"
+            f"🚫 Отклонено фильтрами: {self.counter_total('items_filtered_total')}\n"
+            f"📨 Отправлено на модерацию: {self.counter_total('items_moderation_total')}\n"
+            f"📢 Опубликовано: {self.counter_total('items_published_total')}\n"
+        )
+
+        lanes = self.histogram_summary("lane_latency_seconds", "lane")
+        if lanes:
+            message += "\n🚦 **Задержка публикации по полосам:**\n"
+            for lane, entry in sorted(lanes.items()):
+                missed = self.counter_total("lane_latency_missed_total", lane=lane)
+                message += (f"• {lane}: {entry['count']} шт., p95 ≤ {entry['p95']:.0f} с, "
+                            f"макс. {entry['max']:.0f} с, дольше цели {missed}\n")
+
+        loop_lag = self.histogram_summary("loop_lag_seconds", "").get("")
+        if loop_lag and loop_lag["count"]:
+            message += (f"\n⏱ Задержка event loop: p95 ≤ {min(loop_lag['p95'], loop_lag['max']) * 1000:.0f} мс, "
+                        f"макс. {loop_lag['max'] * 1000:.0f} мс, "
+                        f"остановок {self.counter_total('loop_stalls_total')} (/stalls)\n")
+
+        sources = self.stage_summary("source")
+        slowest = sorted(((s, e) for s, e in sources.items() if s and e["count"]),
+                         key=lambda item: item[1]["sum"] / item[1]["count"], reverse=True)[:5]
+        if slowest:
+            message += "\n🐢 **Самые медленные источники:**\n"
+            for source, entry in slowest:
+                message += f"• {source}: ср. {entry['sum'] / entry['count'] * 1000:.0f} мс\n"
+        return message
+
+
+metrics = MetricsRegistry()
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.split("?")[0] == "/metrics":
+            body = metrics.render_prometheus().encode("utf-8")
+            status = "200 OK"
+        else:
+            body = b"not found\n"
+            status = "404 Not Found"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"Ошибка обработки запроса метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host="127.0.0.1", port=9108):
+    """Поднимает локальный HTTP эндпоинт /metrics для сбора метрик."""
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info(f"Эндпоинт метрик доступен на http://{host}:{port}/metrics")
+    return server
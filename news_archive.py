@@ -0,0 +1,208 @@
+"""
+Колоночный архив собранных новостей.
+
+Архив разбит на дневные разделы archive/YYYY-MM-DD/. Каждая колонка
+раздела хранится в своём файле: hash.bin — 8-байтовые хэши (связка + текст)
+подряд без сжатия, остальные колонки (id, ts, type, linkage, source,
+source_name, text) — JSON-строки в gzip, по одному gzip-блоку на каждую
+дозапись. Проверка на дубли читает только hash.bin, и только те байты,
+которые появились с прошлого чтения, поэтому не зависит от объёма
+сохранённых текстов.
+
+Перенос старых rss_db_<связка>.csv и tg_db_<связка>.csv:
+
+    python news_archive.py migrate [--delete] [файлы...]
+"""
+import argparse
+import csv
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from config import ARCHIVE_DIR
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("id", "ts", "type", "linkage", "source", "source_name", "text")
+HASH_FILE = "hash.bin"
+HASH_SIZE = 8
+PARTITION_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def news_hash(linkage_name, text):
+    """Ключ дедупликации: одинаковый текст в разных связках — разные новости."""
+    return hashlib.blake2b(f"{linkage_name or ''}\0{text}".encode("utf-8"), digest_size=HASH_SIZE).digest()
+
+
+def _news_key(linkage_name, news):
+    """Ключ новости: у NewsRecord он уже посчитан, у словаря считается по тексту."""
+    if hasattr(news, "dedup_key"):
+        return news.dedup_key(linkage_name)
+    return news_hash(linkage_name, news.get("txt") or "")
+
+
+class NewsArchive:
+    """Дневные разделы архива и множество хэшей уже собранных новостей."""
+
+    def __init__(self, root=ARCHIVE_DIR, clock=time.time):
+        self.root = root
+        self.clock = clock
+        self._hashes = set()
+        self._hash_offsets = {}
+        self._lock = threading.Lock()
+
+    def partition_for(self, ts):
+        return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+    def partitions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if PARTITION_RE.match(name))
+
+    def _refresh_hashes(self):
+        """Дочитывает хэши, дописанные с прошлого раза (в том числе другими процессами)."""
+        for partition in self.partitions():
+            path = os.path.join(self.root, partition, HASH_FILE)
+            offset = self._hash_offsets.get(partition, 0)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            size -= size % HASH_SIZE
+            if size <= offset:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+            self._hashes.update(chunk[i:i + HASH_SIZE] for i in range(0, len(chunk), HASH_SIZE))
+            self._hash_offsets[partition] = offset + len(chunk)
+
+    def contains(self, linkage_name, text):
+        """Проверяет, собиралась ли уже новость с таким текстом в этой связке."""
+        with self._lock:
+            self._refresh_hashes()
+            return news_hash(linkage_name, text) in self._hashes
+
+    def contains_news(self, linkage_name, news):
+        """То же, что contains, но по новости (NewsRecord или словарю)."""
+        key = _news_key(linkage_name, news)
+        with self._lock:
+            self._refresh_hashes()
+            return key in self._hashes
+
+    def append(self, linkage_name, items, ts=None):
+        """Дописывает новости в раздел дня ts (по умолчанию — текущего)."""
+        if not items:
+            return
+        ts = self.clock() if ts is None else ts
+        keys = [_news_key(linkage_name, news) for news in items]
+        rows = [{
+            "id": news.get("id"),
+            "ts": news.get("ts", ts),
+            "type": news.get("type"),
+            "linkage": linkage_name,
+            "source": news.get("src"),
+            "source_name": news.get("src_name"),
+            "text": news.get("txt"),
+        } for news in items]
+        partition_dir = os.path.join(self.root, self.partition_for(ts))
+        os.makedirs(partition_dir, exist_ok=True)
+
+        with self._lock, open(os.path.join(partition_dir, ".lock"), "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            for column in COLUMNS:
+                data = "".join(json.dumps(row[column], ensure_ascii=False) + "\n" for row in rows)
+                with open(os.path.join(partition_dir, f"{column}.gz"), "ab") as f:
+                    f.write(gzip.compress(data.encode("utf-8")))
+            # hash.bin пишется последним: строка видна дедупликации только
+            # после того, как записаны все её колонки.
+            with open(os.path.join(partition_dir, HASH_FILE), "ab") as f:
+                f.write(b"".join(keys))
+        self._hashes.update(keys)
+
+    def read_column(self, partition, column):
+        """Значения одной колонки раздела (для аналитики)."""
+        if column == "hash":
+            with open(os.path.join(self.root, partition, HASH_FILE), "rb") as f:
+                data = f.read()
+            return [data[i:i + HASH_SIZE] for i in range(0, len(data) - len(data) % HASH_SIZE, HASH_SIZE)]
+        path = os.path.join(self.root, partition, f"{column}.gz")
+        if not os.path.exists(path):
+            return []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def count(self, partition):
+        """Количество новостей в разделе — по размеру колонки хэшей."""
+        try:
+            return os.path.getsize(os.path.join(self.root, partition, HASH_FILE)) // HASH_SIZE
+        except OSError:
+            return 0
+
+
+news_archive = NewsArchive()
+
+
+def migrate_csv(path, archive=news_archive):
+    """
+    Переносит rss_db_<связка>.csv или tg_db_<связка>.csv в архив. Временем
+    новостей считается время изменения файла. Возвращает число перенесённых строк.
+    """
+    match = re.match(r"^(?:rss|tg)_db_(.+)\.csv$", os.path.basename(path))
+    if not match:
+        raise ValueError(f"Имя файла {path} не похоже на rss_db_<связка>.csv или tg_db_<связка>.csv")
+    linkage_name = match.group(1)
+    ts = os.path.getmtime(path)
+
+    items = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 6 or not row[2] or archive.contains(linkage_name, row[2]):
+                continue
+            items.append({"id": row[0], "type": row[1], "txt": row[2], "src": row[4], "src_name": row[5]})
+    archive.append(linkage_name, items, ts=ts)
+    return len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Архив собранных новостей.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Перенести rss_db_*.csv и tg_db_*.csv в архив.")
+    migrate.add_argument("files", nargs="*", help="CSV файлы (по умолчанию все в текущей папке).")
+    migrate.add_argument("--delete", action="store_true", help="Удалить CSV после переноса.")
+    stats = subparsers.add_parser("stats", help="Количество новостей по дням.")
+    stats.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        handlers=[logging.StreamHandler(sys.stdout)])
+
+    if args.command == "migrate":
+        files = args.files or sorted(glob.glob("rss_db_*.csv") + glob.glob("tg_db_*.csv"))
+        for path in files:
+            moved = migrate_csv(path)
+            logger.info(f"{path}: перенесено {moved} новостей.")
+            if args.delete:
+                os.remove(path)
+    else:
+        for partition in news_archive.partitions()[-args.days:]:
+            print(f"{partition}: {news_archive.count(partition)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Фильтрация новостей перед модерацией.
+
+Правила задаются в связке ключом "filters":
+
+    "filters": {
+        "include": ["биткоин", "ethereum"],   # хотя бы одно слово должно встретиться
+        "exclude": ["реклама", "промокод"],   # ни одно не должно встретиться
+        "languages": ["ru", "uk"],            # допустимые языки текста
+        "min_length": 200,                    # минимальная длина текста
+        "allow_sources": ["t.me/channel"],    # только эти источники
+        "block_sources": ["example.com"]      # кроме этих источников
+    }
+
+Слова ищутся без учёта регистра и только целиком (не как часть другого
+слова) автоматом Ахо — Корасик, поэтому время проверки не зависит от
+количества слов в списке.
+"""
+import re
+from collections import deque
+
+FILTER_KEYS = ("include", "exclude", "languages", "min_length", "allow_sources", "block_sources")
+
+
+class KeywordAutomaton:
+    """Автомат Ахо — Корасик для поиска любого из множества слов за один проход по тексту."""
+
+    def __init__(self, terms):
+        self.terms = sorted({term.casefold().strip() for term in terms if term and term.strip()})
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for term in self.terms:
+            self._add(term)
+        self._build_failure_links()
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    def _add(self, term):
+        state = 0
+        for char in term:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(term)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                if state == 0:
+                    continue
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text):
+        """Возвращает первое слово из списка, встретившееся в тексте целиком, или None."""
+        text = text.casefold()
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for term in self._output[state]:
+                start = index - len(term) + 1
+                before = text[start - 1] if start > 0 else " "
+                after = text[index + 1] if index + 1 < len(text) else " "
+                if not before.isalnum() and not after.isalnum():
+                    return term
+        return None
+
+
+_STOPWORDS = {
+    "en": {"the", "and", "of", "to", "in", "is", "that", "for", "with", "was", "on", "are"},
+    "de": {"der", "die", "und", "das", "ist", "nicht", "mit", "den", "von", "zu", "ein", "auf"},
+    "fr": {"le", "la", "les", "et", "des", "est", "une", "pour", "dans", "que", "qui", "du"},
+    "es": {"el", "los", "las", "y", "es", "una", "para", "con", "que", "del", "por", "como"},
+    "it": {"il", "che", "di", "gli", "una", "per", "con", "non", "sono", "della", "nel", "è"},
+    "pt": {"os", "as", "uma", "para", "com", "não", "que", "do", "da", "em", "por", "são"},
+}
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def detect_language(text, sample=2000):
+    """
+    Быстро определяет язык текста по алфавиту и частым служебным словам.
+    Возвращает код языка (ru, uk, be, en, de, fr, es, it, pt) или None.
+    """
+    text = text[:sample]
+    cyrillic = sum(1 for char in text if "Ѐ" <= char <= "ӿ")
+    latin = sum(1 for char in text if char.isascii() and char.isalpha())
+    if not cyrillic and not latin:
+        return None
+
+    lowered = text.casefold()
+    if cyrillic >= latin:
+        if any(char in lowered for char in "іїєґ"):
+            return "uk"
+        if "ў" in lowered:
+            return "be"
+        return "ru"
+
+    words = _WORD_RE.findall(lowered)
+    scores = {language: sum(1 for word in words if word in stopwords)
+              for language, stopwords in _STOPWORDS.items()}
+    best = max(scores, key=scores.get)
+    return best if scores[best] else "en"
+
+
+class NewsFilter:
+    """Скомпилированные правила фильтрации одной связки."""
+
+    def __init__(self, rules=None):
+        rules = rules or {}
+        self.include = KeywordAutomaton(rules.get("include", []))
+        self.exclude = KeywordAutomaton(rules.get("exclude", []))
+        self.languages = set(rules.get("languages", []))
+        self.min_length = int(rules.get("min_length", 0))
+        self.allow_sources = list(rules.get("allow_sources", []))
+        self.block_sources = list(rules.get("block_sources", []))
+
+    def check(self, news):
+        """Возвращает причину отклонения новости или None, если новость проходит фильтр."""
+        source = news.get("src") or ""
+        if self.allow_sources and not any(rule in source for rule in self.allow_sources):
+            return "source"
+        if any(rule in source for rule in self.block_sources):
+            return "source"
+
+        text = news.get("txt") or ""
+        if len(text) < self.min_length:
+            return "min_length"
+        if self.exclude and self.exclude.find(text):
+            return "exclude"
+        if self.include and not self.include.find(text):
+            return "include"
+        if self.languages:
+            language = detect_language(text)
+            if language and language not in self.languages:
+                return "language"
+        return None
+
+
+def validate_filters(rules):
+    """Проверяет блок "filters" связки. Возвращает список ошибок."""
+    if not isinstance(rules, dict):
+        return ["filters должен быть объектом"]
+    errors = [f"неизвестный ключ filters.{key}" for key in rules if key not in FILTER_KEYS]
+    for key in ("include", "exclude", "languages", "allow_sources", "block_sources"):
+        value = rules.get(key, [])
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            errors.append(f"filters.{key} должен быть списком строк")
+    min_length = rules.get("min_length", 0)
+    if not isinstance(min_length, int) or isinstance(min_length, bool) or min_length < 0:
+        errors.append("filters.min_length должен быть неотрицательным целым числом")
+    return errors
+
@@ -0,0 +1,164 @@
+"""
+Запись новости, которую передают друг другу все этапы конвейера.
+
+NewsRecord хранит поля в __slots__ (без словаря на каждый объект),
+интернирует повторяющиеся строки (тип, источник, название источника),
+один раз считает хэш текста и ключ дедупликации и умеет компактно
+сериализоваться в байты для очереди задач.
+
+Для совместимости с кодом и файлами, где новость — словарь
+({id, type, txt, img, src, src_name, ...}), запись поддерживает
+доступ по ключу (news["txt"], news.get("img"), news["queued_at"] = ...)
+и преобразование to_dict()/from_dict().
+"""
+import hashlib
+import json
+import struct
+import sys
+
+from news_archive import news_hash
+
+FIELDS = ("id", "type", "txt", "img", "src", "src_name")
+_INTERNED = ("type", "src", "src_name")
+
+FORMAT_VERSION = 1
+_TAG_NONE, _TAG_STR, _TAG_INT = 0, 1, 2
+_LENGTH = struct.Struct("<I")
+_INT = struct.Struct("<q")
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class NewsRecord:
+    __slots__ = FIELDS + ("extra", "_text_hash", "_dedup_key")
+
+    def __init__(self, id=None, type=None, txt=None, img=None, src=None, src_name=None, **extra):
+        self.id = id
+        self.type = _intern(type)
+        self.txt = txt
+        self.img = img
+        self.src = _intern(src)
+        self.src_name = _intern(src_name)
+        self.extra = extra
+        self._text_hash = None
+        self._dedup_key = None
+
+    # --- доступ как к словарю -------------------------------------------------
+
+    def __getitem__(self, key):
+        if key in FIELDS:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in FIELDS:
+            if key in _INTERNED:
+                value = _intern(value)
+            if key == "txt":
+                self._text_hash = self._dedup_key = None
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in FIELDS or key in self.extra
+
+    def get(self, key, default=None):
+        if key in FIELDS:
+            return getattr(self, key)
+        return self.extra.get(key, default)
+
+    def setdefault(self, key, default=None):
+        if key in FIELDS:
+            if getattr(self, key) is None:
+                self[key] = default
+            return getattr(self, key)
+        return self.extra.setdefault(key, default)
+
+    def pop(self, key, default=None):
+        return self.extra.pop(key, default)
+
+    def __eq__(self, other):
+        if isinstance(other, NewsRecord):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"NewsRecord(id={self.id!r}, type={self.type!r}, src={self.src!r})"
+
+    # --- хэши ---------------------------------------------------------------
+
+    @property
+    def text_hash(self):
+        """8-байтовый хэш текста, считается один раз."""
+        if self._text_hash is None:
+            self._text_hash = hashlib.blake2b((self.txt or "").encode("utf-8"), digest_size=8).digest()
+        return self._text_hash
+
+    def dedup_key(self, linkage_name):
+        """Ключ дедупликации в архиве для связки (см. news_archive.news_hash), считается один раз."""
+        if self._dedup_key is None or self._dedup_key[0] != linkage_name:
+            self._dedup_key = (linkage_name, news_hash(linkage_name, self.txt or ""))
+        return self._dedup_key[1]
+
+    # --- преобразования -----------------------------------------------------
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in FIELDS}
+        data.update(self.extra)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        return cls(**data)
+
+    def to_bytes(self):
+        """
+        Двоичное представление: версия формата, затем поля FIELDS и JSON
+        дополнительных полей. Каждое значение — байт типа и либо 8-байтовое
+        целое, либо строка UTF-8 с 4-байтовой длиной.
+        """
+        parts = [bytes((FORMAT_VERSION,))]
+        values = [getattr(self, field) for field in FIELDS]
+        values.append(json.dumps(self.extra, ensure_ascii=False) if self.extra else None)
+        for value in values:
+            if value is None:
+                parts.append(bytes((_TAG_NONE,)))
+            elif isinstance(value, int) and not isinstance(value, bool):
+                parts.append(bytes((_TAG_INT,)))
+                parts.append(_INT.pack(value))
+            else:
+                encoded = str(value).encode("utf-8")
+                parts.append(bytes((_TAG_STR,)))
+                parts.append(_LENGTH.pack(len(encoded)))
+                parts.append(encoded)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = memoryview(data)
+        if data[0] != FORMAT_VERSION:
+            raise ValueError(f"Неизвестная версия формата записи новости: {data[0]}")
+        offset = 1
+        values = []
+        for _ in range(len(FIELDS) + 1):
+            tag = data[offset]
+            offset += 1
+            if tag == _TAG_NONE:
+                values.append(None)
+            elif tag == _TAG_INT:
+                values.append(_INT.unpack_from(data, offset)[0])
+                offset += _INT.size
+            else:
+                (length,) = _LENGTH.unpack_from(data, offset)
+                offset += _LENGTH.size
+                values.append(str(data[offset:offset + length], "utf-8"))
+                offset += length
+        extra = values.pop()
+        return cls(**dict(zip(FIELDS, values)), **(json.loads(extra) if extra is not None else {}))
@@ -0,0 +1,151 @@
+"""
+Пул пользовательских сессий парсера Telegram.
+
+Каналы-источники опрашиваются через несколько пользовательских аккаунтов
+(PARSER_SESSIONS — имена файлов сессий), чтобы FloodWait одного аккаунта
+не останавливал весь приём из Telegram.
+
+Канал закрепляется за сессией при первом опросе — за наименее нагруженной
+(меньше запросов за последние PARSER_LOAD_WINDOW секунд, затем меньше
+каналов) — и дальше опрашивается ею же: у аккаунта уже есть сущность канала,
+и не тратятся запросы на разрешение имени. Получив FloodWait, сессия уходит
+на указанное Telegram время в ожидание, её каналы временно опрашиваются
+наименее нагруженной из доступных сессий, а после ожидания возвращаются к ней.
+Если ждут все сессии, опрос канала завершается SessionsExhaustedError.
+
+Нагрузка и состояние сессий видны в счётчиках parser_requests_total,
+parser_flood_waits_total, parser_failovers_total и в сводке describe().
+"""
+import logging
+import time
+from collections import deque
+
+from telethon import TelegramClient
+
+from config import PARSER_LOAD_WINDOW, PARSER_SESSIONS
+from helpers import SourceError
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SessionsExhaustedError(SourceError):
+    """
+    Все сессии парсера ждут окончания FloodWait: запрос не выполнялся.
+    retry_after — через сколько секунд освободится ближайшая сессия; канал
+    при этом исправен, и опрос просто откладывается.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def flood_wait_seconds(error):
+    """Сколько секунд ждать по ошибке FloodWait (и похожим), или None для прочих ошибок."""
+    seconds = getattr(error, "seconds", None)
+    return seconds if isinstance(seconds, int) else None
+
+
+class ParserSession:
+    """Одна пользовательская сессия: клиент, закреплённые каналы и недавние запросы."""
+
+    def __init__(self, name, api_id, api_hash, window=PARSER_LOAD_WINDOW, clock=time.monotonic):
+        self.name = name
+        self.client = TelegramClient(name, api_id, api_hash)
+        self.window = window
+        self.clock = clock
+        self.channels = set()
+        self.requests = deque()
+        self.cooldown_until = 0.0
+        self.flood_waits = 0
+
+    def available(self):
+        return self.clock() >= self.cooldown_until
+
+    def cooldown_left(self):
+        return max(self.cooldown_until - self.clock(), 0.0)
+
+    def load(self):
+        """Число запросов за последние window секунд."""
+        horizon = self.clock() - self.window
+        while self.requests and self.requests[0] < horizon:
+            self.requests.popleft()
+        return len(self.requests)
+
+    def record_request(self):
+        self.requests.append(self.clock())
+        metrics.inc("parser_requests_total", session=self.name)
+
+    def record_flood_wait(self, seconds):
+        self.cooldown_until = max(self.cooldown_until, self.clock() + seconds)
+        self.flood_waits += 1
+        metrics.inc("parser_flood_waits_total", session=self.name)
+        logger.warning(f"Сессия парсера '{self.name}' получила FloodWait на {seconds} с, "
+                       f"её каналы ({len(self.channels)}) временно опрашиваются другими сессиями.")
+
+
+class ParserPool:
+    """Сессии парсера и закрепление каналов за ними."""
+
+    def __init__(self, api_id, api_hash, sessions=PARSER_SESSIONS, window=PARSER_LOAD_WINDOW, clock=time.monotonic):
+        if not sessions:
+            raise ValueError("PARSER_SESSIONS не должен быть пустым")
+        self.sessions = [ParserSession(name, api_id, api_hash, window, clock) for name in sessions]
+        self.assignment = {}
+
+    @staticmethod
+    def _least_loaded(candidates):
+        return min(candidates, key=lambda session: (session.load(), len(session.channels)))
+
+    def home_of(self, channel):
+        """Сессия, за которой закреплён канал; новый канал закрепляется за наименее нагруженной."""
+        session = self.assignment.get(channel)
+        if session is None:
+            session = self._least_loaded([s for s in self.sessions if s.available()] or self.sessions)
+            session.channels.add(channel)
+            self.assignment[channel] = session
+            logger.info(f"Канал {channel} закреплён за сессией парсера '{session.name}'.")
+        return session
+
+    def session_for(self, channel, exclude=()):
+        """Сессия для очередного запроса к каналу: своя или, пока она ждёт FloodWait, другая."""
+        home = self.home_of(channel)
+        if home.available() and home not in exclude:
+            return home
+        candidates = [s for s in self.sessions if s.available() and s not in exclude]
+        if not candidates:
+            wait = min(s.cooldown_left() for s in self.sessions)
+            raise SessionsExhaustedError(f"Все сессии парсера в FloodWait, ближайшая освободится через {wait:.0f} с",
+                                         wait)
+        fallback = self._least_loaded(candidates)
+        metrics.inc("parser_failovers_total", session=fallback.name)
+        logger.info(f"Канал {channel} опрашивается сессией '{fallback.name}' вместо '{home.name}'.")
+        return fallback
+
+    async def request(self, channel, call):
+        """
+        Выполняет call(session) для канала. При FloodWait сессия уходит в ожидание,
+        а запрос повторяется через другую. Возвращает (результат, сессия).
+        """
+        tried = []
+        while True:
+            session = self.session_for(channel, exclude=tried)
+            session.record_request()
+            try:
+                return await call(session), session
+            except Exception as e:
+                seconds = flood_wait_seconds(e)
+                if seconds is None:
+                    raise
+                session.record_flood_wait(seconds)
+                tried.append(session)
+
+    def describe(self):
+        """Состояние и нагрузка сессий для сводки метрик."""
+        lines = []
+        for session in self.sessions:
+            state = "✅" if session.available() else f"⏳ FloodWait ещё {session.cooldown_left():.0f} с,"
+            lines.append(f"• {session.name}: {state} каналов {len(session.channels)}, "
+                         f"запросов за {session.window // 60} мин {session.load()}, FloodWait {session.flood_waits}")
+        return "\n".join(lines)
@@ -0,0 +1,103 @@
+"""
+Полосы приоритета новостей: high, normal, low.
+
+Связка задаёт приоритет источникам и ключевым словам:
+
+    "resources": [{"url": "https://t.me/breaking", "priority": "high"}, ...],
+    "priority_keywords": {"high": ["срочно", "breaking"], "low": ["реклама"]}
+
+Новость с ключевым словом полосы high всегда идёт в high; иначе её полоса —
+полоса источника, а без неё — low при совпадении слов из low, или normal.
+Полоса записывается в новость ("priority") вместе со временем получения
+("fetched_at") и сопровождает её через все очереди: источники high
+опрашиваются первыми и не реже LANE_MAX_POLL_INTERVAL, задачи очередей
+moderation, transform и publish берутся в порядке полос, а в режиме
+дайджеста новость high отправляется отдельной карточкой сразу.
+Задержка от получения до публикации учитывается по полосам и сравнивается
+с целевой LANE_LATENCY_TARGETS.
+"""
+import time
+
+from config import LANE_LATENCY_TARGETS
+from metrics import metrics
+from news_filter import KeywordAutomaton
+
+LANES = ("high", "normal", "low")
+DEFAULT_LANE = "normal"
+LANE_RANK = {lane: rank for rank, lane in enumerate(LANES)}
+LANE_MARKS = {"high": "🔥 ", "normal": "", "low": ""}
+
+# Максимальный интервал опроса источника полосы (адаптивный планировщик не уходит дальше).
+LANE_MAX_POLL_INTERVAL = {"high": 60}
+
+LATENCY_BUCKETS = (10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+
+def lane_of(news):
+    lane = news.get("priority")
+    return lane if lane in LANE_RANK else DEFAULT_LANE
+
+
+def lane_rank(news):
+    return LANE_RANK[lane_of(news)]
+
+
+class LaneClassifier:
+    """Скомпилированные правила приоритета одной связки."""
+
+    def __init__(self, linkage=None):
+        linkage = linkage or {}
+        self.source_lanes = {resource["url"]: resource["priority"]
+                             for resource in linkage.get("resources", []) if resource.get("priority")}
+        keywords = linkage.get("priority_keywords", {})
+        self.high = KeywordAutomaton(keywords.get("high", []))
+        self.low = KeywordAutomaton(keywords.get("low", []))
+
+    def source_lane(self, url):
+        return self.source_lanes.get(url, DEFAULT_LANE)
+
+    def classify(self, news):
+        text = news.get("txt") or ""
+        if self.high and self.high.find(text):
+            return "high"
+        lane = self.source_lanes.get(news.get("src"))
+        if lane:
+            return lane
+        if self.low and self.low.find(text):
+            return "low"
+        return DEFAULT_LANE
+
+    def assign(self, news, now=None):
+        """Записывает в новость её полосу и время получения."""
+        news["priority"] = self.classify(news)
+        news.setdefault("fetched_at", now or time.time())
+        return news["priority"]
+
+
+def record_latency(news, linkage_name, now=None):
+    """Учитывает задержку от получения новости до публикации в её полосе."""
+    fetched_at = news.get("fetched_at")
+    if not fetched_at:
+        return
+    lane = lane_of(news)
+    latency = (now or time.time()) - fetched_at
+    metrics.observe("lane_latency_seconds", latency, buckets=LATENCY_BUCKETS, lane=lane, linkage=linkage_name)
+    if latency > LANE_LATENCY_TARGETS.get(lane, float("inf")):
+        metrics.inc("lane_latency_missed_total", lane=lane, linkage=linkage_name)
+
+
+def validate_priority(linkage):
+    """Проверяет приоритеты ресурсов и priority_keywords связки. Возвращает список ошибок."""
+    errors = []
+    for resource in linkage.get("resources", []):
+        if isinstance(resource, dict) and "priority" in resource and resource["priority"] not in LANES:
+            errors.append(f"priority ресурса {resource.get('url')} должен быть одним из: {', '.join(LANES)}")
+    keywords = linkage.get("priority_keywords", {})
+    if not isinstance(keywords, dict):
+        return errors + ["priority_keywords должен быть объектом"]
+    for lane, words in keywords.items():
+        if lane not in ("high", "low"):
+            errors.append(f"priority_keywords.{lane}: допустимы только high и low")
+        elif not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+            errors.append(f"priority_keywords.{lane} должен быть списком строк")
+    return errors
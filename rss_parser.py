@@ -1,6 +1,16 @@
-from helpers import get_next_id
+from helpers import atomic_write_json, delete_news_image, get_next_id, SourceError
+from metrics import metrics
+from circuit_breaker import host_health, CircuitOpenError
+from config import RSS_CURSOR_FILE, RSS_MAX_ENTRIES, RSS_ARTICLE_WORKERS
+from http_client import http
+from news_archive import news_archive
+from news_record import NewsRecord
+from image_index import image_index
+import asyncio
 import csv
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 import feedparser
 import requests
 from bs4 import BeautifulSoup
@@ -9,31 +19,182 @@ from PIL import Image
 from svglib.svglib import svg2rlg
 from reportlab.graphics import renderPM
 
+FEED_TIMEOUT = 10
+ARTICLE_TIMEOUT = 10
+IMAGE_TIMEOUT = 10
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def is_host_failure(error):
+    """Ошибки, говорящие о недоступности хоста, а не о конкретной странице."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code >= 500
+
+
+def entry_key(entry):
+    """Устойчивый идентификатор записи ленты: guid, иначе ссылка, иначе заголовок."""
+    return entry.get("id") or entry.get("link") or entry.get("title")
+
+
+class FeedCursors:
+    """
+    Курсоры RSS лент: для каждой пары (связка, лента) — идентификаторы уже
+    обработанных записей. Хранятся в одном JSON файле, который могут
+    обновлять несколько ingest-воркеров: при сохранении файл блокируется,
+    перечитывается и в него вливаются только изменённые курсоры.
+    """
+
+    SEEN_LIMIT = 1000
+
+    def __init__(self, path=RSS_CURSOR_FILE):
+        self.path = path
+        self.cursors = self._read()
+        self._dirty = set()
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Не удалось прочитать курсоры RSS лент из {self.path}: {e}")
+            return {}
+
+    @staticmethod
+    def key(rss_url, linkage_name):
+        return f"{linkage_name or ''} {rss_url}"
+
+    def seen(self, rss_url, linkage_name):
+        """Множество обработанных записей или None, если лента ещё не опрашивалась."""
+        cursor = self.cursors.get(self.key(rss_url, linkage_name))
+        return set(cursor) if cursor is not None else None
+
+    def advance(self, rss_url, linkage_name, entry_keys):
+        """Добавляет записи в курсор ленты, сохраняя не больше SEEN_LIMIT последних."""
+        key = self.key(rss_url, linkage_name)
+        cursor = [k for k in self.cursors.get(key, []) if k not in set(entry_keys)] + list(entry_keys)
+        self.cursors[key] = cursor[-self.SEEN_LIMIT:]
+        self._dirty.add(key)
+
+    def save(self):
+        if not self._dirty or not self.path:
+            return
+        try:
+            with open(self.path + ".lock", 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                merged = self._read()
+                for key in self._dirty:
+                    merged[key] = self.cursors[key]
+                atomic_write_json(self.path, merged, indent=None)
+            self.cursors = merged
+            self._dirty.clear()
+        except OSError as e:
+            logger.error(f"Не удалось сохранить курсоры RSS лент в {self.path}: {e}")
+
 
 class RSS_Parser:
     """
-    Парсит RSS каналы и возвращает новость в формате:
+    Парсит RSS каналы и возвращает новости в формате:
     {id, type:rss, txt, img, src:url, src_name}
+
+    За один опрос обрабатываются все записи ленты, которых ещё нет в её
+    курсоре (но не больше max_entries самых свежих). Статьи загружаются
+    параллельно через общий пул соединений (не больше HTTP_PER_HOST
+    одновременных запросов к одному хосту).
+    Новости возвращаются от старых к новым. При первом опросе ленты берётся
+    только самая свежая запись, остальные отмечаются как обработанные.
     """
 
-    def parse(self, rss_url):
-        rss = feedparser.parse(rss_url)
-        results = []
+    def __init__(self, cursors=None, max_entries=RSS_MAX_ENTRIES):
+        self.cursors = cursors or FeedCursors()
+        self.max_entries = max_entries
+        self.executor = ThreadPoolExecutor(max_workers=RSS_ARTICLE_WORKERS, thread_name_prefix="rss-article")
 
-        for item in rss.entries[:1]:
-            article_data = {
-                "id": get_next_id(),
-                "type": "rss",
-                "txt": None,
-                "img": None,
-                "src": rss_url,
-                "src_name": rss.feed.get("title", "Unknown")
-            }
+    def parse(self, rss_url, linkage_name=None):
+        host_health.check(rss_url)
+        with metrics.timer("feed_fetch", linkage_name, rss_url):
+            try:
+                response = http.get(rss_url, timeout=FEED_TIMEOUT)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                if is_host_failure(e):
+                    host_health.record_failure(rss_url, e)
+                raise SourceError(f"Не удалось получить RSS ленту {rss_url}: {e}") from e
+            rss = feedparser.parse(response.content)
+            if rss.get("bozo") and not rss.entries:
+                host_health.record_failure(rss_url, rss.get("bozo_exception"))
+                raise SourceError(f"Не удалось разобрать RSS ленту {rss_url}: {rss.get('bozo_exception')}")
+        host_health.record_success(rss_url)
+        feed_title = rss.feed.get("title", "Unknown")
+        entries = [entry for entry in rss.entries if entry.get("link") and entry_key(entry)]
+        seen = self.cursors.seen(rss_url, linkage_name)
+        if seen is None:
+            fresh = entries[:1]
+            self.cursors.advance(rss_url, linkage_name, [entry_key(entry) for entry in reversed(entries[1:])])
+        else:
+            fresh = [entry for entry in entries if entry_key(entry) not in seen]
+        if len(fresh) > self.max_entries:
+            skipped = fresh[self.max_entries:]
+            fresh = fresh[:self.max_entries]
+            logger.warning(f"В ленте {rss_url} {len(skipped)} новых записей сверх лимита {self.max_entries} пропущено.")
+            metrics.inc("items_skipped_total", len(skipped), linkage=linkage_name, source=rss_url)
+            self.cursors.advance(rss_url, linkage_name, [entry_key(entry) for entry in reversed(skipped)])
+
+        # Ленты отдают записи от новых к старым, а в модерацию они уходят от старых к новым.
+        fresh.reverse()
+        futures = [self.executor.submit(self._fetch_article, item, rss_url, feed_title, linkage_name)
+                   for item in fresh]
 
+        results = []
+        processed = []
+        for item, future in zip(fresh, futures):
             try:
+                article_data, retry = future.result()
+            except Exception as e:
+                logger.error(f"Не удалось обработать запись {item.get('link')} ленты {rss_url}: {e}")
+                article_data, retry = None, False
+            if not retry:
+                processed.append(entry_key(item))
+            if article_data and article_data["txt"]:
+                results.append(article_data)
+            elif article_data:
+                # Изображение уже загружено и учтено в image_index — отпускаем его.
+                delete_news_image(article_data)
 
-                response = requests.get(item.link)
-                response.raise_for_status()
+        self.cursors.advance(rss_url, linkage_name, processed)
+        self.cursors.save()
+        return results
+
+    def _fetch_article(self, item, rss_url, feed_title, linkage_name=None):
+        """
+        Загружает статью записи ленты и её изображение.
+        Возвращает (article_data, retry): retry=True, если статью стоит
+        попробовать загрузить при следующем опросе (хост недоступен).
+        """
+        article_data = NewsRecord(id=get_next_id(), type="rss", src=rss_url, src_name=feed_title)
+
+        try:
+
+            host_health.check(item.link)
+            with metrics.timer("article_fetch", linkage_name, rss_url):
+                try:
+                    response = http.get(item.link, timeout=ARTICLE_TIMEOUT)
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    if is_host_failure(e):
+                        host_health.record_failure(item.link, e)
+                    raise
+            host_health.record_success(item.link)
+
+            with metrics.timer("parse", linkage_name, rss_url):
                 soup = BeautifulSoup(response.text, 'html.parser')
 
                 article_body = soup.find('article') or soup.find('div', {'class': 'story-body'})
@@ -45,33 +206,44 @@ class RSS_Parser:
                         clean_text = clean_text[:1024]
                     article_data["txt"] = clean_text
 
-                img_url = None
+            img_url = None
 
-                if hasattr(item, 'media_content') and item.media_content:
-                    img_url = item.media_content[0].get("url", None)
+            if hasattr(item, 'media_content') and item.media_content:
+                img_url = item.media_content[0].get("url", None)
 
-                if not img_url and "description" in item:
-                    soup_desc = BeautifulSoup(item["description"], 'html.parser')
-                    img_tag = soup_desc.find("img")
-                    if img_tag and img_tag.get("src"):
-                        img_url = img_tag["src"]
+            if not img_url and "description" in item:
+                soup_desc = BeautifulSoup(item["description"], 'html.parser')
+                img_tag = soup_desc.find("img")
+                if img_tag and img_tag.get("src"):
+                    img_url = img_tag["src"]
 
-                if not img_url:
-                    img_tag = soup.find("img")
-                    if img_tag and img_tag.get("src"):
-                        img_url = img_tag["src"]
+            if not img_url:
+                img_tag = soup.find("img")
+                if img_tag and img_tag.get("src"):
+                    img_url = img_tag["src"]
 
-                if img_url:
+            if img_url:
+                with metrics.timer("image_download", linkage_name, rss_url):
                     img_path = self.save_image(img_url, article_data["id"])
-                    article_data["img"] = img_path if img_path and isinstance(img_path, str) else None
+                article_data["img"] = img_path if img_path and isinstance(img_path, str) else None
+                if article_data["img"]:
+                    article_data["img"] = image_index.register(article_data["img"], article_data, linkage_name)
 
-            except requests.RequestException as e:
-                logger.error(f"Ошибка загрузки страницы: {e}")
-
-            if article_data["txt"]:
-                results.append(article_data)
+        except requests.RequestException as e:
+            logger.error(f"Ошибка загрузки страницы: {e}")
+            return article_data, is_host_failure(e)
+        except CircuitOpenError as e:
+            logger.debug(f"Статья {item.link} пропущена: {e}")
+            return article_data, True
+        except Exception as e:
+            # Ошибка разбора или изображения повторится и при следующем опросе: запись
+            # считается обработанной, а уже загруженное изображение отпускается.
+            logger.error(f"Не удалось обработать запись {item.get('link')} ленты {rss_url}: {e}")
+            metrics.inc("items_dropped_total", linkage=linkage_name, reason="error")
+            delete_news_image(article_data)
+            return None, False
 
-        return results
+        return article_data, False
 
     def convert_svg_to_png(self, svg_path, output_path):
         """
@@ -98,8 +270,17 @@ class RSS_Parser:
             if not os.path.exists("images"):
                 os.makedirs("images")
 
-            img_response = requests.get(img_url, timeout=10)
-            img_response.raise_for_status()
+            if not host_health.allow(img_url):
+                logger.debug(f"Изображение {img_url} пропущено: хост в карантине")
+                return None
+            try:
+                img_response = http.get(img_url, timeout=IMAGE_TIMEOUT)
+                img_response.raise_for_status()
+            except requests.RequestException as e:
+                if is_host_failure(e):
+                    host_health.record_failure(img_url, e)
+                raise
+            host_health.record_success(img_url)
 
             with open(img_filename, 'wb') as f:
                 f.write(img_response.content)
@@ -162,56 +343,40 @@ class DatabaseHandler:
 
 
 class NewsFetcher:
-    def __init__(self):
+    def __init__(self, archive=None):
         self.rss_parser = RSS_Parser()
+        self.archive = archive or news_archive
+        # Один поток: загрузка и разбор лент не блокируют event loop, а курсоры лент
+        # по-прежнему меняются только из одного места.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rss-feed")
 
-    def create_rss_output_file(self, rss_db_file):
-        """
-        Создает новый файл для добавления новостей из RSS.
-        """
-        with open(rss_db_file, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(["ID", "TYPE", "TXT", "IMG", "SRC", "SRC_NAME"])
-        print(f"Файл {rss_db_file} был успешно создан.")
+    async def fetch_new_rss_news_async(self, rss_urls, linkage_name=None):
+        """fetch_new_rss_news в отдельном потоке — для вызова из event loop."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.fetch_new_rss_news, rss_urls, linkage_name)
 
-    def fetch_new_rss_news(self, rss_urls, rss_db_file):
+    def fetch_new_rss_news(self, rss_urls, linkage_name=None):
         new_posts = []
-
-        if not os.path.exists(rss_db_file):
-            self.create_rss_output_file(rss_db_file)
+        batch_keys = set()
 
         for rss_url in rss_urls:
             print(f"Обрабатываем RSS канал: {rss_url}")
-            posts = self.rss_parser.parse(rss_url)
+            posts = self.rss_parser.parse(rss_url, linkage_name)
+            metrics.inc("items_fetched_total", len(posts), linkage=linkage_name, source=rss_url)
             for post in posts:
                 if post["txt"] and post["txt"].strip():
-                    if not self.is_post_already_added(post["txt"], rss_db_file):
+                    with metrics.timer("dedup_check", linkage_name, rss_url):
+                        key = post.dedup_key(linkage_name)
+                        already_added = key in batch_keys or self.archive.contains_news(linkage_name, post)
+                    if not already_added:
+                        batch_keys.add(key)
                         new_posts.append(post)
-                        self.add_to_rss_output_file(post, rss_db_file)
+                    else:
+                        print(f"Новость уже добавлена: {post['txt']}")
+                        delete_news_image(post)
+                        metrics.inc("items_deduplicated_total", linkage=linkage_name, source=rss_url)
+                else:
+                    delete_news_image(post)
+
+        self.archive.append(linkage_name, new_posts)
         return new_posts
-
-    def add_to_rss_output_file(self, post_data, rss_db_file):
-        """
-        Добавляет новую новость в файл RSS.
-        """
-        try:
-            with open(rss_db_file, mode='a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([post_data["id"], post_data["type"], post_data["txt"], post_data["img"], post_data["src"], post_data["src_name"]])
-            print(f"Новость с текстом: \"{post_data['txt']}\" добавлена в {rss_db_file}.")
-        except Exception as e:
-            print(f"Ошибка при добавлении новости в файл: {e}")
-
-    def is_post_already_added(self, post_text, rss_db_file):
-        try:
-            with open(rss_db_file, mode='r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                next(reader)
-                for row in reader:
-                    if len(row) > 2 and row[2] == post_text:
-                        print(f"Новость уже добавлена: {post_text}")
-                        return True
-            return False
-        except Exception as e:
-            print(f"Ошибка при проверке файла: {e}")
-            return False
@@ -0,0 +1,179 @@
+import glob
+import json
+import logging
+import math
+import os
+import time
+
+from helpers import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+POLL_STATE_FILE = "poll_state.json"
+
+
+class PollScheduler:
+    """
+    Адаптивный планировщик опроса источников.
+
+    Для каждого URL хранит текущий интервал, время следующего опроса и
+    сглаженный (EWMA) интервал между новыми публикациями. Активные источники
+    опрашиваются примерно вдвое чаще, чем они публикуют, тихие и ошибочные —
+    реже с экспоненциальной задержкой до max_interval. Если у ресурса в
+    конфигурации связки задан "poll_interval", он используется как есть.
+    """
+
+    QUIET_BACKOFF = 1.5
+    ERROR_BACKOFF = 2.0
+    SMOOTHING = 0.3
+    POLL_FRACTION = 0.5
+
+    def __init__(self, state_file=POLL_STATE_FILE, min_interval=10, max_interval=3600, clock=time.time):
+        self.state_file = state_file
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.clock = clock
+        self.sources = self._load_state()
+        self._dirty = False
+
+    @classmethod
+    def from_state_files(cls, pattern="poll_state*.json"):
+        """Собирает состояние всех ingest-воркеров (только для отображения)."""
+        scheduler = cls(state_file=None)
+        for path in sorted(glob.glob(pattern)):
+            scheduler.state_file = path
+            scheduler.sources.update(scheduler._load_state())
+        scheduler.state_file = None
+        return scheduler
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Не удалось прочитать состояние планировщика {self.state_file}: {e}")
+            return {}
+
+    def save(self):
+        """Сохраняет выученные интервалы, если они менялись с прошлого сохранения."""
+        if not self._dirty or not self.state_file:
+            return
+        try:
+            atomic_write_json(self.state_file, self.sources)
+            self._dirty = False
+        except OSError as e:
+            logger.error(f"Не удалось сохранить состояние планировщика {self.state_file}: {e}")
+
+    def _state(self, url):
+        state = self.sources.get(url)
+        if state is None:
+            state = self.sources[url] = {
+                "interval": self.min_interval,
+                "next_poll": 0,
+                "last_item_at": None,
+                "avg_gap": None,
+                "errors": 0,
+            }
+        return state
+
+    def _clamp(self, value, ceiling=None):
+        return max(self.min_interval, min(ceiling or self.max_interval, self.max_interval, value))
+
+    def is_due(self, url, pinned=None, ceiling=None):
+        """
+        Проверяет, пора ли опрашивать источник. ceiling — наибольший допустимый
+        интервал (для источников приоритетных полос).
+        """
+        state = self._state(url)
+        now = self.clock()
+        if now < state.get("deferred_until", 0):
+            return False
+        if pinned:
+            last_poll = state.get("last_poll", 0)
+            return now - last_poll >= float(pinned)
+        if ceiling and not state["errors"] and now - state.get("last_poll", 0) >= ceiling:
+            return True
+        return now >= state["next_poll"]
+
+    def record_result(self, url, new_items, pinned=None, ceiling=None):
+        """Учитывает успешный опрос и количество новых (не дублирующихся) новостей."""
+        state = self._state(url)
+        now = self.clock()
+        state["last_poll"] = now
+        state["errors"] = 0
+
+        if new_items:
+            if state["last_item_at"] is not None:
+                gap = (now - state["last_item_at"]) / new_items
+                if state["avg_gap"] is None:
+                    state["avg_gap"] = gap
+                else:
+                    state["avg_gap"] = self.SMOOTHING * gap + (1 - self.SMOOTHING) * state["avg_gap"]
+            state["last_item_at"] = now
+            if state["avg_gap"] is not None:
+                state["interval"] = self._clamp(state["avg_gap"] * self.POLL_FRACTION, ceiling)
+            else:
+                state["interval"] = self.min_interval
+        else:
+            state["interval"] = self._clamp(state["interval"] * self.QUIET_BACKOFF, ceiling)
+
+        if pinned:
+            state["interval"] = float(pinned)
+        state["next_poll"] = now + state["interval"]
+        self._dirty = True
+
+    def record_error(self, url, pinned=None):
+        """Учитывает ошибку опроса: интервал растёт экспоненциально до max_interval."""
+        state = self._state(url)
+        now = self.clock()
+        state["last_poll"] = now
+        state["errors"] += 1
+        # Показатель ограничен: дальше max_interval интервал всё равно не растёт, а степень
+        # неограниченного счётчика (он переживает перезапуски) переполняет float.
+        exponent = min(state["errors"], self._max_error_exponent())
+        state["interval"] = self._clamp(self.min_interval * self.ERROR_BACKOFF ** exponent)
+        if pinned:
+            state["interval"] = max(float(pinned), state["interval"])
+        state["next_poll"] = now + state["interval"]
+        self._dirty = True
+
+    def defer(self, url, delay):
+        """
+        Откладывает опрос источника на delay секунд, не считая это ошибкой
+        источника: интервал и счётчик ошибок не меняются.
+        """
+        state = self._state(url)
+        state["deferred_until"] = self.clock() + delay
+        self._dirty = True
+
+    def _max_error_exponent(self):
+        ratio = max(self.max_interval / max(self.min_interval, 1e-9), 1.0)
+        return math.ceil(math.log(ratio, self.ERROR_BACKOFF)) + 1
+
+    def forget(self, url):
+        """Удаляет состояние источника, который больше не используется ни в одной связке."""
+        if self.sources.pop(url, None) is not None:
+            self._dirty = True
+
+    def describe(self, url, pinned=None):
+        """Краткое описание расписания источника для view_linkages."""
+        if pinned:
+            return f"каждые {_format_seconds(float(pinned))} (закреплено)"
+        state = self.sources.get(url)
+        if not state:
+            return "ещё не опрашивался"
+        text = f"каждые {_format_seconds(state['interval'])}"
+        if state["errors"]:
+            text += f", ошибок подряд: {state['errors']}"
+        return text
+
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections.abc import MutableMapping
+
+from config import SESSIONS_FILE
+from helpers import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+STATE_TTL = 3600
+FLUSH_INTERVAL = 2
+
+
+class UserStates(MutableMapping):
+    """
+    Шаги диалогов пользователей (user_id -> dict) с истечением по TTL.
+
+    Обращение по ключу продлевает жизнь состояния; состояние, которое не
+    трогали дольше ttl секунд (брошенный на середине мастер создания связки),
+    считается отсутствующим.
+    """
+
+    def __init__(self, ttl=STATE_TTL, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._states = {}
+        self._touched = {}
+
+    def _is_expired(self, user_id):
+        return self.clock() - self._touched.get(user_id, 0) > self.ttl
+
+    def __getitem__(self, user_id):
+        if user_id not in self._states or self._is_expired(user_id):
+            self._drop(user_id)
+            raise KeyError(user_id)
+        self._touched[user_id] = self.clock()
+        return self._states[user_id]
+
+    def __setitem__(self, user_id, state):
+        self._states[user_id] = state
+        self._touched[user_id] = self.clock()
+
+    def __delitem__(self, user_id):
+        if user_id not in self._states:
+            raise KeyError(user_id)
+        self._drop(user_id)
+
+    def __iter__(self):
+        return iter([user_id for user_id in self._states if not self._is_expired(user_id)])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr({user_id: self._states[user_id] for user_id in self})
+
+    def _drop(self, user_id):
+        self._states.pop(user_id, None)
+        self._touched.pop(user_id, None)
+
+    def purge_expired(self):
+        """Удаляет истёкшие состояния. Возвращает их количество."""
+        expired = [user_id for user_id in self._states if self._is_expired(user_id)]
+        for user_id in expired:
+            self._drop(user_id)
+        return len(expired)
+
+    def dump(self):
+        return {str(user_id): {"state": self._states[user_id], "touched": self._touched[user_id]}
+                for user_id in self}
+
+    def restore(self, dumped):
+        self._states.clear()
+        self._touched.clear()
+        for user_id, entry in dumped.items():
+            self._states[int(user_id)] = entry["state"]
+            self._touched[int(user_id)] = entry["touched"]
+        self.purge_expired()
+
+
+class SessionStore:
+    """
+    Сессии администраторов бота: авторизованные пользователи и шаги диалогов.
+
+    Все чтения и изменения идут в памяти; на диск состояние сбрасывается
+    фоновой задачей не чаще раза в FLUSH_INTERVAL секунд и только если оно
+    изменилось, поэтому перезапуск бота не разлогинивает операторов.
+    """
+
+    def __init__(self, path=SESSIONS_FILE, ttl=STATE_TTL, clock=time.time):
+        self.path = path
+        self.states = UserStates(ttl=ttl, clock=clock)
+        self.authenticated = set()
+        self._last_saved = None
+
+    def _snapshot(self):
+        return {
+            "authenticated_users": sorted(self.authenticated),
+            "user_states": self.states.dump(),
+        }
+
+    def restore(self):
+        """Загружает сессии, сохранённые предыдущим запуском."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Не удалось прочитать сессии из {self.path}: {e}")
+            return
+
+        self.authenticated.clear()
+        self.authenticated.update(data.get("authenticated_users", []))
+        self.states.restore(data.get("user_states", {}))
+        self._last_saved = json.dumps(self._snapshot(), ensure_ascii=False, sort_keys=True)
+        logger.info(f"Восстановлены сессии: авторизованных пользователей {len(self.authenticated)}, "
+                    f"незавершённых диалогов {len(self.states)}.")
+
+    def flush(self):
+        """Сохраняет сессии на диск, если они изменились с прошлого сохранения."""
+        self.states.purge_expired()
+        snapshot = self._snapshot()
+        serialized = json.dumps(snapshot, ensure_ascii=False, sort_keys=True)
+        if serialized == self._last_saved:
+            return
+        try:
+            atomic_write_json(self.path, snapshot, indent=None)
+            self._last_saved = serialized
+        except OSError as e:
+            logger.error(f"Не удалось сохранить сессии в {self.path}: {e}")
+
+    async def run_flusher(self):
+        """Фоновая задача отложенной записи сессий."""
+        try:
+            while True:
+                await asyncio.sleep(FLUSH_INTERVAL)
+                self.flush()
+        finally:
+            self.flush()
@@ -1,67 +1,67 @@
-import csv
-import os
 
-from telethon import TelegramClient
-
-from helpers import get_next_id
+from config import PARSER_SESSIONS
+from helpers import delete_news_image, get_next_id, SourceError
+from metrics import metrics
+from circuit_breaker import host_health
+from news_archive import news_archive
+from news_record import NewsRecord
+from image_index import image_index
+from parser_pool import ParserPool, SessionsExhaustedError, flood_wait_seconds
 
 
 class TelegramParser:
-    def __init__(self, api_id, api_hash):
-        self.client = TelegramClient('parser_session', api_id, api_hash)
+    def __init__(self, api_id, api_hash, sessions=PARSER_SESSIONS):
+        self.pool = ParserPool(api_id, api_hash, sessions)
+        self.archive = news_archive
         self.start()
 
     async def start(self):
-        if not self.client.is_connected():
-            await self.client.connect()
-        if not await self.client.is_user_authorized():
-            await self.authorize()
+        for session in self.pool.sessions:
+            await self.ensure_ready(session)
+
+    async def ensure_ready(self, session):
+        if not session.client.is_connected():
+            await session.client.connect()
+        if not await session.client.is_user_authorized():
+            await self.authorize(session)
 
     async def stop(self):
-        if self.client.is_connected():
-            await self.client.disconnect()
+        for session in self.pool.sessions:
+            if session.client.is_connected():
+                await session.client.disconnect()
 
     async def check_connection(self):
-        try:
-            await self.client.connect()
-            if not await self.client.is_user_authorized():
-                print("Не авторизован! Нужно выполнить авторизацию.")
-                return False
-            print("Авторизация успешна!")
-            return True
-        except Exception as e:
-            print(f"Ошибка подключения: {e}")
-            return False
-
-    async def authorize(self):
-        if await self.client.is_user_authorized():
+        ok = True
+        for session in self.pool.sessions:
+            try:
+                await session.client.connect()
+                if not await session.client.is_user_authorized():
+                    print(f"Сессия {session.name} не авторизована! Нужно выполнить авторизацию.")
+                    ok = False
+                    continue
+                print(f"Сессия {session.name}: авторизация успешна!")
+            except Exception as e:
+                print(f"Ошибка подключения сессии {session.name}: {e}")
+                ok = False
+        return ok
+
+    async def authorize(self, session):
+        if await session.client.is_user_authorized():
             print("Уже авторизован.")
             return
-        phone_number = input("Введите номер телефона в формате +1234567890: ")
+        phone_number = input(f"Сессия {session.name}: введите номер телефона в формате +1234567890: ")
         try:
             print("Отправляем код для авторизации...")
-            await self.client.send_code_request(phone_number)
+            await session.client.send_code_request(phone_number)
             code = input("Введите код из Telegram: ")
-            await self.client.sign_in(phone_number, code)
+            await session.client.sign_in(phone_number, code)
             print("Авторизация завершена.")
         except Exception as e:
             print(f"Ошибка авторизации: {e}")
 
-    async def get_last_post(self, channel_link, timeout=10):
+    async def get_last_post(self, channel_link, timeout=10, linkage_name=None):
         try:
-            if not self.client.is_connected():
-                await self.client.connect()
-            if not await self.client.is_user_authorized():
-                await self.authorize()
-
             print(f"Запрашиваем последние сообщения из канала: {channel_link}")
-            if not await self.client.is_user_authorized():
-                await self.authorize()
-
-            print("Подключаемся к Telegram...")
-            if not self.client.is_connected():
-                await self.client.connect()
-            print("Подключение установлено.")
 
             if not channel_link.startswith("https://"):
                 channel_link = "https://" + channel_link
@@ -73,34 +73,55 @@ class TelegramParser:
 
             print(f"Запрашиваем последние сообщения из канала: {channel_username}...")
 
-            message = (await self.client.get_messages(channel_username, limit=1))[0]
-
-            post_data = {
-                "id": get_next_id(),
-                "type": "tg",
-                "txt": self.format_text(message.text),
-                "img": None,
-                "src": channel_link,
-                "src_name": message.chat.title if message.chat else "Unknown"
-            }
+            async def fetch(session):
+                await self.ensure_ready(session)
+                return await session.client.get_messages(channel_username, limit=1)
+
+            host_health.check(channel_link)
+            try:
+                with metrics.timer("feed_fetch", linkage_name, channel_link):
+                    messages, session = await self.pool.request(channel_link, fetch)
+                    message = messages[0]
+            except SessionsExhaustedError:
+                # FloodWait аккаунтов парсера — не сбой канала, карантин ему не нужен.
+                raise
+            except Exception as e:
+                host_health.record_failure(channel_link, e)
+                raise
+            host_health.record_success(channel_link)
+
+            post_data = NewsRecord(
+                id=get_next_id(),
+                type="tg",
+                txt=self.format_text(message.text),
+                src=channel_link,
+                src_name=message.chat.title if message.chat else "Unknown"
+            )
 
             if message.photo:
                 try:
 
-                    image_path = await self.client.download_media(message.photo,
-                                                                  file="images/")
-                    post_data["img"] = image_path
+                    # Ссылка на файл действительна только для аккаунта, получившего сообщение.
+                    with metrics.timer("image_download", linkage_name, channel_link):
+                        image_path = await session.client.download_media(message.photo,
+                                                                         file="images/")
+                    post_data["img"] = await image_index.register_async(image_path, post_data, linkage_name)
                     print(f"Фото сохранено в {image_path}")
                 except Exception as e:
+                    seconds = flood_wait_seconds(e)
+                    if seconds is not None:
+                        session.record_flood_wait(seconds)
                     print(f"Ошибка загрузки фото: {e}")
                     post_data["img"] = None
 
             print("Последнее сообщение успешно получено.")
             return post_data
 
+        except SessionsExhaustedError:
+            raise
         except Exception as e:
             print(f"Ошибка: {e}")
-            return None
+            raise SourceError(f"Не удалось получить сообщения из {channel_link}: {e}") from e
 
     def format_text(self, text):
         """
@@ -113,65 +134,25 @@ class TelegramParser:
             formatted_text = formatted_text[:1024]
         return formatted_text
 
-    async def fetch_new_telegram_news(self, tg_urls, tg_db_file):
+    async def fetch_new_telegram_news(self, tg_urls, linkage_name=None):
         new_posts = []
 
-        if not os.path.exists(tg_db_file):
-            self.create_tg_db(tg_db_file)
-
         for channel_link in tg_urls:
             print(f"Обрабатываем Telegram-канал: {channel_link}")
 
-            last_post = await self.get_last_post(channel_link)
-            if last_post and not self.is_post_already_added(tg_db_file, last_post["txt"]):
+            last_post = await self.get_last_post(channel_link, linkage_name=linkage_name)
+            already_added = False
+            if last_post:
+                metrics.inc("items_fetched_total", linkage=linkage_name, source=channel_link)
+                with metrics.timer("dedup_check", linkage_name, channel_link):
+                    already_added = self.archive.contains_news(linkage_name, last_post)
+            if last_post and not already_added:
                 new_posts.append(last_post)
-                self.add_post_to_tg_db(tg_db_file, last_post)
+                self.archive.append(linkage_name, [last_post])
             else:
+                if last_post:
+                    metrics.inc("items_deduplicated_total", linkage=linkage_name, source=channel_link)
+                    delete_news_image(last_post)
                 print(f"Новость из {channel_link} уже была добавлена ранее, пропускаем.")
 
         return new_posts
-
-    def create_tg_db(self, tg_db_file):
-        """
-        Создает новый файл tg_db с заголовками для новых новостей.
-        """
-        with open(tg_db_file, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(["ID", "TYPE", "TXT", "IMG", "SRC", "SRC_NAME"])
-
-        print(f"Файл {tg_db_file} был успешно создан.")
-
-    def add_post_to_tg_db(self, tg_db_file, post_data):
-        """
-        Добавляет новую новость в файл tg_db.csv.
-        :param tg_db_file: Путь к файлу tg_db.csv.
-        :param post_data: Данные поста, который нужно добавить.
-        """
-        try:
-            with open(tg_db_file, mode='a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(
-                    [post_data["id"], post_data["type"], post_data["txt"], post_data["img"], post_data["src"],
-                     post_data["src_name"]])
-            print(f"Новость с текстом: \"{post_data['txt']}\" добавлена в {tg_db_file}.")
-        except Exception as e:
-            print(f"Ошибка при добавлении новости в файл: {e}")
-
-    def is_post_already_added(self, tg_db_file, post_text):
-        """
-        Проверяет, была ли уже добавлена новость с данным текстом в tg_db.csv.
-        :param tg_db_file: Путь к файлу tg_db.csv.
-        :param post_text: Текст поста, который нужно проверить.
-        :return: True, если новость уже добавлена, иначе False.
-        """
-        try:
-            with open(tg_db_file, mode='r', encoding='utf-8') as file:
-                reader = csv.reader(file)
-                next(reader)
-                for row in reader:
-                    if len(row) > 0 and row[2] == post_text:
-                        return True
-            return False
-        except Exception as e:
-            print(f"Ошибка при проверке файла: {e}")
-            return False
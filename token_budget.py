@@ -0,0 +1,257 @@
+"""
+Бюджет токенов и учёт расходов на GPT.
+
+Токены считаются локальным токенизатором tiktoken (кодировка модели
+GPT_MODEL); без него — приближённо, по словам и знакам препинания.
+Текст новости обрезается до token_budget токенов связки (по умолчанию
+GPT_INPUT_TOKENS), а не до фиксированного числа символов.
+
+Расход (токены запроса и ответа, стоимость по GPT_PRICE_INPUT и
+GPT_PRICE_OUTPUT за 1000 токенов) копится по связкам и дням UTC в памяти
+и раз в FLUSH_INTERVAL секунд переносится в gpt_usage.json, общий для
+бота и воркеров. Лимиты связки на день:
+
+    "daily_token_cap": 200000,   # токенов запроса и ответа
+    "daily_cost_cap": 1.5        # долларов
+
+После достижения лимита GPT для связки не вызывается до конца дня:
+публикуется очищенный исходный текст, потоковый предпросмотр не запускается.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+from config import (GPT_MODEL, GPT_INPUT_TOKENS, GPT_PRICE_INPUT, GPT_PRICE_OUTPUT,
+                    GPT_USAGE_FILE, GPT_USAGE_DAYS)
+from helpers import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Как часто накопленный расход записывается в файл, секунд.
+FLUSH_INTERVAL = 5
+
+# Накладные токены формата чата на каждое сообщение и на ответ.
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.encoding_for_model(GPT_MODEL)
+        except Exception:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def _piece_tokens(piece):
+    # Без токенизатора: латиница — около 4 символов на токен, остальное — около 2.
+    per_token = 4 if piece.isascii() else 2
+    return max(1, math.ceil(len(piece) / per_token))
+
+
+def count_tokens(text):
+    """Количество токенов в тексте."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return sum(_piece_tokens(piece) for piece in _PIECE_RE.findall(text))
+
+
+def trim_to_tokens(text, max_tokens):
+    """Обрезает текст до max_tokens токенов (по границе токена или слова)."""
+    if not text or max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens]).strip()
+
+    used = 0
+    for match in _PIECE_RE.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            return text[:match.start()].strip()
+    return text
+
+
+def count_message_tokens(messages):
+    """Токены запроса ChatCompletion с учётом разметки сообщений."""
+    return sum(MESSAGE_OVERHEAD + count_tokens(m["content"]) for m in messages) + REPLY_OVERHEAD
+
+
+def token_budget(linkage):
+    return int(linkage.get("token_budget", GPT_INPUT_TOKENS)) if linkage else GPT_INPUT_TOKENS
+
+
+def cost_of(prompt_tokens, completion_tokens):
+    return (prompt_tokens * GPT_PRICE_INPUT + completion_tokens * GPT_PRICE_OUTPUT) / 1000
+
+
+def today(clock=time.time):
+    return time.strftime("%Y-%m-%d", time.gmtime(clock()))
+
+
+class GptUsage:
+    """
+    Расход GPT по дням и связкам: {день: {связка: {calls, prompt_tokens,
+    completion_tokens, cost}}}.
+
+    record только копит расход в памяти, а на диск его переносит фоновая
+    задача run_flusher раз в FLUSH_INTERVAL секунд, вне event loop. Запись
+    блокирует файл, перечитывает его и прибавляет накопленное, поэтому
+    несколько процессов не теряют данные.
+    """
+
+    def __init__(self, path=GPT_USAGE_FILE, keep_days=GPT_USAGE_DAYS, clock=time.time):
+        self.path = path
+        self.keep_days = keep_days
+        self.clock = clock
+        self.usage = self._read()
+        self._read_at = self.clock()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._capped = set()
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Не удалось прочитать расход GPT из {self.path}: {e}")
+            return {}
+
+    @staticmethod
+    def _add(usage, day, linkage_name, spent):
+        entry = usage.setdefault(day, {}).setdefault(
+            linkage_name, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+        entry["calls"] += spent["calls"]
+        entry["prompt_tokens"] += spent["prompt_tokens"]
+        entry["completion_tokens"] += spent["completion_tokens"]
+        entry["cost"] = round(entry["cost"] + spent["cost"], 6)
+
+    def record(self, linkage_name, prompt_tokens, completion_tokens):
+        """Прибавляет расход одного запроса к расходу связки за сегодня (на диск — при flush)."""
+        day = today(self.clock)
+        spent = {"calls": 1, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "cost": cost_of(prompt_tokens, completion_tokens)}
+        with self._lock:
+            self._add(self._pending, day, linkage_name or "", spent)
+            self._add(self.usage, day, linkage_name or "", spent)
+
+    def flush(self):
+        """Прибавляет накопленный расход к файлу. Блокирующий вызов — из event loop через run_flusher."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                with open(self.path + ".lock", 'a') as lock:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_EX)
+                    usage = self._read()
+                    for day, linkages in pending.items():
+                        for linkage_name, spent in linkages.items():
+                            self._add(usage, day, linkage_name, spent)
+                    for old_day in sorted(usage)[:-self.keep_days]:
+                        del usage[old_day]
+                    atomic_write_json(self.path, usage, indent=None)
+            except OSError as e:
+                logger.error(f"Не удалось сохранить расход GPT в {self.path}: {e}")
+                with self._lock:
+                    for day, linkages in pending.items():
+                        for linkage_name, spent in linkages.items():
+                            self._add(self._pending, day, linkage_name, spent)
+                return
+            with self._lock:
+                self.usage = self._with_pending(usage)
+                self._read_at = self.clock()
+
+    async def run_flusher(self):
+        """Фоновая задача отложенной записи расхода."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(FLUSH_INTERVAL)
+                await loop.run_in_executor(None, self.flush)
+        finally:
+            self.flush()
+
+    def _with_pending(self, usage):
+        """Расход из файла вместе с ещё не записанным расходом этого процесса."""
+        for day, linkages in self._pending.items():
+            for linkage_name, spent in linkages.items():
+                self._add(usage, day, linkage_name, spent)
+        return usage
+
+    def today(self, linkage_name, max_age=5):
+        """Расход связки за сегодня (перечитывается, если старше max_age секунд)."""
+        if self.clock() - self._read_at > max_age:
+            usage = self._read()
+            with self._lock:
+                self.usage = self._with_pending(usage)
+                self._read_at = self.clock()
+        entry = self.usage.get(today(self.clock), {}).get(linkage_name or "", {})
+        return {
+            "calls": entry.get("calls", 0),
+            "tokens": entry.get("prompt_tokens", 0) + entry.get("completion_tokens", 0),
+            "cost": entry.get("cost", 0.0),
+        }
+
+    def cap_reached(self, linkage_name, linkage):
+        """Возвращает описание превышенного дневного лимита связки или None."""
+        if not linkage:
+            return None
+        spent = self.today(linkage_name)
+        reason = None
+        if "daily_token_cap" in linkage and spent["tokens"] >= linkage["daily_token_cap"]:
+            reason = f"токены {spent['tokens']}/{linkage['daily_token_cap']}"
+        elif "daily_cost_cap" in linkage and spent["cost"] >= linkage["daily_cost_cap"]:
+            reason = f"стоимость ${spent['cost']:.4f}/${linkage['daily_cost_cap']}"
+
+        key = (today(self.clock), linkage_name)
+        if reason and key not in self._capped:
+            self._capped.add(key)
+            logger.warning(f"Дневной лимит GPT связки '{linkage_name}' исчерпан ({reason}). "
+                           f"До конца дня публикуется исходный текст.")
+        return reason
+
+    def describe(self, linkage_name, linkage):
+        spent = self.today(linkage_name)
+        limits = []
+        if linkage.get("daily_token_cap"):
+            limits.append(f"лимит {linkage['daily_token_cap']} токенов")
+        if linkage.get("daily_cost_cap"):
+            limits.append(f"лимит ${linkage['daily_cost_cap']}")
+        suffix = f" ({', '.join(limits)})" if limits else ""
+        return f"{spent['calls']} запросов, {spent['tokens']} токенов, ${spent['cost']:.4f}{suffix}"
+
+
+gpt_usage = GptUsage()
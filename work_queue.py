@@ -0,0 +1,317 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import QUEUE_FILE
+from fair_share import fair_shares
+from news_record import NewsRecord
+from priority import lane_rank
+
+logger = logging.getLogger(__name__)
+
+MODERATION_QUEUE = "moderation"
+TRANSFORM_QUEUE = "transform"
+PUBLISH_QUEUE = "publish"
+
+MAX_ATTEMPTS = 5
+# Сколько секунд задачи хранятся в failed для разбора, прежде чем purge_failed их удалит.
+FAILED_RETENTION = 7 * 24 * 3600
+
+# Общий ресурс, который расходуют задачи очереди (см. fair_share).
+QUEUE_RESOURCES = {MODERATION_QUEUE: "send", TRANSFORM_QUEUE: "gpt", PUBLISH_QUEUE: "send"}
+
+
+class WorkQueue:
+    """
+    Надёжная локальная очередь задач на SQLite.
+
+    Задачи переживают перезапуск процессов: взятая задача «арендуется» на
+    lease секунд и, если воркер упал, не подтвердив её, снова становится
+    доступной. Несколько процессов на одной машине (или на общем диске)
+    могут работать с одним файлом очереди одновременно.
+
+    Новость задачи (payload["news"]) хранится отдельно от JSON payload —
+    в колонке news в двоичном виде NewsRecord, и из claim возвращается NewsRecord.
+    Задачи берутся по полосе приоритета новости (high раньше normal и low),
+    внутри полосы связки чередуются по весам (fair_share), а задачи одной
+    связки идут в порядке поступления. С fair=False связки не чередуются.
+    """
+
+    def __init__(self, path=QUEUE_FILE, lease=120, fair=True):
+        self.path = path
+        self.lease = lease
+        self.fair = fair
+        self._local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="work-queue")
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " queue TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'ready',"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " available_at REAL NOT NULL,"
+                " leased_by TEXT,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (queue, status, available_at)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "news" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN news BLOB")
+            if "priority" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 1")
+            if "linkage" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN linkage TEXT")
+                conn.execute("UPDATE jobs SET linkage = json_extract(payload, '$.linkage_name')")
+            if "text_hash" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN text_hash BLOB")
+            if "img" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN img TEXT")
+                rows = conn.execute("SELECT id, payload, news FROM jobs").fetchall()
+                conn.executemany("UPDATE jobs SET img = ? WHERE id = ?",
+                                 [(self._decode(payload, news).get("news", {}).get("img"), job_id)
+                                  for job_id, payload, news in rows])
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_lane ON jobs (queue, status, priority, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_text ON jobs (queue, text_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_linkage ON jobs (queue, status, linkage, priority, id)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode(queue, payload, now, delay=0):
+        payload = dict(payload)
+        news = payload.pop("news", None)
+        priority = lane_rank(news) if news is not None else lane_rank({})
+        text_hash = img = None
+        if news is not None:
+            record = NewsRecord.from_dict(news)
+            news, text_hash, img = record.to_bytes(), record.text_hash, record.img
+        return (queue, json.dumps(payload, ensure_ascii=False), news, priority, payload.get("linkage_name"),
+                text_hash, img, now + delay, now)
+
+    @staticmethod
+    def _decode(payload, news):
+        payload = json.loads(payload)
+        if "linkage_name" in payload:
+            payload["linkage_name"] = sys.intern(payload["linkage_name"])
+        if news is not None:
+            payload["news"] = NewsRecord.from_bytes(news)
+        elif "news" in payload:
+            # Задачи, поставленные до появления колонки news.
+            payload["news"] = NewsRecord.from_dict(payload["news"])
+        return payload
+
+    def put(self, queue, payload, delay=0):
+        """Кладёт задачу в очередь (доступной через delay секунд) и возвращает её ID."""
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (queue, payload, news, priority, linkage, text_hash, img, available_at, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            self._encode(queue, payload, time.time(), delay)
+        )
+        return cursor.lastrowid
+
+    def reschedule(self, job_id, queue, payload, delay=0):
+        """
+        Заменяет payload ещё не взятой задачи и делает её доступной через delay
+        секунд. Возвращает False, если задачу уже взяли или выполнили.
+        """
+        _, payload, news, priority, linkage, text_hash, img, available_at, _ = self._encode(queue, payload,
+                                                                                            time.time(), delay)
+        cursor = self._connect().execute(
+            "UPDATE jobs SET payload = ?, news = ?, priority = ?, linkage = ?, text_hash = ?, img = ?,"
+            " available_at = ? WHERE id = ? AND status = 'ready'",
+            (payload, news, priority, linkage, text_hash, img, available_at, job_id)
+        )
+        return cursor.rowcount > 0
+
+    def put_many(self, queue, payloads):
+        """Кладёт несколько задач в очередь одной транзакцией."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO jobs (queue, payload, news, priority, linkage, text_hash, img, available_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._encode(queue, payload, now) for payload in payloads]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, queue, worker_id):
+        """
+        Атомарно берёт готовую задачу (или задачу с истёкшей арендой) старшей
+        полосы: связку выбирает справедливая очередь ресурса, задачу связки —
+        самую старую. Возвращает {"id", "payload", "attempts"} или None.
+        """
+        conn = self._connect()
+        now = time.time()
+        share = fair_shares.get(QUEUE_RESOURCES.get(queue)) if self.fair else None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if share is None:
+                row = conn.execute(
+                    "SELECT id, payload, news, attempts FROM jobs"
+                    " WHERE queue = ? AND status IN ('ready', 'leased') AND available_at <= ?"
+                    " ORDER BY priority, id LIMIT 1",
+                    (queue, now)
+                ).fetchone()
+            else:
+                row = self._claim_fair(conn, queue, now, share)
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', leased_by = ?, available_at = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                (worker_id, now + self.lease, row[0])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"id": row[0], "payload": self._decode(row[1], row[2]), "attempts": row[3] + 1}
+
+    def claim_matching(self, queue, worker_id, text_hash, exclude_id=None):
+        """
+        Атомарно берёт все ждущие задачи очереди с тем же текстом новости
+        (включая отложенные), кроме exclude_id. Возвращает список задач как у claim.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload, news, attempts FROM jobs"
+                " WHERE queue = ? AND text_hash = ? AND status = 'ready' AND id IS NOT ? ORDER BY id",
+                (queue, text_hash, exclude_id)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'leased', leased_by = ?, available_at = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                [(worker_id, now + self.lease, row[0]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [{"id": row[0], "payload": self._decode(row[1], row[2]), "attempts": row[3] + 1} for row in rows]
+
+    @staticmethod
+    def _claim_fair(conn, queue, now, share):
+        lanes = conn.execute(
+            "SELECT linkage, MIN(priority) FROM jobs"
+            " WHERE queue = ? AND status IN ('ready', 'leased') AND available_at <= ? GROUP BY linkage",
+            (queue, now)
+        ).fetchall()
+        if not lanes:
+            return None
+        best = min(priority for _, priority in lanes)
+        linkage = share.pick([name for name, priority in lanes if priority == best])
+        row = conn.execute(
+            "SELECT id, payload, news, attempts FROM jobs"
+            " WHERE queue = ? AND status IN ('ready', 'leased') AND available_at <= ?"
+            " AND linkage IS ? AND priority = ? ORDER BY id LIMIT 1",
+            (queue, now, linkage, best)
+        ).fetchone()
+        share.charge(linkage)
+        return row
+
+    def ack(self, job_id):
+        """Подтверждает выполнение задачи."""
+        self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def nack(self, job_id, attempts, delay=5):
+        """Возвращает задачу в очередь с задержкой или откладывает её в failed после MAX_ATTEMPTS."""
+        if attempts >= MAX_ATTEMPTS:
+            # available_at задачи в failed — время переноса, по нему purge_failed считает срок хранения.
+            self._connect().execute(
+                "UPDATE jobs SET status = 'failed', leased_by = NULL, available_at = ? WHERE id = ?",
+                (time.time(), job_id)
+            )
+            logger.error(f"Задача {job_id} перенесена в failed после {attempts} попыток.")
+            return
+        self._connect().execute(
+            "UPDATE jobs SET status = 'ready', leased_by = NULL, available_at = ? WHERE id = ?",
+            (time.time() + delay, job_id)
+        )
+
+    def depth(self, queue):
+        """Количество ещё не выполненных задач в очереди."""
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE queue = ? AND status IN ('ready', 'leased')", (queue,)
+        ).fetchone()
+        return row[0]
+
+    def depth_by_linkage(self, queue):
+        """Количество невыполненных задач очереди по связкам: {linkage_name: count}."""
+        rows = self._connect().execute(
+            "SELECT linkage, COUNT(*) FROM jobs"
+            " WHERE queue = ? AND status IN ('ready', 'leased') GROUP BY 1", (queue,)
+        ).fetchall()
+        return dict(rows)
+
+    def image_paths(self):
+        """Изображения новостей всех задач, ещё лежащих в очереди (включая failed)."""
+        rows = self._connect().execute("SELECT DISTINCT img FROM jobs WHERE img IS NOT NULL").fetchall()
+        return {row[0] for row in rows}
+
+    def purge_failed(self, max_age=FAILED_RETENTION):
+        """Удаляет задачи, лежащие в failed дольше max_age секунд. Возвращает их число."""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status = 'failed' AND available_at < ?", (time.time() - max_age,)
+        )
+        return cursor.rowcount
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Выполняет метод очереди в её потоке: ожидание блокировки SQLite
+        (до 30 с при записи другим процессом) не останавливает event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                functools.partial(method, *args, **kwargs))
+
+
+async def consume(queue, queue_name, handler, worker_id, idle_sleep=0.5, stop_when_empty=False):
+    """
+    Забирает задачи из очереди и передаёт payload в корутину handler.
+    Ошибка обработчика возвращает задачу в очередь с экспоненциальной задержкой.
+    С stop_when_empty=True выходит, как только очередь опустела (для разовых прогонов).
+    """
+    processed = 0
+    while True:
+        job = await queue.call(queue.claim, queue_name, worker_id)
+        if job is None:
+            if stop_when_empty:
+                return processed
+            await asyncio.sleep(idle_sleep)
+            continue
+
+        try:
+            await handler(job["payload"])
+            await queue.call(queue.ack, job["id"])
+            processed += 1
+        except Exception as e:
+            logger.error(f"Ошибка обработки задачи {job['id']} из очереди '{queue_name}': {e}")
+            await queue.call(queue.nack, job["id"], job["attempts"], delay=min(300, 2 ** job["attempts"]))
+
+
+def default_worker_id(role):
+    return f"{role}-{os.getpid()}"
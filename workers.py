@@ -0,0 +1,427 @@
+"""
+Воркеры конвейера, которые можно запускать отдельно от бота:
+
+    python workers.py ingest --worker-index 0 --worker-count 2
+    python workers.py ingest --worker-index 1 --worker-count 2
+    python workers.py transform
+
+ingest    — опрашивает свои источники (раздел по crc32(url) % worker_count)
+            и кладёт новые новости в очередь moderation;
+transform — берёт принятые новости из очереди transform, обрабатывает их
+            GPT и кладёт результат в очередь publish.
+
+Очереди moderation и publish обслуживает процесс бота (main_bot.py).
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+import zlib
+from collections import Counter, deque
+
+import gpt_style_translation
+from backpressure import is_ingest_paused
+from circuit_breaker import host_health
+from config import (API_ID, API_HASH, CHECK_INTERVAL, FETCHES_PER_CYCLE, MAX_POLL_INTERVAL, METRICS_HOST,
+                    METRICS_PORT)
+from fair_share import fair_shares
+from helpers import SourceError, delete_news_image
+from linkage_config import LinkageWatcher
+from linkage_store import recover_linkages
+from loop_monitor import loop_watchdog
+from metrics import metrics, start_metrics_server
+from news_filter import NewsFilter
+from priority import LANE_MAX_POLL_INTERVAL, LANE_RANK, LANES, LaneClassifier
+from scheduler import PollScheduler, POLL_STATE_FILE
+from token_budget import gpt_usage
+from work_queue import WorkQueue, consume, default_worker_id, MODERATION_QUEUE, TRANSFORM_QUEUE, PUBLISH_QUEUE
+
+logger = logging.getLogger(__name__)
+
+
+def is_ready_linkage(linkage_name, linkage_data):
+    """Связка активна и у неё настроены чат модерации и канал публикации."""
+    if not linkage_data.get("is_active", False):
+        return False
+
+    if not linkage_data.get("moderation_bot"):
+        logger.warning(f"Связка '{linkage_name}' не имеет модерационного чата. Пропускаем.")
+        return False
+
+    if not linkage_data.get("publication_channel"):
+        logger.warning(f"Связка '{linkage_name}' не имеет канала публикации. Пропускаем.")
+        return False
+
+    return True
+
+
+class IngestWorker:
+    """
+    Опрашивает источники и кладёт новые новости в очередь moderation.
+    При worker_count > 1 обрабатывает только свою часть источников.
+    """
+
+    def __init__(self, queue, rss_fetcher, telegram_parser, worker_index=0, worker_count=1, scheduler=None,
+                 watcher=None):
+        self.queue = queue
+        self.rss_fetcher = rss_fetcher
+        self.telegram_parser = telegram_parser
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        if scheduler is None:
+            state_file = POLL_STATE_FILE if worker_count == 1 else f"poll_state_{worker_index}.json"
+            scheduler = PollScheduler(state_file=state_file, min_interval=CHECK_INTERVAL,
+                                      max_interval=MAX_POLL_INTERVAL)
+        self.scheduler = scheduler
+        # url -> {linkage_name: закреплённый poll_interval или None}
+        self.sources = {}
+        # linkage_name -> NewsFilter
+        self.filters = {}
+        # linkage_name -> LaneClassifier
+        self.lanes = {}
+        self.watcher = watcher or LinkageWatcher()
+        self.watcher.subscribe(self.apply_changes)
+
+    def owns(self, url):
+        return zlib.crc32(url.encode("utf-8")) % self.worker_count == self.worker_index
+
+    async def fetch_resource(self, url, linkage_name):
+        """Забирает новые (не дублирующиеся) новости одного ресурса связки."""
+        if "rss" in url or "feed" in url:
+            logger.info(f"Обрабатываем RSS канал: {url}")
+            return await self.rss_fetcher.fetch_new_rss_news_async([url], linkage_name)
+        elif "t.me" in url:
+            logger.info(f"Обрабатываем Telegram-канал: {url}")
+            return await self.telegram_parser.fetch_new_telegram_news([url], linkage_name)
+        logger.warning(f"Неизвестный тип ресурса '{url}' в связке '{linkage_name}'.")
+        return []
+
+    def apply_changes(self, changes):
+        """
+        Обновляет задания опроса по изменениям конфигурации связок: добавляет
+        новые источники, убирает источники, которые больше не нужны ни одной
+        связке, и меняет закреплённые интервалы.
+        """
+        for change in changes:
+            if change["type"] == "linkage_removed":
+                self.filters.pop(change["linkage"], None)
+                self.lanes.pop(change["linkage"], None)
+            elif "filters" in change.get("fields", []):
+                rules = self.watcher.linkages[change["linkage"]].get("filters")
+                if rules:
+                    self.filters[change["linkage"]] = NewsFilter(rules)
+                else:
+                    self.filters.pop(change["linkage"], None)
+
+            if change["linkage"] in self.watcher.linkages and (
+                    "url" in change or "priority_keywords" in change.get("fields", [])):
+                self.lanes[change["linkage"]] = LaneClassifier(self.watcher.linkages[change["linkage"]])
+
+            url = change.get("url")
+            if not url or not self.owns(url):
+                continue
+            if change["type"] == "source_removed":
+                job = self.sources.get(url)
+                if job is None:
+                    continue
+                job.pop(change["linkage"], None)
+                if not job:
+                    del self.sources[url]
+                    self.scheduler.forget(url)
+                    logger.info(f"Источник '{url}' больше не используется ни одной связкой, опрос остановлен.")
+            else:
+                self.sources.setdefault(url, {})[change["linkage"]] = change["poll_interval"]
+
+    def passes_filters(self, linkage_name, news):
+        """Проверяет новость фильтрами связки; отклонённая новость не попадает в модерацию."""
+        news_filter = self.filters.get(linkage_name)
+        if news_filter is None:
+            return True
+        with metrics.timer("filter", linkage_name, news.get("src")):
+            reason = news_filter.check(news)
+        if reason is None:
+            return True
+        logger.debug(f"Новость ID {news['id']} связки '{linkage_name}' отклонена фильтром ({reason}).")
+        metrics.inc("items_filtered_total", linkage=linkage_name, reason=reason)
+        delete_news_image(news)
+        return False
+
+    def source_lane(self, url, linkage_names):
+        """Старшая из полос, которые источнику назначили связки."""
+        lanes = [self.lanes[name].source_lane(url) for name in linkage_names if name in self.lanes]
+        return min(lanes, key=LANE_RANK.get, default=LANES[1])
+
+    @staticmethod
+    def fair_order(due):
+        """
+        Порядок опроса: по полосам приоритета, а внутри полосы источники
+        связок чередуются по весам (fair_share), чтобы связка с сотней
+        источников не задерживала опрос остальных.
+        """
+        for rank in sorted({item[0] for item in due}):
+            by_linkage = {}
+            for item in due:
+                if item[0] == rank:
+                    by_linkage.setdefault(item[3][0], deque()).append(item)
+            while by_linkage:
+                linkage_name = fair_shares["fetch"].pick(list(by_linkage))
+                yield by_linkage[linkage_name].popleft()
+                if not by_linkage[linkage_name]:
+                    del by_linkage[linkage_name]
+
+    @staticmethod
+    def fetch_quotas(due, budget=FETCHES_PER_CYCLE):
+        """
+        Сколько загрузок может сделать каждая связка за проход: budget делится
+        пропорционально весам связок, у которых есть источники к опросу, а доля,
+        которая связке с немногими источниками не нужна, достаётся остальным
+        (не меньше одной загрузки на связку).
+        """
+        demand = Counter(name for item in due for name in item[3])
+        weights = {name: max(fair_shares["fetch"].weight_of(name), 1e-6) for name in demand}
+        quotas = {}
+        remaining, active = budget, set(demand)
+        while active:
+            total = sum(weights[name] for name in active)
+            satisfied = {name for name in active if demand[name] <= remaining * weights[name] / total}
+            if not satisfied:
+                quotas.update({name: max(1, int(remaining * weights[name] / total)) for name in active})
+                break
+            for name in satisfied:
+                quotas[name] = demand[name]
+                remaining -= demand[name]
+            active -= satisfied
+        return quotas
+
+    async def poll_once(self):
+        """
+        Один проход по источникам: сбор новостей с тех, которые планировщик
+        считает готовыми к опросу, и постановка их в очередь модерации.
+        Конфигурация перечитывается, только если хранилище связок изменилось.
+        Источники старших полос приоритета опрашиваются первыми, внутри полосы
+        связки чередуются по весам. Загрузки связки сверх её доли
+        FETCHES_PER_CYCLE (fetch_quotas) переносятся на следующий проход:
+        её источники остаются готовыми к опросу.
+        """
+        cycle_started = time.perf_counter()
+        self.watcher.refresh()
+        queued = self.queue.depth_by_linkage(MODERATION_QUEUE)
+
+        active_linkages = set()
+        for linkage_name, linkage_data in self.watcher.linkages.items():
+            if not is_ready_linkage(linkage_name, linkage_data):
+                continue
+
+            if is_ingest_paused(linkage_data, queued.get(linkage_name, 0)):
+                logger.info(f"Очередь модерации связки '{linkage_name}' заполнена, сбор новостей приостановлен.")
+                metrics.inc("polls_paused_total", linkage=linkage_name)
+                continue
+            active_linkages.add(linkage_name)
+
+        due = []
+        for url, job in self.sources.items():
+            linkage_names = [name for name in job if name in active_linkages]
+            if linkage_names:
+                due.append((LANE_RANK[self.source_lane(url, linkage_names)], url, job, linkage_names))
+
+        quotas = self.fetch_quotas(due)
+        fetches = Counter()
+        for rank, url, job, linkage_names in self.fair_order(due):
+            pinned = min((interval for interval in job.values() if interval), default=None)
+            ceiling = LANE_MAX_POLL_INTERVAL.get(LANES[rank])
+            is_due = self.scheduler.is_due(url, pinned, ceiling)
+            if is_due and not host_health.is_available(url):
+                is_due = False
+                metrics.inc("polls_quarantined_total", source=url)
+            if not is_due:
+                for linkage_name in linkage_names:
+                    metrics.inc("polls_skipped_total", linkage=linkage_name, source=url)
+                continue
+
+            throttled = [name for name in linkage_names if fetches[name] >= quotas[name]]
+            for linkage_name in throttled:
+                metrics.inc("polls_throttled_total", linkage=linkage_name, source=url)
+            linkage_names = [name for name in linkage_names if name not in throttled]
+            if not linkage_names:
+                continue
+
+            new_items = 0
+            failed = False
+            retry_after = None
+            for linkage_name in linkage_names:
+                try:
+                    fetches[linkage_name] += 1
+                    fair_shares["fetch"].charge(linkage_name)
+                    news_list = await self.fetch_resource(url, linkage_name)
+                except SourceError as e:
+                    # retry_after есть у ошибок, которые говорят не о сбое источника, а о том,
+                    # что опросить его сейчас нечем (все сессии парсера в FloodWait).
+                    retry_after = getattr(e, "retry_after", None)
+                    if retry_after is None:
+                        logger.error(f"Источник '{url}' связки '{linkage_name}' недоступен: {e}")
+                        failed = True
+                    else:
+                        logger.warning(f"Опрос источника '{url}' отложен на {retry_after:.0f} с: {e}")
+                    break
+                except Exception as e:
+                    logger.error(f"Ошибка обработки ресурса '{url}' связки '{linkage_name}': {e}")
+                    continue
+                new_items += len(news_list)
+                try:
+                    self.enqueue(linkage_name, news_list)
+                except Exception as e:
+                    logger.error(f"Ошибка передачи новостей ресурса '{url}' связки '{linkage_name}' в модерацию: {e}")
+
+            try:
+                if retry_after is not None:
+                    self.scheduler.defer(url, retry_after)
+                elif failed:
+                    self.scheduler.record_error(url, pinned)
+                else:
+                    self.scheduler.record_result(url, new_items, pinned, ceiling)
+            except Exception as e:
+                logger.error(f"Ошибка обновления расписания источника '{url}': {e}")
+        try:
+            self.scheduler.save()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние планировщика: {e}")
+
+        metrics.observe("poll_cycle_seconds", time.perf_counter() - cycle_started)
+
+    def enqueue(self, linkage_name, news_list):
+        """Пропускает новости через фильтры связки и ставит прошедшие в очередь модерации."""
+        for news in news_list:
+            if self.passes_filters(linkage_name, news):
+                self.lanes.get(linkage_name, LaneClassifier()).assign(news)
+                self.queue.put(MODERATION_QUEUE, {"linkage_name": linkage_name, "news": news})
+
+    async def run(self):
+        """Основной цикл опроса источников. Ошибка одного прохода не останавливает опрос."""
+        while True:
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("Ошибка прохода опроса источников.")
+            await asyncio.sleep(CHECK_INTERVAL)
+
+
+class TransformWorker:
+    """
+    Обрабатывает принятые модератором новости GPT и передаёт их на публикацию.
+    Если та же новость ждёт преобразования и в других связках, все они
+    обрабатываются одним запросом с несколькими промптами.
+    """
+
+    def __init__(self, queue, worker_id=None, watcher=None):
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id("transform")
+        self.watcher = watcher or LinkageWatcher()
+
+    async def handle(self, payload):
+        news = payload["news"]
+        self.watcher.refresh()
+        if not news.get("transformed"):
+            siblings = await self.queue.call(self.queue.claim_matching, TRANSFORM_QUEUE, self.worker_id,
+                                                 news.text_hash)
+            if siblings:
+                await self.handle_group(payload, siblings)
+                return
+        await self.handle_single(payload)
+
+    async def handle_group(self, payload, siblings):
+        """Преобразует новость для нескольких связок одним запросом; задачи-попутчики подтверждаются здесь же."""
+        payloads = [payload] + [job["payload"] for job in siblings]
+        try:
+            pending = [p for p in payloads if not p["news"].get("transformed")]
+            targets = []
+            for p in pending:
+                linkage = self.watcher.linkages.get(p["linkage_name"], {})
+                targets.append((p["linkage_name"], linkage, linkage.get("prompt", gpt_style_translation.default_prompt)))
+
+            with metrics.timer("gpt_transform", payload["linkage_name"], payload["news"].get("src")):
+                outputs = await gpt_style_translation.transform_text_gpt_multi(payload["news"]["txt"], targets)
+            for p, text in zip(pending, outputs):
+                p["news"]["transformed"] = text
+            logger.info(f"Новость ID {payload['news']['id']} преобразована одним запросом для "
+                        f"{len(pending)} связок.")
+
+            await self.queue.call(self.queue.put_many, PUBLISH_QUEUE, [
+                {"linkage_name": p["linkage_name"], "news": p["news"], "text": p["news"].pop("transformed")}
+                for p in payloads
+            ])
+        except Exception:
+            for job in siblings:
+                await self.queue.call(self.queue.nack, job["id"], job["attempts"])
+            raise
+        for job in siblings:
+            await self.queue.call(self.queue.ack, job["id"])
+
+    async def handle_single(self, payload):
+        news = payload["news"]
+        linkage_name = payload["linkage_name"]
+        linkage = self.watcher.linkages.get(linkage_name, {})
+        custom_prompt = linkage.get("prompt", gpt_style_translation.default_prompt)
+
+        translated_text = news.get("transformed")
+        if translated_text:
+            # Текст уже получен потоковым предпросмотром в карточке модерации.
+            logger.debug(f"Новость ID {news['id']} публикуется с текстом предпросмотра.")
+        else:
+            with metrics.timer("gpt_transform", linkage_name, news.get("src")):
+                translated_text = await gpt_style_translation.transform_text_gpt(
+                    news['txt'], custom_prompt, linkage_name, linkage)
+
+        await self.queue.call(self.queue.put, PUBLISH_QUEUE,
+                              {"linkage_name": linkage_name, "news": news, "text": translated_text})
+
+    async def run_once(self):
+        return await consume(self.queue, TRANSFORM_QUEUE, self.handle, self.worker_id, stop_when_empty=True)
+
+    async def run(self):
+        await consume(self.queue, TRANSFORM_QUEUE, self.handle, self.worker_id)
+
+
+async def run_worker(args):
+    queue = WorkQueue()
+    recover_linkages()
+    try:
+        await start_metrics_server(METRICS_HOST, args.metrics_port)
+    except OSError as e:
+        logger.error(f"Не удалось запустить эндпоинт метрик на порту {args.metrics_port}: {e}")
+
+    if args.role == "ingest":
+        from rss_parser import NewsFetcher
+        from tg_parser import TelegramParser
+
+        worker = IngestWorker(queue, NewsFetcher(), TelegramParser(API_ID, API_HASH),
+                              worker_index=args.worker_index, worker_count=args.worker_count)
+        logger.info(f"Ingest-воркер {args.worker_index + 1}/{args.worker_count} запущен.")
+    else:
+        worker = TransformWorker(queue)
+        logger.info("Transform-воркер запущен.")
+    await asyncio.gather(worker.run(), loop_watchdog.run(), gpt_usage.run_flusher())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркеры конвейера новостей.")
+    parser.add_argument("role", choices=["ingest", "transform"])
+    parser.add_argument("--worker-index", type=int, default=0, help="Номер ingest-воркера (с нуля).")
+    parser.add_argument("--worker-count", type=int, default=1, help="Общее число ingest-воркеров.")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT + 1,
+                        help="Порт эндпоинта метрик этого процесса.")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(f"{args.role}_debug.log", encoding="utf-8"),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+    asyncio.run(run_worker(args))
+
+
+if __name__ == "__main__":
+    main()